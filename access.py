@@ -0,0 +1,56 @@
+from collections import namedtuple
+from functools import wraps
+from flask import g, session, flash, redirect, url_for, jsonify
+
+Identity = namedtuple('Identity', 'id username role full_name')
+
+DENIED_MESSAGES = {
+    None: 'Please log in first.',
+    'admin': 'Access denied. Admins only.',
+    'user': 'Access denied.',
+}
+
+
+def start_session(user):
+    session.clear()
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+    session['user_id'] = user.id
+    session['username'] = user.username
+    session['role'] = user.role
+    session['full_name'] = user.full_name
+
+
+def end_session():
+    session.clear()
+    if hasattr(session, 'regenerate'):
+        # the old id is deleted from the store rather than kept around empty
+        session.regenerate()
+
+
+def current_identity():
+    # read from the session once per request; no user query needed
+    if 'identity' not in g:
+        user_id = session.get('user_id')
+        g.identity = Identity(
+            user_id,
+            session.get('username'),
+            session.get('role'),
+            session.get('full_name'),
+        ) if user_id else None
+    return g.identity
+
+
+def login_required(role=None, api=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            identity = current_identity()
+            if identity is None or (role and identity.role != role):
+                if api:
+                    return jsonify({'error': 'forbidden'}), 403
+                flash(DENIED_MESSAGES[role])
+                return redirect(url_for('auth.login'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -1,15 +1,44 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, session, abort, request
-from models import db, Lot, Spot, Reservation, User
-from datetime import datetime
+from flask import Blueprint, render_template, redirect, url_for, flash, abort, request, Response, stream_template, stream_with_context, jsonify
+from models import db, Lot, Spot, Reservation, ReservationArchive, User, Vehicle, LotRollup, Booking
+from sqlalchemy import select, func, or_, and_
+from access import login_required
+from spots import spot_index, add_spots, remove_spots, spots_changed
+from history import history_query, history_page, history_stream, parse_date
+from export import export_query, iter_csv
+from billing import running_charges, tariff_for, parse_tariff
+from rollups import lot_trend, ROLLUP_PERIODS, TREND_DAYS
+from stats import forget_lot_stats
+from lot_search import lot_search_index
+from schedule import booking_index, LIVE_BOOKINGS
+from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+USERS_PAGE_SIZE = 50
+LOT_VEHICLES_PAGE_SIZE = 100
+
+
+def prefix_match(column, text):
+    # a range on lower(column) instead of LIKE '%...%', so the search walks
+    # the expression index rather than every row
+    prefix = text.lower()
+    lowered = func.lower(column)
+    return and_(lowered >= prefix, lowered < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def parse_coordinates(form):
+    latitude = form.get('latitude', '').strip()
+    longitude = form.get('longitude', '').strip()
+    if not latitude and not longitude:
+        return None, None
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('latitude/longitude out of range')
+    return latitude, longitude
+
 @admin_bp.route('/parking_lot/create', methods=['GET', 'POST'])
+@login_required('admin')
 def create_parking_lot():
-    if session.get('role') != 'admin':
-        flash('Access denied.')
-        return redirect(url_for('auth.login'))
-
     if request.method == 'POST':
         location_name = request.form.get('location_name')
         price = request.form.get('price')
@@ -18,24 +47,23 @@ def create_parking_lot():
         max_spots = request.form.get('max_spots')
 
         try:
+            latitude, longitude = parse_coordinates(request.form)
             new_lot = Lot(
                 location_name=location_name,
                 price=float(price),
                 address=address,
                 pin_code=pin_code,
-                max_spots=int(max_spots)
+                max_spots=int(max_spots),
+                latitude=latitude,
+                longitude=longitude,
             )
             db.session.add(new_lot)
             db.session.flush()
-            i = 0
-            while i <= int(max_spots):
-                new_spot = Spot(
-                    lot_id = new_lot.lot_id,
-                    status = 'A'
-                )
-                db.session.add(new_spot)
-                i += 1
+            add_spots(new_lot.lot_id, new_lot.max_spots)
             db.session.commit()
+            spot_index.reload(new_lot.lot_id)
+            spots_changed(new_lot.lot_id)
+            lot_search_index.invalidate(new_lot.lot_id)
             
             flash('Parking lot created successfully.')
             return redirect(url_for('admin_dashboard'))
@@ -48,47 +76,49 @@ def create_parking_lot():
 
 
 @admin_bp.route('/lot/<int:lot_id>')
+@login_required('admin')
 def lot_list(lot_id):
-    if session.get('role') != 'admin':
-        flash('Access denied. Admins only.')
-        return redirect(url_for('auth.login'))
-
     lot = Lot.query.get(lot_id)
     if not lot:
         abort(404)
 
-    spots = Spot.query.filter_by(lot_id=lot_id).all()
-
-    lot_vehicles = []
-    for spot in spots:
-        if spot.status == 'O':
-            reservation = Reservation.query.filter_by(spot_id=spot.spot_id).first()
-            username = reservation.user.username
-            vehicle = reservation.vehicle.v_number
-            details = reservation.vehicle.details
-            parked_at = reservation.parking_timestamp
-            time_parked = datetime.utcnow() - parked_at
-            minutes_parked = max(int(time_parked.total_seconds() / 60), 0)
-    
-            revenue = round(minutes_parked * lot.price, 2)
-    
-            lot_vehicles.append({
-                'vehicle_number': vehicle,
-                'username': username,
-                'details': details,
-                'parked_at': parked_at,
-                'minutes_parked': minutes_parked,
-                'revenue': revenue
-            })
-
-    return render_template('lot_list.html', lot=lot, lot_vehicles=lot_vehicles)
+    after = request.args.get('after', type=int)
+    query = (
+        db.session.query(
+            Reservation.r_id,
+            Reservation.parking_timestamp,
+            User.username,
+            Vehicle.v_number,
+            Vehicle.details,
+        )
+        .join(User, User.id == Reservation.user_id)
+        .join(Vehicle, Vehicle.v_id == Reservation.vehicle_id)
+        .filter(Reservation.lot_id == lot_id, Reservation.leaving_timestamp.is_(None))
+    )
+    if after:
+        query = query.filter(Reservation.r_id > after)
+    rows = query.order_by(Reservation.r_id).limit(LOT_VEHICLES_PAGE_SIZE + 1).all()
+    next_after = rows[LOT_VEHICLES_PAGE_SIZE - 1].r_id if len(rows) > LOT_VEHICLES_PAGE_SIZE else None
+    rows = rows[:LOT_VEHICLES_PAGE_SIZE]
+
+    minutes, revenues = running_charges([row.parking_timestamp for row in rows], tariff_for(lot), datetime.utcnow())
+    lot_vehicles = [
+        {
+            'vehicle_number': row.v_number,
+            'username': row.username,
+            'details': row.details,
+            'parked_at': row.parking_timestamp,
+            'minutes_parked': minutes_parked,
+            'revenue': revenue,
+        }
+        for row, minutes_parked, revenue in zip(rows, minutes, revenues)
+    ]
+
+    return render_template('lot_list.html', lot=lot, lot_vehicles=lot_vehicles, next_after=next_after)
 
 @admin_bp.route('/lot/<int:lot_id>/edit', methods=['GET', 'POST'])
+@login_required('admin')
 def edit_parking_lot(lot_id):
-    if session.get('role') != 'admin':
-        flash('Access denied. Admins only.')
-        return redirect(url_for('auth.login'))
-
     lot = Lot.query.get(lot_id)
     if not lot:
         flash('Parking lot not found.')
@@ -99,69 +129,62 @@ def edit_parking_lot(lot_id):
             new_max_spots = int(request.form['max_spots'])
             new_price = float(request.form['price'])
             new_address = request.form['address'].strip()
-        except (ValueError, KeyError):
+            new_latitude, new_longitude = parse_coordinates(request.form)
+            new_tariff = request.form.get('tariff', '').strip() or None
+            parse_tariff(new_price, new_tariff)
+        except (ValueError, KeyError, TypeError):
             flash('Invalid input detected. Please check your entries.')
             return render_template('edit_lot.html', lot=lot)
 
         
         lot.price = new_price
         lot.address = new_address
+        lot.latitude = new_latitude
+        lot.longitude = new_longitude
+        lot.tariff = new_tariff
 
         
         if new_max_spots > lot.max_spots:
             num_new_spots = new_max_spots - lot.max_spots
-            for _ in range(num_new_spots):
-                new_spot = Spot(lot_id=lot.lot_id, status='A')
-                db.session.add(new_spot)
+            add_spots(lot.lot_id, num_new_spots)
             lot.max_spots = new_max_spots
             db.session.commit()
+            spot_index.reload(lot.lot_id)
+            spots_changed(lot.lot_id)
             flash(f'Lot updated successfully. {num_new_spots} new spot(s) added.')
 
         
         elif new_max_spots < lot.max_spots:
             to_remove = lot.max_spots - new_max_spots
 
-            
-            available_spots = Spot.query.filter_by(lot_id=lot.lot_id, status='A').all()
-
-            spots_to_delete = []
-            for spot in available_spots:
-                
-                related_reservations = Reservation.query.filter_by(spot_id=spot.spot_id).all()
-                for res in related_reservations:
-                    db.session.delete(res)
-                spots_to_delete.append(spot)
-                if len(spots_to_delete) == to_remove:
-                    break
-
-            if len(spots_to_delete) < to_remove:
-                flash('Cannot reduce spots: not enough available spots that can be deleted. Some spots may be occupied or have reservations.')
+            if not remove_spots(lot.lot_id, to_remove):
+                db.session.rollback()
+                flash('Cannot reduce spots: not enough available spots that can be deleted. Some spots may be occupied, booked or have unpaid reservations.')
                 return render_template('edit_lot.html', lot=lot)
 
             
-            for spot in spots_to_delete:
-                db.session.delete(spot)
-
-            
             lot.max_spots = new_max_spots
             db.session.commit()
-            flash(f'Lot updated successfully. {to_remove} spot(s) and related reservations removed.')
+            spot_index.reload(lot.lot_id)
+            spots_changed(lot.lot_id)
+            flash(f'Lot updated successfully. {to_remove} spot(s) removed; their past reservations were archived.')
 
         else:
             
             db.session.commit()
+            spots_changed(lot.lot_id)
             flash('Lot details updated.')
 
+        lot_search_index.invalidate(lot.lot_id)
+        booking_index.invalidate(lot.lot_id)
         return redirect(url_for('admin.lot_list', lot_id=lot.lot_id))
 
     
     return render_template('edit_lot.html', lot=lot)
 
 @admin_bp.route('/lot/<int:lot_id>/delete', methods=['GET','POST'])
+@login_required('admin')
 def delete_parking_lot(lot_id):
-    if session.get('role') != 'admin':
-        flash('Access denied. Admins only.')
-        return redirect(url_for('auth.login'))
     
     lot = Lot.query.get(lot_id)
     if not lot:
@@ -173,17 +196,24 @@ def delete_parking_lot(lot_id):
         if active_reservation:
             flash('you cannot delete the lot. Still occupied.')
             return redirect(url_for('admin.lot_list', lot_id=lot_id))
+        live_booking = Booking.query.filter(Booking.lot_id == lot_id, Booking.status.in_(LIVE_BOOKINGS)).first()
+        if live_booking:
+            flash('you cannot delete the lot. It has upcoming bookings.')
+            return redirect(url_for('admin.lot_list', lot_id=lot_id))
         
-        reservations = Reservation.query.filter_by(lot_id=lot_id)
-        for res in reservations:
-            db.session.delete(res)
-        
-        spots = Spot.query.filter_by(lot_id=lot_id)
-        for spot in spots:
-            db.session.delete(spot)
+        forget_lot_stats(lot_id)
+        Reservation.query.filter_by(lot_id=lot_id).delete(synchronize_session=False)
+        ReservationArchive.query.filter_by(lot_id=lot_id).delete(synchronize_session=False)
+        Booking.query.filter_by(lot_id=lot_id).delete(synchronize_session=False)
+        LotRollup.query.filter_by(lot_id=lot_id).delete(synchronize_session=False)
+        Spot.query.filter_by(lot_id=lot_id).delete(synchronize_session=False)
 
         db.session.delete(lot)
         db.session.commit()
+        spot_index.drop(lot_id)
+        spots_changed(lot_id)
+        lot_search_index.invalidate(lot_id)
+        booking_index.invalidate(lot_id)
 
     return redirect(url_for('admin_dashboard'))
 
@@ -215,55 +245,84 @@ def search_spot():
     return render_template('spot.html', info=info, lot=lot)
 
 @admin_bp.route('/users')
+@login_required('admin')
 def view_users():
-    if session.get('role') != 'admin':
-        flash('Access denied. Admins only.')
-        return redirect(url_for('auth.login'))
-
-    
-    users = User.query.filter(User.role != 'admin').all()
-
-    
-    users_data = []
-    for user in users:
-        vehicle_count = len(user.vehicles) if user.vehicles else 0
-        
-        active_spots_count = Reservation.query.filter_by(user_id=user.id, leaving_timestamp=None).count()
-        users_data.append({
-            'username': user.username,
-            'full_name': user.full_name,
-            'vehicle_count': vehicle_count,
-            'active_spots': active_spots_count
-        })
-
-    return render_template('users.html', users=users_data)
+    search = request.args.get('q', '').strip()
+    after = request.args.get('after', type=int)
+
+    vehicle_count = (
+        select(func.count(Vehicle.v_id))
+        .where(Vehicle.user_id == User.id)
+        .scalar_subquery()
+    )
+    active_spots_count = (
+        select(func.count(Reservation.r_id))
+        .where(Reservation.user_id == User.id, Reservation.leaving_timestamp.is_(None))
+        .scalar_subquery()
+    )
+    query = db.session.query(
+        User.id,
+        User.username,
+        User.full_name,
+        vehicle_count.label('vehicle_count'),
+        active_spots_count.label('active_spots'),
+    ).filter(User.role != 'admin')
+    if search:
+        query = query.filter(or_(prefix_match(User.username, search), prefix_match(User.full_name, search)))
+    if after:
+        query = query.filter(User.id > after)
+
+    rows = query.order_by(User.id).limit(USERS_PAGE_SIZE + 1).all()
+    next_after = rows[USERS_PAGE_SIZE - 1].id if len(rows) > USERS_PAGE_SIZE else None
+    users_data = [row._asdict() for row in rows[:USERS_PAGE_SIZE]]
+
+    return render_template('users.html', users=users_data, search=search, next_after=next_after)
 
 
 @admin_bp.route('/parking_history',methods=['GET','POST'])
+@login_required('admin')
 def parking_history():
-    
-    history=[]
-    if session.get('role') != 'admin':
-        flash('Access denied. Admins only.')
-        return redirect(url_for('admin.dashboard'))
-    
-    reservations = Reservation.query.filter_by()
-
-    for res in reservations:
-        parktime = res.parking_timestamp
-        leavetime = res.leaving_timestamp
-        amount = res.amount
-        status = res.payment_status
-        user_details = User.query.filter_by(id = res.user_id).first()
-        u_name = user_details.full_name
-        u_username = user_details.username
-        history.append({
-            "full_name": u_name,
-            "username": u_username,
-            "parking_time": parktime,
-            "leaving_time": leavetime,
-            "amount": amount,
-            "status": status
-        })
-
-    return render_template('history.html',reservation=history)
\ No newline at end of file
+    filters = {
+        'lot_id': request.args.get('lot_id', type=int),
+        'username': request.args.get('user', '').strip(),
+        'date_from': parse_date(request.args.get('from')),
+        'date_to': parse_date(request.args.get('to')),
+    }
+    args = {key: value for key, value in request.args.items() if key not in ('before', 'stream') and value}
+    lots = Lot.query.order_by(Lot.location_name).all()
+
+    if request.args.get('stream'):
+        # whole filtered history, rendered row by row without holding it in memory
+        query = history_query(**filters)
+        return Response(stream_template('history.html', reservation=history_stream(query), lots=lots, args=args, streaming=True))
+
+    query = history_query(before=request.args.get('before', type=int), **filters)
+    history, next_before = history_page(query)
+    return render_template('history.html', reservation=history, lots=lots, args=args, next_before=next_before)
+
+
+@admin_bp.route('/export/reservations.csv')
+@login_required('admin')
+def export_reservations():
+    query = export_query(
+        since_id=request.args.get('since_id', type=int),
+        since=parse_date(request.args.get('since')),
+    )
+    response = Response(stream_with_context(iter_csv(query)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=reservations.csv'
+    return response
+
+
+@admin_bp.route('/trends.json')
+@login_required('admin', api=True)
+def trends():
+    period = request.args.get('period', 'day')
+    if period not in ROLLUP_PERIODS:
+        abort(400)
+    days = min(max(request.args.get('days', TREND_DAYS, type=int), 1), 366)
+    since = datetime.utcnow() - timedelta(days=days)
+    trend = lot_trend(request.args.get('lot_id', type=int), period, since)
+    return jsonify({
+        'period': period,
+        'buckets': [dict(row, bucket=row['bucket'].isoformat()) for row in trend],
+    })
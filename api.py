@@ -0,0 +1,95 @@
+import hmac
+from flask import Blueprint, request, jsonify, abort, Response, current_app
+from snapshot import lot_snapshot, SNAPSHOT_TTL
+from events import create_feed, occupancy_stream, FeedFull, KEEPALIVE_INTERVAL
+from gate import apply_gate_events, MAX_GATE_BATCH
+from lot_search import lot_search_index, DEFAULT_RESULTS, MAX_RESULTS
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+occupancy_feed = create_feed(lot_snapshot)
+
+
+def conditional_json(data, etag, last_modified):
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = SNAPSHOT_TTL
+    return response.make_conditional(request)
+
+
+@api_bp.route('/lots')
+def lots_availability():
+    snapshot = lot_snapshot.get()
+    data = {'lots': list(snapshot['lots'].values()), 'last_modified': snapshot['last_modified'].isoformat()}
+    return conditional_json(data, snapshot['etag'], snapshot['last_modified'])
+
+
+@api_bp.route('/lots/<int:lot_id>')
+def lot_availability(lot_id):
+    snapshot = lot_snapshot.get()
+    lot = snapshot['lots'].get(lot_id)
+    if not lot:
+        abort(404)
+    return conditional_json(lot, snapshot['etags'][lot_id], snapshot['last_modified'])
+
+
+@api_bp.route('/lots/stream')
+def lots_stream():
+    app = current_app._get_current_object()
+    try:
+        q, current = occupancy_feed.subscribe(app, app.config['SSE_MAX_SUBSCRIBERS'])
+    except FeedFull:
+        response = jsonify({'error': 'too many live displays on this server, retry shortly'})
+        response.headers['Retry-After'] = str(KEEPALIVE_INTERVAL)
+        return response, 503
+    response = Response(occupancy_stream(occupancy_feed, q, current), mimetype='text/event-stream')
+    # a client gone before the first event never starts the generator
+    response.call_on_close(lambda: occupancy_feed.unsubscribe(q))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_bp.route('/gate/events', methods=['POST'])
+def gate_events():
+    key = current_app.config.get('GATE_API_KEY')
+    given = request.headers.get('X-Gate-Key', '')
+    if not key or not hmac.compare_digest(given.encode(), key.encode()):
+        return jsonify({'error': 'forbidden'}), 403
+
+    payload = request.get_json(silent=True) or {}
+    events = payload.get('events')
+    if not isinstance(events, list) or not all(isinstance(ev, dict) for ev in events):
+        return jsonify({'error': 'expected {"events": [...]}'}), 400
+    if len(events) > MAX_GATE_BATCH:
+        return jsonify({'error': f'at most {MAX_GATE_BATCH} events per batch'}), 413
+
+    results = apply_gate_events(events)
+    if results is None:
+        return jsonify({'error': 'busy, retry the batch'}), 503
+    return jsonify({'results': results})
+
+
+@api_bp.route('/lots/search')
+def lots_search():
+    k = min(max(request.args.get('k', DEFAULT_RESULTS, type=int), 1), MAX_RESULTS)
+    options = {
+        'k': k,
+        'max_price': request.args.get('max_price', type=float),
+        'include_full': request.args.get('include_full') == '1',
+    }
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    pin = request.args.get('pin', '').strip()
+
+    if latitude is not None and longitude is not None:
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return jsonify({'error': 'lat/lon out of range'}), 400
+        results = lot_search_index.by_location(latitude, longitude, **options)
+    elif pin:
+        results = lot_search_index.by_pin(pin, **options)
+    else:
+        return jsonify({'error': 'expected pin or lat and lon'}), 400
+    return jsonify({'lots': results})
@@ -1,31 +1,57 @@
-import bcrypt
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from models import db, User, Lot, Spot, Reservation, Vehicle
+from flask import Flask, render_template, request, redirect, url_for
+from models import db, Reservation
 from auth import auth_bp
 from user import user_bp
 from admin import admin_bp
-from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import io
-import base64
+from api import api_bp
+from stats import lot_stats, dashboard_totals, user_totals, recent_reservations, recent_durations, backfill_user_stats_command
+from spots import spot_index, check_spots_command
+from sqlalchemy import inspect
+from charts import chart_cache, chart_response
+from export import export_reservations_command
+from migrations import upgrade, db_upgrade_command
+from gate import ingest_gate_events_command
+from archive import archive_reservations_command
+from rollups import lot_trend, rebuild_rollups_command
+from billing import reprice_reservations_command
+from config import load_config, apply_sqlite_pragmas
+from profiling import init_profiling
+from sessions import init_sessions
+from bookings import init_bookings, upcoming_bookings, expire_bookings_command
+from access import login_required, current_identity
 
 
 app = Flask(__name__)
-app.secret_key = 'your_secret_key'
 
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///parking_app.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+load_config(app)
+init_sessions(app)
+init_profiling(app)
+init_bookings(app)
 
 
 db.init_app(app)
 app.register_blueprint(auth_bp)
 app.register_blueprint(user_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(api_bp)
 
+with app.app_context():
+    apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    if inspect(db.engine).has_table('spots'):
+        upgrade(db.engine)
+        spot_index.rebuild()
+
+
+app.cli.add_command(export_reservations_command)
+app.cli.add_command(db_upgrade_command)
+app.cli.add_command(backfill_user_stats_command)
+app.cli.add_command(ingest_gate_events_command)
+app.cli.add_command(archive_reservations_command)
+app.cli.add_command(rebuild_rollups_command)
+app.cli.add_command(reprice_reservations_command)
+app.cli.add_command(expire_bookings_command)
+app.cli.add_command(check_spots_command)
 
 
 @app.route('/')
@@ -34,165 +60,106 @@ def home():
 
 
 
-@app.route('/admin/dashboard')
-def admin_dashboard():
-    if session.get('role') != 'admin':
-        flash('Admin login required.')
-        return redirect(url_for('auth.login'))
-
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) 
-    name = user.full_name 
-    parking_lots = Lot.query.all()
-
-    total_spots_occupied = 0
-    total_spots = 0
-    total_revenue_per_minute = 0.0
-
-    lots_data = []
-    for lot in parking_lots:
-        occupied_spots_count = Spot.query.filter_by(lot_id=lot.lot_id, status='O').count()
-        max_spots = lot.max_spots
-        total_spots_occupied += occupied_spots_count
-        total_spots += max_spots
-        lot_revenue = lot.price * occupied_spots_count
-        total_revenue_per_minute += lot_revenue
-
-        lots_data.append({
-            'id': lot.lot_id,
-            'location_name': lot.location_name,
-            'pin_code': lot.pin_code,
-            'occupied': occupied_spots_count,
-            'max_spots': max_spots
-        })
-
-    occupancy_percent = (total_spots_occupied / total_spots * 100) if total_spots else 0
-
-    parking_lots = Lot.query.all()
-    lot_names = []
-    occupied_counts = []
-    revenues = []
-
-    for lot in parking_lots:
-        lot_names.append(lot.location_name)
-        occ = Spot.query.filter_by(lot_id=lot.lot_id, status='O').count()
-        occupied_counts.append(occ)
-        rev = lot.price * occ
-        revenues.append(rev)
-
-    
-    pie_img = None
+def admin_chart_specs(lots_data):
+    lot_names = [lot['location_name'] for lot in lots_data]
+    occupied_counts = [lot['occupied'] for lot in lots_data]
+    revenues = [lot['revenue_per_minute'] for lot in lots_data]
+
+    specs = {}
     if lot_names and sum(occupied_counts) > 0:
-        fig1, ax1 = plt.subplots(figsize=(5,5))
-        ax1.pie(occupied_counts, labels=lot_names, autopct='%1.1f%%', startangle=90)
-        ax1.set_title('Occupied Spots Distribution')
-        buf = io.BytesIO()
-        plt.tight_layout()
-        fig1.savefig(buf, format='png')
-        buf.seek(0)
-        pie_img = base64.b64encode(buf.read()).decode('ascii')
-        plt.close(fig1)
-
-    
-    bar_img = None
+        specs['pie'] = {'labels': lot_names, 'values': occupied_counts}
     if lot_names and revenues:
-        fig2, ax2 = plt.subplots(figsize=(6,4))
-        ax2.bar(lot_names, revenues, color='#27ae60')
-        ax2.set_ylabel('Revenue')
-        ax2.set_xlabel('Parking Lot')
-        ax2.set_title('Revenue by Lot')
-        plt.tight_layout()
-        buf = io.BytesIO()
-        fig2.savefig(buf, format='png')
-        buf.seek(0)
-        bar_img = base64.b64encode(buf.read()).decode('ascii')
-        plt.close(fig2)
+        specs['bar'] = {'labels': lot_names, 'values': revenues}
+    trend = lot_trend()
+    if trend:
+        specs['trend'] = {
+            'days': [row['bucket'] for row in trend],
+            'occupancy': [row['occupancy_percent'] for row in trend],
+            'revenue': [row['revenue'] for row in trend],
+        }
+    return specs
+
+
+def duration_chart_spec(reservations):
+    times = []
+    durations = []
+    for res in reservations:
+        if res.leaving_timestamp:
+            times.append(res.parking_timestamp)
+            duration_min = (res.leaving_timestamp - res.parking_timestamp).total_seconds() / 60
+            durations.append(duration_min)
+    if not times:
+        return None
+    return {'times': times, 'durations': durations}
+
+
+@app.route('/admin/dashboard')
+@login_required('admin')
+def admin_dashboard():
+    admin = current_identity()
+
+    lots_data = lot_stats()
+    totals = dashboard_totals(lots_data)
 
+    specs = admin_chart_specs(lots_data)
+    chart_keys = {kind: chart_cache.prefetch(kind, data) for kind, data in specs.items()}
 
     return render_template(
         'admin_dashboard.html',
-        username=session.get('username', 'admin'),
-        name=name,
-        spots_occupied=total_spots_occupied,
-        occupancy_percent=round(occupancy_percent, 2),
-        revenue_per_minute=round(total_revenue_per_minute, 2),
+        username=admin.username or 'admin',
+        name=admin.full_name,
+        spots_occupied=totals['spots_occupied'],
+        occupancy_percent=totals['occupancy_percent'],
+        revenue_per_minute=totals['revenue_per_minute'],
         parking_lots=lots_data,
-        pie_img=pie_img,
-        bar_img=bar_img,
+        pie_chart=chart_keys.get('pie'),
+        bar_chart=chart_keys.get('bar'),
+        trend_chart=chart_keys.get('trend'),
     )
 
 
+@app.route('/admin/dashboard/charts/<kind>.png')
+@login_required('admin', api=True)
+def admin_dashboard_chart(kind):
+    specs = admin_chart_specs(lot_stats())
+    return chart_response(kind, specs.get(kind))
+
+
 @app.route('/user/dashboard')
+@login_required('user')
 def user_dashboard():
-    if session.get('role') != 'user':
-        flash('Access denied.')
-        return redirect(url_for('auth.login'))
-
-    user_id = session.get('user_id')
-    user = User.query.get(user_id)
-    if not user:
-        flash('User not found.')
-        return redirect(url_for('auth.login'))
+    user = current_identity()
+    user_id = user.id
 
     active_reservation = Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first()
     active_spot = active_reservation.spot if active_reservation else None
 
-    reservations = Reservation.query.filter_by(user_id=user_id).order_by(Reservation.parking_timestamp.desc()).all()
-
-    total_time = timedelta()
-    total_paid = 0
-    for res in reservations:
-        if res.leaving_timestamp:
-            total_time += res.leaving_timestamp - res.parking_timestamp
-        if res.payment_status == 'Paid' and res.amount:
-            total_paid += res.amount
+    reservations, next_before = recent_reservations(user_id, before=request.args.get('before', type=int))
+    totals = user_totals(user_id)
 
-    total_minutes = int(total_time.total_seconds() // 60)
-    hours = total_minutes // 60
-    minutes = total_minutes % 60
-
-    total_time_parked = f"{hours}h {minutes:02d}m"
-    total_amount_paid = f"₹{total_paid:.2f}"
-    total_bookings = len(reservations)
-
-    times = []
-    durations = []
-    for res in reservations:
-        if res.leaving_timestamp:  
-            times.append(res.parking_timestamp)  
-            duration_min = (res.leaving_timestamp - res.parking_timestamp).total_seconds() / 60  
-            durations.append(duration_min)
-
-    img_b64 = None
-    if times and durations:
-        fig, ax = plt.subplots(figsize=(10, 4))
-        ax.plot(times, durations, marker='o', color='green', linewidth=2)
-        ax.set_title("Parking Duration per Reservation (minutely)")
-        ax.set_xlabel("Date & Time")
-        ax.set_ylabel("Duration (minutes)")
-        ax.grid(True)
-        
-        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%b %H:%M'))  # e.g., "31-Jul 13:45"
-        fig.autofmt_xdate(rotation=45)
-        plt.tight_layout()
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png')
-        img_b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
+    duration = duration_chart_spec(recent_durations(user_id))
+    duration_chart = chart_cache.prefetch('duration', duration) if duration else None
 
     return render_template(
         'user_dashboard.html',
         user=user,
         active_spot=active_spot,
         reservations=reservations,
+        next_before=next_before,
         active_reservation = active_reservation,
-        total_time_parked=total_time_parked,
-        total_amount_paid=total_amount_paid,
-        total_bookings=total_bookings,
-        duration_line_chart=img_b64,
+        bookings=upcoming_bookings(user_id),
+        total_time_parked=totals['total_time_parked'],
+        total_amount_paid=totals['total_amount_paid'],
+        total_bookings=totals['total_bookings'],
+        duration_line_chart=duration_chart,
     )
 
 
+@app.route('/user/dashboard/charts/duration.png')
+@login_required('user', api=True)
+def user_dashboard_chart():
+    return chart_response('duration', duration_chart_spec(recent_durations(current_identity().id)))
+
+
 if __name__ == '__main__':
     app.run(debug=True)
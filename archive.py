@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, insert, delete, union_all, func
+from models import db, Reservation, ReservationArchive
+
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVED_COLUMNS = [
+    'r_id', 'spot_id', 'lot_id', 'user_id', 'vehicle_id',
+    'parking_timestamp', 'leaving_timestamp', 'amount', 'payment_status',
+]
+
+
+def all_reservations():
+    hot = Reservation.__table__
+    cold = ReservationArchive.__table__
+    return union_all(
+        select(*[hot.c[name] for name in ARCHIVED_COLUMNS]),
+        select(*[cold.c[name] for name in ARCHIVED_COLUMNS]),
+    ).subquery('all_reservations')
+
+
+def move_to_archive(conn, where):
+    hot = Reservation.__table__
+    cold = ReservationArchive.__table__
+    conn.execute(
+        insert(cold).from_select(
+            ARCHIVED_COLUMNS + ['archived_at'],
+            select(*[hot.c[name] for name in ARCHIVED_COLUMNS], db.literal(datetime.utcnow())).where(where),
+        )
+    )
+    conn.execute(delete(hot).where(where))
+
+
+def archive_reservations(older_than, batch_size=ARCHIVE_BATCH_SIZE):
+    hot = Reservation.__table__
+    cutoff = datetime.utcnow() - older_than
+    # SQLite hands out max(r_id) + 1 for new rows, so the newest hot row must
+    # stay put or a fresh reservation could reuse an archived r_id
+    newest = select(func.max(hot.c.r_id)).scalar_subquery()
+    moved = 0
+    while True:
+        # one short transaction per batch so parks and leaves are never blocked for long
+        with db.engine.begin() as conn:
+            ids = conn.execute(
+                select(hot.c.r_id)
+                .where(hot.c.payment_status == 'Paid', hot.c.leaving_timestamp < cutoff, hot.c.r_id < newest)
+                .order_by(hot.c.r_id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            move_to_archive(conn, hot.c.r_id.in_(ids))
+        moved += len(ids)
+    return moved
+
+
+@click.command('archive-reservations')
+@click.option('--days', type=int, help='Archive paid reservations closed more than this many days ago.')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True)
+def archive_reservations_command(days, batch_size):
+    if days is None:
+        days = current_app.config['ARCHIVE_AFTER_DAYS']
+    moved = archive_reservations(timedelta(days=days), batch_size)
+    click.echo(f'Archived {moved} reservation(s) closed more than {days} day(s) ago.')
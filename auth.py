@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from access import start_session, end_session
 from models import db, User, Vehicle
-import bcrypt
+from passwords import (
+    hash_password, check_password, needs_rehash, HashingBusy,
+    login_ip_limiter, login_user_limiter, register_ip_limiter,
+)
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -12,11 +16,22 @@ def register():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip().encode('utf-8')
 
+        if register_ip_limiter.blocked(request.remote_addr):
+            flash('Too many registrations from this address. Try again later.')
+            return render_template('register.html'), 429
+        register_ip_limiter.hit(request.remote_addr)
+
         if User.query.filter_by(username=username).first():
             flash('Username already exists.')
             return render_template('register.html')
+        # hand the connection back to the pool for as long as bcrypt runs
+        db.session.rollback()
 
-        hashed = bcrypt.hashpw(password, bcrypt.gensalt())
+        try:
+            hashed = hash_password(password)
+        except HashingBusy:
+            flash('Server is busy. Please try again.')
+            return render_template('register.html'), 503
         new_user = User(full_name=u_name,username=username, password=hashed, role='user')
         db.session.add(new_user)
         db.session.commit()
@@ -31,22 +46,45 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip().encode('utf-8')
+
+        # rejected before any hashing so floods cannot tie up the bcrypt pool
+        if login_ip_limiter.blocked(request.remote_addr) or login_user_limiter.blocked(username):
+            flash('Too many login attempts. Try again later.')
+            return render_template('index.html'), 429
+        login_ip_limiter.hit(request.remote_addr)
+
         user = User.query.filter_by(username=username).first()
-        if user and bcrypt.checkpw(password, user.password):
-            session['user_id'] = user.id
-            session['username'] = user.username
-            session['role'] = user.role
+        hashed = user.password if user else None
+        # hand the connection back to the pool for as long as bcrypt runs
+        db.session.rollback()
+        try:
+            valid = bool(user) and check_password(password, hashed)
+        except HashingBusy:
+            flash('Server is busy. Please try again.')
+            return render_template('index.html'), 503
+
+        if valid:
+            if needs_rehash(hashed):
+                # cost factor changed since this hash was made; retried on a later login if busy
+                try:
+                    user.password = hash_password(password)
+                    db.session.commit()
+                except HashingBusy:
+                    pass
+            login_user_limiter.reset(username)
+            start_session(user)
             if user.role == 'admin':
                 return redirect(url_for('admin_dashboard'))
             else:
                 return redirect(url_for('user_dashboard'))
         else:
+            login_user_limiter.hit(username)
             flash('Invalid username or password.')
     return render_template('index.html')
 
 
 @auth_bp.route('/logout')
 def logout():
-    session.clear()
+    end_session()
     flash('Logged out successfully.')
     return redirect(url_for('auth.login'))
@@ -0,0 +1,41 @@
+import random
+from datetime import datetime, timedelta
+import click
+from common import time_ms
+
+
+@click.command()
+@click.option('--rows', default='1000,10000,100000', show_default=True, help='Comma-separated stay counts to price.')
+def main(rows):
+    """Repricing closed stays one row at a time against the NumPy batch path, per tariff shape."""
+    import numpy as np
+    from billing import parse_tariff, price_stay, price_stays, stay_minutes
+
+    tariffs = {
+        'flat': parse_tariff(2.0),
+        'units+grace': parse_tariff(1.5, {'grace_minutes': 15, 'unit_minutes': 30}),
+        'slabs+cap': parse_tariff(3.0, {'slabs': [[30, 0.5], [180, 2.0]], 'daily_cap': 400}),
+        'night+cap': parse_tariff(2.0, {'night_price': 0.25, 'night_start': 22, 'night_end': 6, 'daily_cap': 900}),
+    }
+    rng = random.Random(1)
+    first = datetime(2024, 1, 1)
+
+    click.echo(f"{'tariff':>12} {'rows':>8} {'per-row ms':>11} {'batch ms':>9} {'speedup':>8} {'mismatches':>11}")
+    for count in [int(n) for n in rows.split(',')]:
+        parked = [first + timedelta(seconds=rng.randrange(365 * 86400)) for _ in range(count)]
+        left = [p + timedelta(seconds=rng.randrange(3 * 86400)) for p in parked]
+        # the batch path reads timestamps as text, as reprice-reservations does
+        parked_text = [p.isoformat(' ') for p in parked]
+        left_text = [l.isoformat(' ') for l in left]
+
+        for name, tariff in tariffs.items():
+            repeat = 1 if count > 10000 else 3
+            single = time_ms(lambda: [price_stay(tariff, p, l) for p, l in zip(parked, left)], repeat)
+            batch = time_ms(lambda: price_stays(tariff, *stay_minutes(parked_text, left_text)), repeat)
+            expected = np.array([price_stay(tariff, p, l) for p, l in zip(parked, left)])
+            mismatches = int(np.count_nonzero(price_stays(tariff, *stay_minutes(parked_text, left_text)) != expected))
+            click.echo(f'{name:>12} {count:>8} {single:>11.1f} {batch:>9.1f} {single / batch:>7.0f}x {mismatches:>11}')
+
+
+if __name__ == '__main__':
+    main()
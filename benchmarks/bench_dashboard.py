@@ -0,0 +1,38 @@
+import click
+from common import bench_env, fresh_database, seed_lots, add_user, login, count_queries, time_ms
+
+
+@click.command()
+@click.option('--lots', default='10,100,1000', show_default=True, help='Comma-separated lot counts to try.')
+@click.option('--spots', default=20, show_default=True, help='Spots per lot, half of them occupied.')
+def main(lots, spots):
+    """Queries and time per admin dashboard load as the number of lots grows."""
+    bench_env(BCRYPT_ROUNDS=4)
+    from app import app
+    from models import db
+
+    counts = []
+    click.echo(f"{'lots':>6} {'queries':>8} {'ms':>8}")
+    for count in [int(n) for n in lots.split(',')]:
+        fresh_database(app)
+        with app.app_context():
+            seed_lots(count, spots, occupied=spots // 2)
+            add_user('admin', 'admin', role='admin')
+        client = app.test_client()
+        login(client, 'admin', 'admin')
+
+        def load():
+            response = client.get('/admin/dashboard')
+            assert response.status_code == 200, response.status_code
+
+        load()
+        with app.app_context(), count_queries(db.engine) as statements:
+            load()
+        counts.append(len(statements))
+        click.echo(f'{count:>6} {len(statements):>8} {time_ms(load):>8.1f}')
+
+    click.echo('query count constant: ' + ('yes' if len(set(counts)) == 1 else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import click
+from common import bench_env, fresh_database
+
+
+@click.command()
+@click.option('--clients', default='1,8,32', show_default=True, help='Comma-separated concurrent client counts.')
+@click.option('--logins', default=64, show_default=True, help='Logins per run, each as a different user.')
+@click.option('--rounds', default=10, show_default=True, help='bcrypt cost factor (the app default is 12).')
+@click.option('--hash-workers', default=4, show_default=True)
+def main(clients, logins, rounds, hash_workers):
+    """Successful logins per second, and rejections, with many clients logging in at once."""
+    bench_env(BCRYPT_ROUNDS=rounds, HASH_WORKERS=hash_workers, LOGIN_IP_LIMIT=10 ** 9)
+    from app import app
+    from models import db, User
+    from passwords import hash_password, login_ip_limiter
+
+    fresh_database(app)
+    with app.app_context():
+        # one hash is enough, every user gets the same password
+        password = hash_password(b'secret')
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'u{i}', 'full_name': f'U {i}', 'password': password, 'role': 'user'} for i in range(logins)
+        ])
+        db.session.commit()
+
+    def log_in(i):
+        client = app.test_client()
+        return client.post('/login', data={'username': f'u{i}', 'password': 'secret'}).status_code
+
+    click.echo(f"{'clients':>8} {'logins/s':>9}  statuses")
+    for count in [int(n) for n in clients.split(',')]:
+        login_ip_limiter._hits.clear()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            statuses = Counter(pool.map(log_in, range(logins)))
+        elapsed = time.perf_counter() - started
+        click.echo(f'{count:>8} {statuses[302] / elapsed:>9.1f}  {dict(sorted(statuses.items()))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import click
+from common import bench_env
+
+_app = None
+
+
+def _init_worker(url, profile):
+    # each process is its own app with its own spot index, like a gunicorn worker
+    global _app
+    os.environ['DATABASE_URL'] = url
+    os.environ['APP_PROFILE'] = profile
+    from app import app
+    _app = app
+
+
+def _ready(_):
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _cycles(job):
+    # park and leave `cycles` times; returns the number that failed
+    from sqlalchemy.exc import OperationalError
+    from models import db
+    from spots import park, finish_parking, spot_index, spots_changed
+    from billing import tariff_for
+    user_id, cycles = job
+    failed = 0
+    with _app.app_context():
+        for _ in range(cycles):
+            reservation, error = park(user_id, user_id, 1)
+            if error:
+                failed += 1
+                continue
+            try:
+                finish_parking(reservation, tariff_for(reservation.lot))
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                failed += 1
+                continue
+            spot_index.release(1, reservation.spot_id)
+            spots_changed(1)
+    return failed
+
+
+def seed(url, users):
+    from sqlalchemy import create_engine, insert
+    from models import db, User, Vehicle, Lot, Spot
+    from migrations import upgrade
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    upgrade(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Lot.__table__).values(lot_id=1, location_name='Bench', price=1.0, max_spots=users))
+        conn.execute(insert(Spot.__table__), [{'lot_id': 1, 'status': 'A'}] * users)
+        conn.execute(insert(User.__table__), [
+            {'id': i, 'username': f'b{i}', 'password': 'x', 'role': 'user'} for i in range(1, users + 1)
+        ])
+        conn.execute(insert(Vehicle.__table__), [
+            {'v_id': i, 'v_number': f'B{i}', 'user_id': i} for i in range(1, users + 1)
+        ])
+    engine.dispose()
+
+
+def run(profile, workers, users, cycles):
+    tmp = bench_env()
+    url = f"sqlite:///{os.path.join(tmp, f'{profile}-{workers}.db')}"
+    seed(url, users)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(url, profile),
+    ) as pool:
+        # start every worker before the clock does
+        while len(set(pool.map(_ready, range(workers * 2)))) < workers:
+            pass
+        started = time.perf_counter()
+        failed = sum(pool.map(_cycles, [(user_id, cycles) for user_id in range(1, users + 1)]))
+        elapsed = time.perf_counter() - started
+    done = users * cycles - failed
+    return done / elapsed, failed
+
+
+@click.command()
+@click.option('--workers', default='1,4,16', show_default=True, help='Comma-separated worker process counts.')
+@click.option('--profiles', default='development,production', show_default=True)
+@click.option('--users', default=64, show_default=True, help='Users parking at once, one spot each.')
+@click.option('--cycles', default=20, show_default=True, help='Park and leave cycles per user.')
+def main(workers, profiles, users, cycles):
+    """Park and leave throughput with several worker processes under each database profile."""
+    click.echo(f"{'profile':>12} {'workers':>8} {'cycles/s':>9} {'failed':>7}")
+    for profile in profiles.split(','):
+        for count in [int(n) for n in workers.split(',')]:
+            rate, failed = run(profile, count, users, cycles)
+            click.echo(f'{profile:>12} {count:>8} {rate:>9.0f} {failed:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import time
+import click
+from common import bench_env, fresh_database
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,100000', show_default=True, help='Comma-separated spot counts to try.')
+def main(sizes):
+    """Time to provision a lot's spots in bulk, and to shrink it by half again."""
+    bench_env()
+    from app import app
+    from models import db, Lot, Spot
+    from spots import add_spots, remove_spots
+
+    click.echo(f"{'spots':>8} {'grow ms':>9} {'shrink ms':>10}")
+    for size in [int(n) for n in sizes.split(',')]:
+        fresh_database(app)
+        with app.app_context():
+            lot = Lot(location_name='Garage', price=1.0, address='x', pin_code='600001', max_spots=size)
+            db.session.add(lot)
+            db.session.commit()
+
+            started = time.perf_counter()
+            add_spots(lot.lot_id, size)
+            db.session.commit()
+            grow = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            assert remove_spots(lot.lot_id, size // 2)
+            db.session.commit()
+            shrink = (time.perf_counter() - started) * 1000
+
+            left = Spot.query.filter_by(lot_id=lot.lot_id).count()
+            assert left == size - size // 2, left
+        click.echo(f'{size:>8} {grow:>9.0f} {shrink:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
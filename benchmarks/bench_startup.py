@@ -0,0 +1,47 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import click
+from common import ROOT, bench_env
+
+PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+{preload}
+import app
+print(json.dumps({{
+    'ms': (time.perf_counter() - started) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'matplotlib': 'matplotlib' in sys.modules,
+}}))
+'''
+# what app.py used to import at module load
+EAGER = "import matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot, matplotlib.dates"
+
+
+def probe(preload, runs):
+    code = PROBE.format(preload=preload)
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=os.environ, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+@click.command()
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters per variant.')
+def main(runs):
+    """`import app` time and peak RSS per worker, lazy charts against eager matplotlib."""
+    bench_env()
+    click.echo(f"{'variant':>10} {'import ms':>10} {'rss MB':>8}  matplotlib loaded")
+    for name, preload in (('lazy', ''), ('eager', EAGER)):
+        results = probe(preload, runs)
+        ms = statistics.median(r['ms'] for r in results)
+        rss = statistics.median(r['rss_mb'] for r in results)
+        click.echo(f"{name:>10} {ms:>10.0f} {rss:>8.1f}  {results[0]['matplotlib']}")
+
+
+if __name__ == '__main__':
+    main()
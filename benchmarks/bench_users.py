@@ -0,0 +1,56 @@
+import click
+from common import bench_env, fresh_database, add_user, login, count_queries, time_ms
+
+
+def seed_users(count):
+    from models import db, User, Vehicle
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'full_name': f'User {i}', 'password': b'x', 'role': 'user'} for i in range(count)
+    ])
+    first = db.session.query(db.func.min(User.id)).scalar()
+    db.session.execute(Vehicle.__table__.insert(), [
+        {'v_number': f'V{i}', 'details': 'car', 'user_id': first + i} for i in range(count)
+    ])
+    db.session.commit()
+    return first + count - 1
+
+
+@click.command()
+@click.option('--users', default='1000,10000,100000', show_default=True, help='Comma-separated user counts to try.')
+def main(users):
+    """Admin users page time as users grow: first and deep pages, one exact search, and a broad filter's first and deep pages."""
+    bench_env(BCRYPT_ROUNDS=4)
+    from app import app
+    from models import db
+
+    click.echo(f"{'users':>8} {'first ms':>9} {'deep ms':>8} {'search ms':>10} "
+               f"{'filter ms':>10} {'filter deep ms':>15} {'queries':>8}")
+    for count in [int(n) for n in users.split(',')]:
+        fresh_database(app)
+        with app.app_context():
+            last_id = seed_users(count)
+            add_user('admin', 'admin', role='admin')
+        client = app.test_client()
+        login(client, 'admin', 'admin')
+
+        def page(url):
+            def load():
+                response = client.get(url)
+                assert response.status_code == 200, response.status_code
+            return load
+
+        first = page('/admin/users')
+        with app.app_context(), count_queries(db.engine) as statements:
+            first()
+        deep = page(f'/admin/users?after={last_id - 30}')
+        search = page(f'/admin/users?q=user{count - 1}')
+        # 'user1' matches about a ninth of all users; the deep page starts
+        # halfway through those matches, at user15, user150, user1500...
+        filtered = page('/admin/users?q=user1')
+        filtered_deep = page(f'/admin/users?q=user1&after={last_id - count + 1 + 15 * count // 100}')
+        click.echo(f'{count:>8} {time_ms(first):>9.1f} {time_ms(deep):>8.1f} {time_ms(search):>10.1f} '
+                   f'{time_ms(filtered):>10.1f} {time_ms(filtered_deep):>15.1f} {len(statements):>8}')
+
+
+if __name__ == '__main__':
+    main()
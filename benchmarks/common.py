@@ -0,0 +1,92 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def bench_env(**settings):
+    # app.py builds the app at import time, so its settings go in first; every
+    # run gets a throwaway database
+    tmp = tempfile.mkdtemp(prefix='parking-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    os.environ.setdefault('BOOKING_EXPIRY_INTERVAL', '0')
+    os.environ.update({name: str(value) for name, value in settings.items()})
+    return tmp
+
+
+def fresh_database(app):
+    from models import db
+    from migrations import upgrade
+    from spots import spot_index
+    from lot_search import lot_search_index
+    from schedule import booking_index
+    from snapshot import lot_snapshot
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        upgrade(db.engine)
+        spot_index.rebuild()
+    lot_search_index.invalidate()
+    booking_index.invalidate()
+    lot_snapshot.invalidate()
+
+
+def seed_lots(count, spots, occupied=0):
+    from models import db, Lot, Spot
+    db.session.execute(Lot.__table__.insert(), [
+        {'location_name': f'Lot {i}', 'price': 1.0 + i % 5, 'address': 'x', 'pin_code': f'{600000 + i}', 'max_spots': spots}
+        for i in range(count)
+    ])
+    lot_ids = db.session.query(Lot.lot_id).order_by(Lot.lot_id).all()
+    rows = []
+    for (lot_id,) in lot_ids[-count:]:
+        rows += [{'lot_id': lot_id, 'status': 'O' if i < occupied else 'A'} for i in range(spots)]
+    db.session.execute(Spot.__table__.insert(), rows)
+    db.session.commit()
+
+
+def add_user(username, password, role='user'):
+    from models import db, User
+    from passwords import hash_password
+    user = User(username=username, full_name=username, password=hash_password(password.encode('utf-8')), role=role)
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def login(client, username, password):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302, response.status_code
+
+
+@contextmanager
+def count_queries(engine):
+    from sqlalchemy import event
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def time_ms(fn, repeat=5):
+    # median of `repeat` runs after one warm-up
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
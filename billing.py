@@ -0,0 +1,246 @@
+import json
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+import click
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, update, bindparam, cast, String
+from models import db, Lot, Reservation
+from history import parse_date
+from rollups import rebuild_rollups
+
+MINUTES_PER_DAY = 1440
+REPRICE_BATCH_SIZE = 50000
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+TARIFF_KEYS = {'grace_minutes', 'unit_minutes', 'slabs', 'daily_cap', 'night_price', 'night_start', 'night_end'}
+
+# slabs is a tuple of (up_to_minute, price_per_minute) pairs covering the stay
+# from arrival; the last pair has up_to_minute None. Night windows and offsets
+# are in minutes of the local day.
+Tariff = namedtuple(
+    'Tariff',
+    'grace_minutes unit_minutes slabs daily_cap night_price night_start night_end utc_offset',
+)
+
+# the same pricing code runs on floats for one stay and on arrays for a batch
+SCALAR_OPS = (min, max, math.floor)
+VECTOR_OPS = (np.minimum, np.maximum, np.floor)
+
+
+def parse_tariff(price, rules=None, utc_offset=0):
+    if isinstance(rules, str):
+        rules = json.loads(rules) if rules.strip() else None
+    rules = rules or {}
+    if not isinstance(rules, dict):
+        raise ValueError('tariff must be a JSON object')
+    unknown = set(rules) - TARIFF_KEYS
+    if unknown:
+        raise ValueError(f"unknown tariff setting(s): {', '.join(sorted(unknown))}")
+
+    slabs = []
+    lower = 0
+    for bound, rate in rules.get('slabs', []):
+        if bound is None or float(bound) <= lower:
+            raise ValueError('slab limits must be increasing minute counts')
+        lower = float(bound)
+        slabs.append((lower, float(rate)))
+    # time past the last slab is billed at the lot's price
+    slabs.append((None, float(price)))
+
+    night_price = rules.get('night_price')
+    daily_cap = rules.get('daily_cap')
+    return Tariff(
+        grace_minutes=float(rules.get('grace_minutes', 0)),
+        unit_minutes=float(rules.get('unit_minutes', 0)),
+        slabs=tuple(slabs),
+        daily_cap=float(daily_cap) if daily_cap is not None else None,
+        night_price=float(night_price) if night_price is not None else None,
+        night_start=float(rules.get('night_start', 22)) * 60 % MINUTES_PER_DAY,
+        night_end=float(rules.get('night_end', 6)) * 60 % MINUTES_PER_DAY,
+        utc_offset=utc_offset,
+    )
+
+
+@lru_cache(maxsize=1024)
+def _cached_tariff(price, rules, utc_offset):
+    return parse_tariff(price, rules, utc_offset)
+
+
+def tariff_for(lot):
+    return _cached_tariff(lot.price, lot.tariff, current_app.config['BILLING_UTC_OFFSET_MINUTES'])
+
+
+def _night_before(tariff, t, ops):
+    # night minutes between the epoch and local minute t
+    lo, hi, floor = ops
+    start, end = tariff.night_start, tariff.night_end
+    length = (end - start) % MINUTES_PER_DAY
+    day = floor(t / MINUTES_PER_DAY)
+    minute = t - day * MINUTES_PER_DAY
+    if start <= end:
+        within = lo(hi(minute - start, 0), end - start)
+    else:
+        within = lo(minute, end) + hi(minute - start, 0)
+    return day * length + within
+
+
+def _charge_until(tariff, start, elapsed, ops):
+    # charge for the first `elapsed` minutes of a stay that began at local minute `start`
+    lo, hi, _ = ops
+    total = 0
+    lower = 0
+    for bound, rate in tariff.slabs:
+        upper = hi(elapsed if bound is None else lo(elapsed, bound), lower)
+        minutes = upper - lower
+        if tariff.night_price is None:
+            total = total + minutes * rate
+        else:
+            night = _night_before(tariff, start + upper, ops) - _night_before(tariff, start + lower, ops)
+            total = total + (minutes - night) * rate + night * tariff.night_price
+        if bound is None:
+            break
+        lower = bound
+    return total
+
+
+def _price(tariff, start, duration, ops):
+    lo, hi, floor = ops
+    billed = duration
+    if tariff.unit_minutes:
+        # every started unit is charged in full
+        billed = -floor(-duration / tariff.unit_minutes) * tariff.unit_minutes
+    longest = billed.max() if isinstance(billed, np.ndarray) else billed
+    days = max(math.ceil(longest / MINUTES_PER_DAY), 1)
+
+    if tariff.daily_cap is None:
+        amount = _charge_until(tariff, start, billed, ops)
+    else:
+        # the cap applies to each 24 hours counted from arrival
+        amount = 0
+        previous = 0
+        for day in range(days):
+            current = _charge_until(tariff, start, lo(billed, (day + 1) * MINUTES_PER_DAY), ops)
+            amount = amount + lo(current - previous, tariff.daily_cap)
+            previous = current
+    # half-up to the paisa, identical for floats and arrays
+    return floor(amount * 100 + 0.5) / 100
+
+
+def price_stay(tariff, parked_at, left_at):
+    # timedelta division is exact, so this matches the datetime64 batch path bit for bit
+    duration = max((left_at - parked_at) / MINUTE, 0)
+    if duration <= tariff.grace_minutes:
+        return 0.0
+    start = (parked_at - EPOCH) / MINUTE + tariff.utc_offset
+    return float(_price(tariff, start, duration, SCALAR_OPS))
+
+
+def price_stays(tariff, starts, durations):
+    # starts are UTC minutes since the epoch, durations the stay lengths in minutes
+    durations = np.maximum(np.asarray(durations, dtype=float), 0)
+    if not len(durations):
+        return np.zeros(0)
+    amounts = _price(tariff, np.asarray(starts, dtype=float) + tariff.utc_offset, durations, VECTOR_OPS)
+    return np.where(durations <= tariff.grace_minutes, 0.0, amounts)
+
+
+def stay_minutes(parked_at, left_at):
+    # ISO timestamp strings are parsed by numpy, never turned into datetime
+    # objects; durations come from the exact microsecond difference as in
+    # price_stay, since subtracting two float epoch minutes can tip an amount
+    # over a rounding edge
+    parked = np.asarray(parked_at, dtype='datetime64[us]')
+    left = np.asarray(left_at, dtype='datetime64[us]')
+    minute = np.timedelta64(1, 'm')
+    return (parked - np.datetime64(EPOCH, 'us')) / minute, (left - parked) / minute
+
+
+def running_charges(parked_at, tariff, now):
+    starts = np.array([(parked - EPOCH) / MINUTE for parked in parked_at])
+    minutes = np.maximum(np.floor((now - EPOCH) / MINUTE - starts), 0)
+    return minutes.astype(int).tolist(), price_stays(tariff, starts, minutes).tolist()
+
+
+def reprice_chunk(lot_ids, starts, durations, tariffs):
+    # rows are grouped by lot with one sort; lots that no longer exist stay NaN
+    amounts = np.full(len(lot_ids), np.nan)
+    order = np.argsort(lot_ids, kind='stable')
+    lots, first = np.unique(lot_ids[order], return_index=True)
+    for lot_id, lo, hi in zip(lots, first, list(first[1:]) + [len(order)]):
+        tariff = tariffs.get(int(lot_id))
+        if tariff is not None:
+            rows = order[lo:hi]
+            amounts[rows] = price_stays(tariff, starts[rows], durations[rows])
+    return amounts
+
+
+@click.command('reprice-reservations')
+@click.option('--lot-id', type=int, help='Only reprice this lot.')
+@click.option('--since', help='Only reservations that closed on/after YYYY-MM-DD.')
+@click.option('--apply', 'apply_changes', is_flag=True, help='Write new amounts to unpaid reservations.')
+@click.option('--batch-size', default=REPRICE_BATCH_SIZE, show_default=True)
+def reprice_reservations_command(lot_id, since, apply_changes, batch_size):
+    since_date = parse_date(since)
+    if since and not since_date:
+        raise click.BadParameter('expected YYYY-MM-DD', param_hint='--since')
+
+    tariffs = {lot.lot_id: tariff_for(lot) for lot in Lot.query.all()}
+    table = Reservation.__table__
+    columns = [
+        table.c.r_id, table.c.lot_id, table.c.amount, table.c.payment_status,
+        cast(table.c.parking_timestamp, String).label('parked_text'),
+        cast(table.c.leaving_timestamp, String).label('left_text'),
+    ]
+    query = select(*columns).where(table.c.leaving_timestamp.isnot(None))
+    if lot_id:
+        query = query.where(table.c.lot_id == lot_id)
+    if since_date:
+        query = query.where(table.c.leaving_timestamp >= since_date)
+    update_amount = update(table).where(table.c.r_id == bindparam('b_r_id')).values(amount=bindparam('b_amount'))
+
+    totals = {'rows': 0, 'changed': 0, 'updated': 0, 'old': 0.0, 'new': 0.0}
+    last_id = 0
+    while True:
+        # one short transaction per chunk, keyed on r_id like the archiver
+        with db.engine.begin() as conn:
+            rows = conn.execute(query.where(table.c.r_id > last_id).order_by(table.c.r_id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1].r_id
+
+            values = list(zip(*rows))
+            r_ids = np.asarray(values[0])
+            starts, durations = stay_minutes(values[4], values[5])
+            amounts = reprice_chunk(np.asarray(values[1]), starts, durations, tariffs)
+
+            old = np.array([amount or 0 for amount in values[2]], dtype=float)
+            priced = ~np.isnan(amounts)
+            new = np.where(priced, amounts, old)
+            changed = np.abs(old - new) > 0.005
+            totals['rows'] += len(rows)
+            totals['changed'] += int(changed.sum())
+            totals['old'] += float(old.sum())
+            totals['new'] += float(new.sum())
+
+            # amounts already paid are reported but never rewritten
+            unpaid = np.isin(np.asarray(values[3]), ('Pending', 'Failed'))
+            if apply_changes and (changed & unpaid).any():
+                conn.execute(update_amount, [
+                    {'b_r_id': int(r_id), 'b_amount': float(amount)}
+                    for r_id, amount in zip(r_ids[changed & unpaid], new[changed & unpaid])
+                ])
+                totals['updated'] += int((changed & unpaid).sum())
+
+    click.echo(
+        f"Priced {totals['rows']} reservation(s): {totals['changed']} differ, "
+        f"total {totals['old']:.2f} -> {totals['new']:.2f}."
+    )
+    if apply_changes:
+        click.echo(f"Updated {totals['updated']} unpaid reservation(s); paid ones were left alone.")
+        if totals['updated']:
+            with db.engine.begin() as conn:
+                rebuild_rollups(conn)
+            click.echo('Rebuilt lot rollups.')
@@ -0,0 +1,305 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, Spot, Reservation, Booking
+from spots import spot_index, take_spot, spots_changed, MAX_CLAIM_ATTEMPTS, MAX_PARK_RETRIES
+from stats import bump_user_stats
+from schedule import booking_index, LIVE_BOOKINGS
+
+UPCOMING_BOOKINGS_SIZE = 10
+
+
+def _minutes(setting):
+    return timedelta(minutes=current_app.config[setting])
+
+
+def validate_window(starts_at, ends_at, now=None):
+    now = now or datetime.utcnow()
+    if ends_at <= starts_at:
+        return 'bad_window'
+    if starts_at < now.replace(second=0, microsecond=0):
+        return 'in_past'
+    if starts_at > now + timedelta(days=current_app.config['BOOKING_MAX_DAYS_AHEAD']):
+        return 'too_far'
+    if ends_at - starts_at > timedelta(hours=current_app.config['BOOKING_MAX_HOURS']):
+        return 'too_long'
+    return None
+
+
+def _lock_spot(spot_id):
+    # a no-op write that makes bookings of one spot take turns across workers
+    db.session.execute(
+        update(Spot)
+        .where(Spot.spot_id == spot_id)
+        .values(status=Spot.status)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _window_taken(spot_id, starts_at, ends_at):
+    return db.session.execute(
+        select(Booking.booking_id)
+        .where(
+            Booking.spot_id == spot_id,
+            Booking.status.in_(LIVE_BOOKINGS),
+            Booking.ends_at > starts_at,
+            Booking.starts_at < ends_at,
+        )
+        .limit(1)
+    ).first() is not None
+
+
+def _reserve_window(lot_id, starts_at, ends_at, only=None):
+    # the index proposes a spot and the database confirms it under the spot's lock
+    tried = set()
+    reloaded = False
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        spot_id = booking_index.find_free(lot_id, starts_at, ends_at, only=only, skip=tried)
+        if spot_id is None:
+            # bookings cancelled in other workers may not be in this index yet
+            if reloaded:
+                return None
+            booking_index.invalidate(lot_id)
+            reloaded = True
+            continue
+        _lock_spot(spot_id)
+        if not _window_taken(spot_id, starts_at, ends_at):
+            return spot_id
+        # booked by another worker first, so this process's schedule is stale
+        tried.add(spot_id)
+        if not reloaded:
+            booking_index.invalidate(lot_id)
+            reloaded = True
+    return None
+
+
+def start_booking(user_id, vehicle_id, lot_id, starts_at, ends_at):
+    overlapping = Booking.query.filter(
+        Booking.user_id == user_id,
+        Booking.status.in_(LIVE_BOOKINGS),
+        Booking.starts_at < ends_at,
+        Booking.ends_at > starts_at,
+    ).first()
+    if overlapping:
+        return None, 'overlap'
+
+    only = None
+    if starts_at < datetime.utcnow() + _minutes('BOOKING_WALKIN_BUFFER_MINUTES'):
+        # nobody knows when a walk-in will leave, so a booking that starts
+        # soon needs a spot that is empty right now
+        only = spot_index.free_spots(lot_id)
+    spot_id = _reserve_window(lot_id, starts_at, ends_at, only)
+    if spot_id is None:
+        return None, 'no_spot'
+    booking = Booking(
+        spot_id=spot_id,
+        lot_id=lot_id,
+        user_id=user_id,
+        vehicle_id=vehicle_id,
+        starts_at=starts_at,
+        ends_at=ends_at,
+        status='Booked',
+    )
+    db.session.add(booking)
+    return booking, None
+
+
+def book(user_id, vehicle_id, lot_id, starts_at, ends_at):
+    for attempt in range(MAX_PARK_RETRIES):
+        try:
+            booking, error = start_booking(user_id, vehicle_id, lot_id, starts_at, ends_at)
+            if error:
+                db.session.rollback()
+                return None, error
+            db.session.commit()
+            booking_index.add(lot_id, booking.spot_id, starts_at, ends_at, booking.booking_id)
+            return booking, None
+        except OperationalError:
+            db.session.rollback()
+            time.sleep(random.uniform(0, 0.02 * (attempt + 1)))
+    return None, 'busy'
+
+
+def check_in_error(booking, now):
+    if booking.status != 'Booked':
+        return 'not_booked'
+    if now < booking.starts_at - _minutes('BOOKING_EARLY_CHECKIN_MINUTES'):
+        return 'too_early'
+    if now > booking.starts_at + _minutes('BOOKING_GRACE_MINUTES') or now >= booking.ends_at:
+        return 'expired'
+    return None
+
+
+def start_booked_parking(booking, when=None):
+    now = when or datetime.utcnow()
+    error = check_in_error(booking, now)
+    if error:
+        return None, error
+
+    lot_id = booking.lot_id
+    spot_id = booking.spot_id
+    if not take_spot(lot_id, spot_id):
+        # an earlier walk-in is still on the booked spot: move the booking to
+        # one that is empty now and free until it ends, starting it now
+        spot_id = _reserve_window(lot_id, now, booking.ends_at, only=spot_index.free_spots(lot_id) - {spot_id})
+        if spot_id is None or not take_spot(lot_id, spot_id):
+            return None, 'full'
+        booking_index.remove(lot_id, booking.spot_id, booking.starts_at, booking.booking_id)
+        booking.spot_id = spot_id
+        booking.starts_at = now
+        booking_index.add(lot_id, spot_id, now, booking.ends_at, booking.booking_id)
+
+    reservation = Reservation(
+        spot_id=spot_id,
+        lot_id=lot_id,
+        user_id=booking.user_id,
+        vehicle_id=booking.vehicle_id,
+        parking_timestamp=now,
+        payment_status='Parked'
+    )
+    db.session.add(reservation)
+    db.session.flush()
+    booking.status = 'CheckedIn'
+    booking.r_id = reservation.r_id
+    bump_user_stats(booking.user_id, bookings=1)
+    return reservation, None
+
+
+def check_in(booking_id, user_id, when=None):
+    for attempt in range(MAX_PARK_RETRIES):
+        lot_id = None
+        try:
+            booking = Booking.query.filter_by(booking_id=booking_id, user_id=user_id).first()
+            if booking is None:
+                return None, 'not_found'
+            lot_id = booking.lot_id
+            reservation, error = start_booked_parking(booking, when)
+            if error:
+                db.session.rollback()
+                return None, error
+            db.session.commit()
+            spots_changed(lot_id)
+            return reservation, None
+        except IntegrityError:
+            db.session.rollback()
+            spot_index.reload(lot_id)
+            return None, 'already_parked'
+        except OperationalError:
+            db.session.rollback()
+            if lot_id is not None:
+                spot_index.reload(lot_id)
+            time.sleep(random.uniform(0, 0.02 * (attempt + 1)))
+    return None, 'busy'
+
+
+def cancel(booking_id, user_id):
+    booking = Booking.query.filter_by(booking_id=booking_id, user_id=user_id).first()
+    if booking is None:
+        return 'not_found'
+    if booking.status != 'Booked':
+        return 'not_booked'
+    booking.status = 'Cancelled'
+    db.session.commit()
+    booking_index.remove(booking.lot_id, booking.spot_id, booking.starts_at, booking.booking_id)
+    return None
+
+
+def pending_bookings(vehicle_ids):
+    # bookings not checked into yet, keyed by (vehicle_id, lot_id)
+    pending = {}
+    rows = (
+        Booking.query
+        .filter(Booking.vehicle_id.in_(vehicle_ids), Booking.status == 'Booked')
+        .order_by(Booking.starts_at)
+    )
+    for booking in rows:
+        pending.setdefault((booking.vehicle_id, booking.lot_id), []).append(booking)
+    return pending
+
+
+def due_booking(pending, vehicle_id, lot_id, when):
+    for booking in pending.get((vehicle_id, lot_id), ()):
+        if check_in_error(booking, when) is None:
+            return booking
+    return None
+
+
+def upcoming_bookings(user_id, limit=UPCOMING_BOOKINGS_SIZE):
+    return (
+        Booking.query
+        .filter(Booking.user_id == user_id, Booking.status == 'Booked')
+        .order_by(Booking.starts_at)
+        .limit(limit)
+        .all()
+    )
+
+
+def expire_no_shows(now=None):
+    now = now or datetime.utcnow()
+    table = Booking.__table__
+    # own short transaction, like the archiver, so it never touches a view's session
+    with db.engine.begin() as conn:
+        expired = conn.execute(
+            update(table)
+            .where(table.c.status == 'Booked', table.c.starts_at < now - _minutes('BOOKING_GRACE_MINUTES'))
+            .values(status='NoShow')
+            .returning(table.c.lot_id, table.c.spot_id, table.c.starts_at, table.c.booking_id)
+        ).all()
+    for row in expired:
+        booking_index.remove(*row)
+    booking_index.prune(now)
+    return len(expired)
+
+
+class NoShowSweeper:
+    # one daemon thread per worker process; the update is idempotent, so
+    # workers sweeping at the same time only repeat each other's no-op
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        interval = app.config['BOOKING_EXPIRY_INTERVAL']
+        if not interval:
+            return
+        with self._lock:
+            # a forked worker inherits the object but not the thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app, interval), name='no-show-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self, app, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    expired = expire_no_shows()
+                if expired:
+                    app.logger.info('marked %d booking(s) as no-shows', expired)
+            except Exception:
+                app.logger.exception('no-show sweep failed')
+
+
+no_show_sweeper = NoShowSweeper()
+
+
+def init_bookings(app):
+    # started by the first request rather than at import, so CLI commands
+    # and chart workers never run a sweeper
+    @app.before_request
+    def start_no_show_sweeper():
+        no_show_sweeper.start(app)
+
+
+@click.command('expire-bookings')
+def expire_bookings_command():
+    expired = expire_no_shows()
+    click.echo(f'Marked {expired} booking(s) as no-shows.')
@@ -0,0 +1,231 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from flask import request, Response, abort
+from profiling import timed
+
+CHART_CACHE_SIZE = 128
+CHART_WORKERS = 2
+CHART_TIMEOUT = 30
+
+
+def _pyplot():
+    # matplotlib is only imported on first render, normally inside a chart worker
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_pie(data):
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(5,5))
+    ax.pie(data['values'], labels=data['labels'], autopct='%1.1f%%', startangle=90)
+    ax.set_title('Occupied Spots Distribution')
+    plt.tight_layout()
+    return _to_png(fig)
+
+
+def render_bar(data):
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(6,4))
+    ax.bar(data['labels'], data['values'], color='#27ae60')
+    ax.set_ylabel('Revenue')
+    ax.set_xlabel('Parking Lot')
+    ax.set_title('Revenue by Lot')
+    plt.tight_layout()
+    return _to_png(fig)
+
+
+def render_duration(data):
+    plt = _pyplot()
+    import matplotlib.dates as mdates
+    fig, ax = plt.subplots(figsize=(10, 4))
+    ax.plot(data['times'], data['durations'], marker='o', color='green', linewidth=2)
+    ax.set_title("Parking Duration per Reservation (minutely)")
+    ax.set_xlabel("Date & Time")
+    ax.set_ylabel("Duration (minutes)")
+    ax.grid(True)
+
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%b %H:%M'))  # e.g., "31-Jul 13:45"
+    fig.autofmt_xdate(rotation=45)
+    plt.tight_layout()
+    return _to_png(fig)
+
+
+def render_trend(data):
+    plt = _pyplot()
+    import matplotlib.dates as mdates
+    fig, ax = plt.subplots(figsize=(10, 4))
+    ax.plot(data['days'], data['occupancy'], color='#136b25', linewidth=2)
+    ax.set_ylabel('Occupancy (%)')
+    ax.set_title('Daily Occupancy and Revenue')
+    ax.grid(True)
+    revenue_ax = ax.twinx()
+    revenue_ax.bar(data['days'], data['revenue'], color='#27ae60', alpha=0.3)
+    revenue_ax.set_ylabel('Revenue')
+
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%b'))
+    fig.autofmt_xdate(rotation=45)
+    plt.tight_layout()
+    return _to_png(fig)
+
+
+RENDERERS = {
+    'pie': render_pie,
+    'bar': render_bar,
+    'duration': render_duration,
+    'trend': render_trend,
+}
+
+
+def _to_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    _pyplot().close(fig)
+    return buf.getvalue()
+
+
+def render(kind, data):
+    return RENDERERS[kind](data)
+
+
+def chart_key(kind, data):
+    payload = json.dumps([kind, data], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ChartWorker:
+    # a `python -m charts` child: it imports this module and matplotlib, never
+    # the app, whatever script the web process was started from
+
+    def __init__(self):
+        self._proc = subprocess.Popen(
+            [sys.executable, '-m', 'charts'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def render(self, kind, data):
+        try:
+            pickle.dump((kind, data), self._proc.stdin)
+            self._proc.stdin.flush()
+            ok, result = pickle.load(self._proc.stdout)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._proc.kill()
+            raise RuntimeError('chart worker exited')
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+
+def serve(requests, replies):
+    while True:
+        try:
+            kind, data = pickle.load(requests)
+        except EOFError:
+            # the web process has gone
+            return
+        try:
+            reply = (True, render(kind, data))
+        except Exception as exc:
+            reply = (False, repr(exc))
+        pickle.dump(reply, replies)
+        replies.flush()
+
+
+class ChartCache:
+
+    def __init__(self, max_size=CHART_CACHE_SIZE, workers=CHART_WORKERS):
+        self.max_size = max_size
+        self.workers = workers
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._local = threading.local()
+
+    def _pool(self):
+        # matplotlib is not thread-safe, so charts render in separate processes,
+        # one per thread of this pool
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='chart')
+        return self._executor
+
+    def _render(self, kind, data):
+        worker = getattr(self._local, 'worker', None)
+        if worker is None or not worker.alive():
+            worker = self._local.worker = ChartWorker()
+        return worker.render(kind, data)
+
+    def _submit(self, kind, data):
+        return self._pool().submit(self._render, kind, data)
+
+    def prefetch(self, kind, data):
+        key = chart_key(kind, data)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return key
+            self._entries[key] = self._submit(kind, data)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return key
+
+    def get(self, kind, data):
+        key = self.prefetch(kind, data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # pushed out by other prefetches before it was read
+                entry = self._submit(kind, data)
+        if isinstance(entry, Future):
+            try:
+                png = entry.result(timeout=CHART_TIMEOUT)
+            except Exception:
+                with self._lock:
+                    self._entries.pop(key, None)
+                raise
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key] = png
+            return key, png
+        return key, entry
+
+
+chart_cache = ChartCache()
+
+
+def chart_response(kind, data):
+    if data is None:
+        abort(404)
+    key = chart_key(kind, data)
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        with timed('matplotlib'):
+            key, png = chart_cache.get(kind, data)
+        response = Response(png, mimetype='image/png')
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+if __name__ == '__main__':
+    # keep stray prints from matplotlib out of the reply stream
+    replies = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    serve(sys.stdin.buffer, replies)
@@ -0,0 +1,108 @@
+import os
+from sqlalchemy import event
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    # cookie, memory (single process), database or redis
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'database')
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///parking_app.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLITE_PRAGMAS = {}
+    GATE_API_KEY = os.environ.get('GATE_API_KEY')
+    # every open /api/lots/stream holds a worker thread for as long as the
+    # display stays connected, and displays past this many per worker get a
+    # 503. With sync or gthread workers keep it well under the thread count;
+    # serving the app with gevent workers (gunicorn -k gevent) turns each
+    # stream into a greenlet, and the limit can then go into the thousands
+    SSE_MAX_SUBSCRIBERS = _env_int('SSE_MAX_SUBSCRIBERS', 16)
+    ARCHIVE_AFTER_DAYS = _env_int('ARCHIVE_AFTER_DAYS', 180)
+    METRICS_ENABLED = False
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # fraction of requests run under cProfile; dumped only if slower than PROFILE_SLOW_MS
+    PROFILE_SAMPLE_RATE = _env_float('PROFILE_SAMPLE_RATE', 0.0)
+    PROFILE_SLOW_MS = _env_int('PROFILE_SLOW_MS', 500)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # night tariffs are defined in local time; timestamps are stored in UTC
+    BILLING_UTC_OFFSET_MINUTES = _env_int('BILLING_UTC_OFFSET_MINUTES', 0)
+    BCRYPT_ROUNDS = _env_int('BCRYPT_ROUNDS', 12)
+    HASH_WORKERS = _env_int('HASH_WORKERS', 4)
+    # hashes allowed to wait for a worker before logins are turned away
+    HASH_MAX_PENDING = _env_int('HASH_MAX_PENDING', 32)
+    HASH_QUEUE_TIMEOUT = _env_float('HASH_QUEUE_TIMEOUT', 2.0)
+    RATE_LIMIT_WINDOW = _env_int('RATE_LIMIT_WINDOW', 300)
+    LOGIN_IP_LIMIT = _env_int('LOGIN_IP_LIMIT', 30)
+    LOGIN_USER_LIMIT = _env_int('LOGIN_USER_LIMIT', 5)
+    REGISTER_IP_LIMIT = _env_int('REGISTER_IP_LIMIT', 5)
+    # check-in opens this long before a booking starts; nobody arriving by
+    # the grace period after the start makes it a no-show
+    BOOKING_EARLY_CHECKIN_MINUTES = _env_int('BOOKING_EARLY_CHECKIN_MINUTES', 15)
+    BOOKING_GRACE_MINUTES = _env_int('BOOKING_GRACE_MINUTES', 15)
+    # walk-ins are kept off spots booked to start within this many minutes
+    BOOKING_WALKIN_BUFFER_MINUTES = _env_int('BOOKING_WALKIN_BUFFER_MINUTES', 60)
+    BOOKING_MAX_DAYS_AHEAD = _env_int('BOOKING_MAX_DAYS_AHEAD', 30)
+    BOOKING_MAX_HOURS = _env_int('BOOKING_MAX_HOURS', 24)
+    # seconds between no-show sweeps in each worker; 0 leaves it to `flask expire-bookings`
+    BOOKING_EXPIRY_INTERVAL = _env_int('BOOKING_EXPIRY_INTERVAL', 60)
+
+
+class DevelopmentConfig(Config):
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-only-secret-key')
+
+
+class ProductionConfig(Config):
+    METRICS_ENABLED = True
+    # WAL lets readers run alongside the single writer; busy_timeout makes
+    # writers wait for the lock instead of failing straight away
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': _env_int('DB_POOL_SIZE', 10),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+
+def load_config(app):
+    profile = os.environ.get('APP_PROFILE', 'development')
+    if profile not in PROFILES:
+        raise RuntimeError(f"Unknown APP_PROFILE {profile!r}; expected one of {', '.join(PROFILES)}")
+    app.config.from_object(PROFILES[profile])
+    app.config['APP_PROFILE'] = profile
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError(f'SECRET_KEY must be set for the {profile} profile')
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -1,12 +1,14 @@
 from app import app, db
-import bcrypt
+from migrations import upgrade
 from models import User
+from passwords import hash_password
 
 with app.app_context():
     db.create_all()
+    upgrade(db.engine)
     admin = User.query.filter_by(role='admin').first()
     if not admin:
-        hashed = bcrypt.hashpw(b"admin123", bcrypt.gensalt())
+        hashed = hash_password(b"admin123")
         admin_user = User(username='admin', password=hashed, role='admin', full_name='admi')
         db.session.add(admin_user)
         db.session.commit()
@@ -0,0 +1,114 @@
+import json
+import queue
+import threading
+from spots import on_spots_changed
+
+# changes made by other workers are noticed on the next poll
+POLL_INTERVAL = 2
+KEEPALIVE_INTERVAL = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class FeedFull(Exception):
+    pass
+
+
+class OccupancyFeed:
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.last = {}
+        self.sequence = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def notify(self, lot_id=None):
+        self._wakeup.set()
+
+    def subscribe(self, app, limit=None):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if limit and len(self._subscribers) >= limit:
+                raise FeedFull()
+            self._subscribers.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                with app.app_context():
+                    self.last = dict(self.snapshot.get()['lots'])
+                self._thread = threading.Thread(target=self._run, args=(app,), daemon=True)
+                self._thread.start()
+            current = list(self.last.values())
+        return q, current
+
+    def is_subscribed(self, q):
+        with self._lock:
+            return q in self._subscribers
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _run(self, app):
+        while True:
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                with app.app_context():
+                    lots = self.snapshot.get()['lots']
+            except Exception:
+                app.logger.exception('occupancy feed refresh failed')
+                continue
+            self.publish(lots)
+
+    def publish(self, lots):
+        deltas = [lot for lot_id, lot in lots.items() if self.last.get(lot_id) != lot]
+        deltas += [{'id': lot_id, 'removed': True} for lot_id in self.last if lot_id not in lots]
+        self.last = dict(lots)
+        if not deltas:
+            return
+        with self._lock:
+            self.sequence += 1
+            message = (self.sequence, deltas)
+            for q in list(self._subscribers):
+                try:
+                    q.put_nowait(message)
+                except queue.Full:
+                    # a display that stopped reading is dropped rather than buffered forever
+                    self._subscribers.discard(q)
+
+
+def sse_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def occupancy_stream(feed, q, current):
+    try:
+        yield sse_event('snapshot', current)
+        while True:
+            try:
+                sequence, deltas = q.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                if not feed.is_subscribed(q):
+                    # dropped for falling behind; the client reconnects and resyncs
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            yield sse_event('occupancy', deltas, sequence)
+    finally:
+        feed.unsubscribe(q)
+
+
+def create_feed(snapshot):
+    feed = OccupancyFeed(snapshot)
+    on_spots_changed(feed.notify)
+    return feed
@@ -0,0 +1,174 @@
+import csv
+import io
+import os
+import click
+from models import db, Lot, User, Vehicle
+from archive import all_reservations
+from history import parse_date
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = [
+    'r_id', 'lot_id', 'location_name', 'spot_id', 'user_id', 'username', 'full_name',
+    'vehicle_id', 'v_number', 'parking_timestamp', 'leaving_timestamp', 'amount', 'payment_status',
+]
+
+
+def export_query(since_id=None, since=None, chunk_size=EXPORT_CHUNK_SIZE, held_ids=()):
+    res = all_reservations()
+    query = (
+        db.session.query(
+            res.c.r_id,
+            res.c.lot_id,
+            Lot.location_name,
+            res.c.spot_id,
+            res.c.user_id,
+            User.username,
+            User.full_name,
+            res.c.vehicle_id,
+            Vehicle.v_number,
+            res.c.parking_timestamp,
+            res.c.leaving_timestamp,
+            res.c.amount,
+            res.c.payment_status,
+        )
+        .outerjoin(Lot, Lot.lot_id == res.c.lot_id)
+        .outerjoin(User, User.id == res.c.user_id)
+        .outerjoin(Vehicle, Vehicle.v_id == res.c.vehicle_id)
+    )
+    if since_id and held_ids:
+        # stays still open at the last export go out again once they close
+        query = query.filter(db.or_(res.c.r_id > since_id, res.c.r_id.in_(held_ids)))
+    elif since_id:
+        query = query.filter(res.c.r_id > since_id)
+    if since:
+        # picks up reservations that started or closed after the watermark
+        query = query.filter(db.func.coalesce(res.c.leaving_timestamp, res.c.parking_timestamp) >= since)
+    return (
+        query.order_by(res.c.r_id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+
+
+def iter_chunks(query, chunk_size=EXPORT_CHUNK_SIZE):
+    chunk = []
+    for row in query:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(query, state=None, chunk_size=EXPORT_CHUNK_SIZE):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in iter_chunks(query, chunk_size):
+        writer.writerows(chunk)
+        if state is not None:
+            state['last_id'] = chunk[-1].r_id
+            state['rows'] = state.get('rows', 0) + len(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def write_csv(query, path, state=None):
+    with open(path, 'w', newline='') as f:
+        for text in iter_csv(query, state):
+            f.write(text)
+
+
+def write_parquet(query, path, state=None, chunk_size=EXPORT_CHUNK_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException('Parquet export needs pyarrow (pip install pyarrow).')
+
+    schema = pa.schema([
+        ('r_id', pa.int64()),
+        ('lot_id', pa.int64()),
+        ('location_name', pa.string()),
+        ('spot_id', pa.int64()),
+        ('user_id', pa.int64()),
+        ('username', pa.string()),
+        ('full_name', pa.string()),
+        ('vehicle_id', pa.int64()),
+        ('v_number', pa.string()),
+        ('parking_timestamp', pa.timestamp('us')),
+        ('leaving_timestamp', pa.timestamp('us')),
+        ('amount', pa.float64()),
+        ('payment_status', pa.string()),
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_chunks(query, chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch([list(col) for col in columns], schema=schema))
+            if state is not None:
+                state['last_id'] = chunk[-1].r_id
+                state['rows'] = state.get('rows', 0) + len(chunk)
+
+
+def closed_rows(query, progress):
+    # an open stay would be skipped for good once the watermark passes it, so
+    # it is held back and its r_id kept until it closes
+    for row in query:
+        progress['last_id'] = max(row.r_id, progress['last_id'] or 0)
+        if row.leaving_timestamp is None:
+            progress['held'].append(row.r_id)
+        else:
+            yield row
+
+
+def read_watermark(path):
+    # last exported r_id, then the r_ids of stays that were still open
+    if path and os.path.exists(path):
+        with open(path) as f:
+            lines = f.read().split('\n')
+        last_id = int(lines[0]) if lines[0].strip() else None
+        held = [int(value) for value in lines[1].split()] if len(lines) > 1 else []
+        return last_id, held
+    return None, []
+
+
+def write_watermark(path, last_id, held=()):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(f"{last_id}\n{' '.join(str(r_id) for r_id in held)}\n")
+    os.replace(tmp, path)
+
+
+@click.command('export-reservations')
+@click.option('--out', 'out_path', required=True, help='File to write.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'parquet']), default='csv')
+@click.option('--since-id', type=int, help='Only export reservations with a larger r_id.')
+@click.option('--since', help='Only export reservations started or closed on/after YYYY-MM-DD.')
+@click.option('--watermark', help='File holding the last exported r_id and any stays still open; '
+                                   'read before and updated after the export. Open stays are exported once closed.')
+def export_reservations_command(out_path, fmt, since_id, since, watermark):
+    held_ids = []
+    if watermark and since_id is None:
+        since_id, held_ids = read_watermark(watermark)
+    since_date = parse_date(since)
+    if since and not since_date:
+        raise click.BadParameter('expected YYYY-MM-DD', param_hint='--since')
+
+    state = {'last_id': since_id, 'rows': 0}
+    query = export_query(since_id=since_id, since=since_date, held_ids=held_ids)
+    if watermark:
+        progress = {'last_id': since_id, 'held': []}
+        query = closed_rows(query, progress)
+    if fmt == 'parquet':
+        write_parquet(query, out_path, state)
+    else:
+        write_csv(query, out_path, state)
+
+    if watermark:
+        state['last_id'] = progress['last_id']
+        if state['last_id'] is not None:
+            write_watermark(watermark, state['last_id'], progress['held'])
+    click.echo(f"Exported {state['rows']} reservation(s) to {out_path}; last r_id {state['last_id']}.")
@@ -0,0 +1,177 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+import click
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, Lot, Vehicle, Reservation
+from spots import spot_index, start_parking, finish_parking, spots_changed
+from billing import tariff_for
+from bookings import pending_bookings, due_booking, start_booked_parking
+
+MAX_GATE_BATCH = 500
+MAX_BATCH_RETRIES = 5
+# gate clocks may run slightly ahead of ours
+MAX_CLOCK_SKEW = timedelta(minutes=2)
+
+
+def parse_timestamp(value):
+    if not value:
+        return datetime.utcnow()
+    if not isinstance(value, str):
+        raise TypeError('timestamp must be an ISO 8601 string')
+    when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if when.tzinfo is not None:
+        # timestamps are stored as naive UTC
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def _lot_id(ev):
+    # anything else, lists and dicts included, is simply an unknown lot
+    lot_id = ev.get('lot_id')
+    return lot_id if isinstance(lot_id, int) and not isinstance(lot_id, bool) else None
+
+
+def _apply(events):
+    v_numbers = {str(ev.get('v_number', '')).strip().upper() for ev in events}
+    vehicles = {v.v_number: v for v in Vehicle.query.filter(Vehicle.v_number.in_(v_numbers))}
+    lots = {lot.lot_id: lot for lot in Lot.query.filter(Lot.lot_id.in_({_lot_id(ev) for ev in events} - {None}))}
+    user_ids = {v.user_id for v in vehicles.values()}
+    pending = pending_bookings({v.v_id for v in vehicles.values()})
+    active_by_user = {
+        res.user_id: res
+        for res in Reservation.query.filter(Reservation.user_id.in_(user_ids), Reservation.leaving_timestamp.is_(None))
+    }
+
+    results = []
+    claimed = []
+    freed = []
+    for ev in events:
+        kind = ev.get('type')
+        vehicle = vehicles.get(str(ev.get('v_number', '')).strip().upper())
+        lot = lots.get(_lot_id(ev))
+        result = {'event_id': ev.get('event_id'), 'type': kind}
+        results.append(result)
+
+        if kind not in ('entry', 'exit'):
+            result['error'] = 'invalid_type'
+            continue
+        if not vehicle:
+            result['error'] = 'unknown_vehicle'
+            continue
+        if not lot:
+            result['error'] = 'unknown_lot'
+            continue
+        try:
+            when = parse_timestamp(ev.get('timestamp'))
+        except (TypeError, ValueError):
+            result['error'] = 'invalid_timestamp'
+            continue
+        if when > datetime.utcnow() + MAX_CLOCK_SKEW:
+            result['error'] = 'future_timestamp'
+            continue
+
+        active = active_by_user.get(vehicle.user_id)
+        if kind == 'entry':
+            if active:
+                result['error'] = 'already_parked'
+                continue
+            booking = due_booking(pending, vehicle.v_id, lot.lot_id, when)
+            if booking:
+                reservation, error = start_booked_parking(booking, when)
+            else:
+                reservation = start_parking(vehicle.user_id, vehicle.v_id, lot.lot_id, when)
+                error = 'full' if reservation is None else None
+            if error:
+                result['error'] = error
+                continue
+            active_by_user[vehicle.user_id] = reservation
+            claimed.append((lot.lot_id, reservation.spot_id))
+            result['reservation'] = reservation
+        else:
+            if not active or active.vehicle_id != vehicle.v_id or active.lot_id != lot.lot_id:
+                result['error'] = 'not_parked'
+                continue
+            if when < active.parking_timestamp:
+                result['error'] = 'exit_before_entry'
+                continue
+            finish_parking(active, tariff_for(lot), when)
+            del active_by_user[vehicle.user_id]
+            freed.append((lot.lot_id, active.spot_id))
+            result['reservation'] = active
+    return results, claimed, freed
+
+
+def apply_gate_events(events):
+    for attempt in range(MAX_BATCH_RETRIES):
+        try:
+            results, claimed, freed = _apply(events)
+            db.session.commit()
+            break
+        except (OperationalError, IntegrityError):
+            # database locked by a concurrent writer, or another worker parked
+            # one of these users since the batch was read; replay the whole
+            # batch, which then rejects just that entry as already_parked
+            db.session.rollback()
+            time.sleep(0.02 * (attempt + 1))
+    else:
+        return None
+
+    for lot_id, spot_id in freed:
+        spot_index.release(lot_id, spot_id)
+    for lot_id in {lot_id for lot_id, _ in claimed + freed}:
+        spots_changed(lot_id)
+
+    for result in results:
+        reservation = result.pop('reservation', None)
+        result['ok'] = 'error' not in result
+        if reservation is not None:
+            result['r_id'] = reservation.r_id
+            result['spot_id'] = reservation.spot_id
+            if result['type'] == 'exit':
+                result['amount'] = reservation.amount
+    return results
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+@click.command('ingest-gate-events')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=100, show_default=True)
+@click.option('--speed', default=0.0, help='Replay at this multiple of real time using event timestamps (0 = as fast as possible).')
+def ingest_gate_events_command(path, batch_size, speed):
+    batch_size = min(batch_size, MAX_GATE_BATCH)
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+
+    latencies = []
+    failed = 0
+    started = time.perf_counter()
+    first_ts = None
+    for i in range(0, len(events), batch_size):
+        batch = events[i:i + batch_size]
+        if speed and batch[0].get('timestamp'):
+            ts = parse_timestamp(batch[0]['timestamp'])
+            if first_ts is None:
+                first_ts = ts
+            wait = (ts - first_ts).total_seconds() / speed - (time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+        t = time.perf_counter()
+        results = apply_gate_events(batch)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if results is None:
+            failed += len(batch)
+        else:
+            failed += sum(1 for r in results if not r['ok'])
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'{len(events)} event(s) in {len(latencies)} batch(es), {failed} rejected, {elapsed:.2f}s '
+               f'({len(events) / elapsed if elapsed else 0:.0f} events/s)')
+    if latencies:
+        click.echo(f'batch latency ms: p50 {_percentile(latencies, 50):.1f}, '
+                   f'p95 {_percentile(latencies, 95):.1f}, p99 {_percentile(latencies, 99):.1f}, '
+                   f'max {max(latencies):.1f}')
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+from models import db, User
+from archive import all_reservations
+
+HISTORY_PAGE_SIZE = 50
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def history_query(lot_id=None, username=None, date_from=None, date_to=None, before=None):
+    res = all_reservations()
+    query = (
+        db.session.query(
+            res.c.r_id,
+            res.c.lot_id,
+            res.c.parking_timestamp,
+            res.c.leaving_timestamp,
+            res.c.amount,
+            res.c.payment_status,
+            User.full_name,
+            User.username,
+        )
+        .join(User, User.id == res.c.user_id)
+    )
+    if lot_id:
+        query = query.filter(res.c.lot_id == lot_id)
+    if username:
+        query = query.filter(User.username == username)
+    if date_from:
+        query = query.filter(res.c.parking_timestamp >= date_from)
+    if date_to:
+        query = query.filter(res.c.parking_timestamp < date_to + timedelta(days=1))
+    if before:
+        query = query.filter(res.c.r_id < before)
+    return query.order_by(res.c.r_id.desc())
+
+
+def history_row(row):
+    return {
+        "r_id": row.r_id,
+        "full_name": row.full_name,
+        "username": row.username,
+        "parking_time": row.parking_timestamp,
+        "leaving_time": row.leaving_timestamp,
+        "amount": row.amount,
+        "status": row.payment_status,
+    }
+
+
+def history_page(query, page_size=HISTORY_PAGE_SIZE):
+    rows = query.limit(page_size + 1).all()
+    next_before = rows[page_size - 1].r_id if len(rows) > page_size else None
+    return [history_row(row) for row in rows[:page_size]], next_before
+
+
+def history_stream(query, chunk_size=500):
+    for row in query.yield_per(chunk_size):
+        yield history_row(row)
@@ -0,0 +1,166 @@
+import bisect
+import heapq
+import math
+import threading
+import time
+from collections import namedtuple
+from models import db, Lot
+from snapshot import lot_snapshot
+
+# lot edits in this worker invalidate the index straight away; other
+# workers pick them up once it expires
+LOT_INDEX_TTL = 60
+GRID_CELL_DEGREES = 0.1
+MAX_GRID_RINGS = 30
+DEFAULT_RESULTS = 10
+MAX_RESULTS = 100
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+LotEntry = namedtuple('LotEntry', 'lot_id location_name pin_code price capacity latitude longitude')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _cell(latitude, longitude):
+    return int(math.floor(latitude / GRID_CELL_DEGREES)), int(math.floor(longitude / GRID_CELL_DEGREES))
+
+
+def _ring(center, radius):
+    row, col = center
+    if radius == 0:
+        yield center
+        return
+    for dc in range(-radius, radius + 1):
+        yield row - radius, col + dc
+        yield row + radius, col + dc
+    for dr in range(-radius + 1, radius):
+        yield row + dr, col - radius
+        yield row + dr, col + radius
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class LotSearchIndex:
+    # lot metadata sorted by pin code and bucketed into a lat/lon grid; free
+    # spot counts come from the shared lot snapshot, so parking never rebuilds it
+
+    def __init__(self, ttl=LOT_INDEX_TTL):
+        self.ttl = ttl
+        self._state = None
+        self._built_at = 0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self, lot_id=None):
+        self._stale = True
+
+    def _get(self):
+        with self._lock:
+            if self._stale or time.monotonic() - self._built_at > self.ttl:
+                self._build()
+            return self._state
+
+    def _build(self):
+        self._stale = False
+        lots = {}
+        pins = []
+        grid = {}
+        rows = db.session.query(
+            Lot.lot_id, Lot.location_name, Lot.pin_code, Lot.price, Lot.max_spots, Lot.latitude, Lot.longitude,
+        )
+        for row in rows:
+            entry = LotEntry(*row)
+            lots[entry.lot_id] = entry
+            if entry.pin_code:
+                pins.append((entry.pin_code.strip(), entry.lot_id))
+            if entry.latitude is not None and entry.longitude is not None:
+                grid.setdefault(_cell(entry.latitude, entry.longitude), []).append(entry.lot_id)
+        pins.sort()
+        self._state = {'lots': lots, 'pins': pins, 'pin_keys': [pin for pin, _ in pins], 'grid': grid}
+        self._built_at = time.monotonic()
+
+    def _result(self, entry, free, **extra):
+        return dict({
+            'id': entry.lot_id,
+            'location_name': entry.location_name,
+            'pin_code': entry.pin_code,
+            'price': entry.price,
+            'capacity': entry.capacity,
+            'free': free,
+            'latitude': entry.latitude,
+            'longitude': entry.longitude,
+        }, **extra)
+
+    def _available(self, state, lot_ids, max_price, include_full):
+        # counted in the database, so spots other workers took are included
+        counts = lot_snapshot.get()['lots']
+        for lot_id in lot_ids:
+            entry = state['lots'][lot_id]
+            if max_price is not None and entry.price > max_price:
+                continue
+            free = counts[lot_id]['free'] if lot_id in counts else 0
+            if free or include_full:
+                yield entry, free
+
+    def by_pin(self, pin, k=DEFAULT_RESULTS, max_price=None, include_full=False):
+        state = self._get()
+        pin = pin.strip()
+        keys = state['pin_keys']
+        seen = set()
+        matches = []
+        # widen the shared prefix one digit at a time until k lots qualify
+        for length in range(len(pin), -1, -1):
+            prefix = pin[:length]
+            lo = bisect.bisect_left(keys, prefix)
+            hi = bisect.bisect_left(keys, prefix + '\uffff')
+            new_ids = [lot_id for _, lot_id in state['pins'][lo:hi] if lot_id not in seen]
+            seen.update(new_ids)
+            for entry, free in self._available(state, new_ids, max_price, include_full):
+                matches.append((-common_prefix(pin, entry.pin_code.strip()), entry.price, -free, entry.lot_id, entry))
+            if len(matches) >= k:
+                break
+        best = heapq.nsmallest(k, matches, key=lambda m: m[:4])
+        return [self._result(m[4], -m[2], matched_digits=-m[0]) for m in best]
+
+    def by_location(self, latitude, longitude, k=DEFAULT_RESULTS, max_price=None, include_full=False):
+        state = self._get()
+        grid = state['grid']
+        center = _cell(latitude, longitude)
+        # narrowest width of a grid cell anywhere in the rings searched
+        poleward = min(abs(latitude) + MAX_GRID_RINGS * GRID_CELL_DEGREES, 89)
+        ring_km = GRID_CELL_DEGREES * KM_PER_DEGREE * math.cos(math.radians(poleward))
+        matches = []
+
+        def add(lot_ids):
+            for entry, free in self._available(state, lot_ids, max_price, include_full):
+                distance = haversine_km(latitude, longitude, entry.latitude, entry.longitude)
+                matches.append((distance, entry.price, -free, entry.lot_id, entry))
+
+        for radius in range(MAX_GRID_RINGS + 1):
+            for cell in _ring(center, radius):
+                add(grid.get(cell, ()))
+            # anything in the next ring is at least radius * ring_km away
+            if len(matches) >= k and heapq.nsmallest(k, matches, key=lambda m: m[:4])[-1][0] <= radius * ring_km:
+                break
+        else:
+            # sparse area: fall back to every lot outside the rings searched
+            searched = {cell for radius in range(MAX_GRID_RINGS + 1) for cell in _ring(center, radius)}
+            add(lot_id for cell, lot_ids in grid.items() if cell not in searched for lot_id in lot_ids)
+
+        best = heapq.nsmallest(k, matches, key=lambda m: m[:4])
+        return [self._result(m[4], -m[2], distance_km=round(m[0], 3)) for m in best]
+
+
+lot_search_index = LotSearchIndex()
@@ -0,0 +1,136 @@
+from datetime import datetime
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from models import db, Reservation, UserStats, ReservationArchive, LotRollup, SessionRecord, Booking
+from stats import rebuild_user_stats
+from rollups import rebuild_rollups
+
+
+def create_indexes(*statements):
+    def step(conn):
+        for statement in statements:
+            conn.execute(text(statement))
+    return step
+
+
+def close_duplicate_active(conn):
+    # legacy data can hold several open stays per user, which the unique
+    # index below refuses; keep the newest and close the rest at no charge
+    stale = conn.execute(text(
+        'SELECT r_id, spot_id FROM reservations r WHERE leaving_timestamp IS NULL AND r_id < '
+        '(SELECT MAX(r_id) FROM reservations k WHERE k.user_id = r.user_id AND k.leaving_timestamp IS NULL)'
+    )).all()
+    for r_id, spot_id in stale:
+        conn.execute(text(
+            "UPDATE reservations SET leaving_timestamp = parking_timestamp, amount = 0, payment_status = 'Paid' "
+            'WHERE r_id = :r_id'
+        ), {'r_id': r_id})
+        conn.execute(text(
+            "UPDATE spots SET status = 'A' WHERE spot_id = :spot_id AND NOT EXISTS "
+            '(SELECT 1 FROM reservations WHERE spot_id = :spot_id AND leaving_timestamp IS NULL)'
+        ), {'spot_id': spot_id})
+
+
+def create_hot_indexes(conn):
+    close_duplicate_active(conn)
+    create_indexes(
+        'CREATE INDEX IF NOT EXISTS ix_spots_lot_status ON spots (lot_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_vehicles_user_id ON vehicles (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_reservations_user_leaving ON reservations (user_id, leaving_timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_reservations_spot_leaving ON reservations (spot_id, leaving_timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_reservations_lot_leaving ON reservations (lot_id, leaving_timestamp)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_reservations_active_user ON reservations (user_id) '
+        'WHERE leaving_timestamp IS NULL',
+    )(conn)
+
+
+def add_columns(table, *columns):
+    def step(conn):
+        existing = {column['name'] for column in inspect(conn).get_columns(table)}
+        for name, ddl in columns:
+            if name not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+    return step
+
+
+def create_user_stats(conn):
+    UserStats.__table__.create(conn, checkfirst=True)
+    # the archive table only arrives in migration 3, so nothing is archived yet
+    rebuild_user_stats(conn, Reservation.__table__)
+
+
+def create_archive(conn):
+    ReservationArchive.__table__.create(conn, checkfirst=True)
+
+
+def create_rollups(conn):
+    LotRollup.__table__.create(conn, checkfirst=True)
+    rebuild_rollups(conn)
+
+
+def create_sessions(conn):
+    SessionRecord.__table__.create(conn, checkfirst=True)
+
+
+def create_bookings(conn):
+    Booking.__table__.create(conn, checkfirst=True)
+
+
+# (version, description, step); steps must be safe to re-run on a database
+# that db.create_all() has already brought up to date
+MIGRATIONS = [
+    (1, 'indexes for hot lookup columns', create_hot_indexes),
+    (2, 'per-user reservation statistics', create_user_stats),
+    (3, 'reservation archive table', create_archive),
+    (4, 'hourly and daily lot rollups', create_rollups),
+    (5, 'server-side sessions', create_sessions),
+    (6, 'lot coordinates', add_columns('lots', ('latitude', 'FLOAT'), ('longitude', 'FLOAT'))),
+    (7, 'lot tariff rules', add_columns('lots', ('tariff', 'TEXT'))),
+    (8, 'advance bookings', create_bookings),
+    (9, 'user search indexes', create_indexes(
+        'CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))',
+        'CREATE INDEX IF NOT EXISTS ix_users_full_name_lower ON users (lower(full_name))',
+    )),
+]
+
+
+def is_applied(conn, version):
+    return conn.execute(text('SELECT 1 FROM schema_migrations WHERE version = :v'), {'v': version}).first() is not None
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'
+        ))
+
+    applied = []
+    for version, description, step in MIGRATIONS:
+        try:
+            with engine.begin() as conn:
+                if is_applied(conn, version):
+                    continue
+                step(conn)
+                conn.execute(
+                    text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                    {'v': version, 'd': description, 't': datetime.utcnow()},
+                )
+            applied.append(version)
+        except IntegrityError:
+            # only a race with another worker applying the same step is
+            # harmless; anything else is a real failure
+            with engine.connect() as conn:
+                if not is_applied(conn, version):
+                    raise
+    return applied
+
+
+@click.command('db-upgrade')
+def db_upgrade_command():
+    applied = upgrade(db.engine)
+    if applied:
+        click.echo(f"Applied migration(s): {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo('Database schema is up to date.')
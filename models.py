@@ -5,6 +5,11 @@ db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # case-insensitive prefix search on the admin users page
+        db.Index('ix_users_username_lower', db.text('lower(username)')),
+        db.Index('ix_users_full_name_lower', db.text('lower(full_name)')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(100), nullable=True) 
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -19,7 +24,7 @@ class Vehicle(db.Model):
     v_id = db.Column(db.Integer, primary_key=True)
     v_number = db.Column(db.String(20), unique=True, nullable=False)
     details = db.Column(db.String(100))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
 
 class Lot(db.Model):
@@ -30,11 +35,17 @@ class Lot(db.Model):
     address = db.Column(db.String(200), nullable=True)
     pin_code = db.Column(db.String(20), nullable=True)
     max_spots = db.Column(db.Integer, nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    tariff = db.Column(db.Text, nullable=True) # JSON tariff rules; NULL bills price per minute
     spots = db.relationship('Spot', backref='lot', cascade='all, delete-orphan')
 
 
 class Spot(db.Model):
     __tablename__ = 'spots'
+    __table_args__ = (
+        db.Index('ix_spots_lot_status', 'lot_id', 'status'),
+    )
     spot_id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('lots.lot_id'), nullable=False)
     status = db.Column(db.String(1), nullable=False, default='A') # 'A'=Available, 'O'=Occupied
@@ -42,6 +53,15 @@ class Spot(db.Model):
 
 class Reservation(db.Model):
     __tablename__ = 'reservations'
+    __table_args__ = (
+        # a user can hold at most one active (not yet left) reservation
+        db.Index('uq_reservations_active_user', 'user_id', unique=True,
+                 sqlite_where=db.text('leaving_timestamp IS NULL'),
+                 postgresql_where=db.text('leaving_timestamp IS NULL')),
+        db.Index('ix_reservations_user_leaving', 'user_id', 'leaving_timestamp'),
+        db.Index('ix_reservations_spot_leaving', 'spot_id', 'leaving_timestamp'),
+        db.Index('ix_reservations_lot_leaving', 'lot_id', 'leaving_timestamp'),
+    )
     r_id = db.Column(db.Integer, primary_key=True)
     spot_id = db.Column(db.Integer, db.ForeignKey('spots.spot_id'), nullable=False)
     lot_id = db.Column(db.Integer, db.ForeignKey('lots.lot_id'), nullable=False)
@@ -58,3 +78,73 @@ class Reservation(db.Model):
 
     def __repr__(self):
         return f"<Reservation {self.r_id} User:{self.user_id} Spot:{self.spot_id} Amount:{self.amount} Status:{self.payment_status}>"
+
+
+class Booking(db.Model):
+    __tablename__ = 'bookings'
+    __table_args__ = (
+        db.Index('ix_bookings_spot_ends', 'spot_id', 'ends_at'),
+        db.Index('ix_bookings_lot_ends', 'lot_id', 'ends_at'),
+        db.Index('ix_bookings_status_starts', 'status', 'starts_at'),
+        db.Index('ix_bookings_user_status', 'user_id', 'status'),
+    )
+    booking_id = db.Column(db.Integer, primary_key=True)
+    spot_id = db.Column(db.Integer, db.ForeignKey('spots.spot_id'), nullable=False)
+    lot_id = db.Column(db.Integer, db.ForeignKey('lots.lot_id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.v_id'), nullable=False)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Booked') # Booked, CheckedIn, Completed, Cancelled, NoShow
+    r_id = db.Column(db.Integer, nullable=True, index=True) # reservation opened at check-in
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    lot = db.relationship('Lot')
+    vehicle = db.relationship('Vehicle')
+
+
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    total_minutes = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SessionRecord(db.Model):
+    __tablename__ = 'sessions'
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class LotRollup(db.Model):
+    __tablename__ = 'lot_rollups'
+    __table_args__ = (
+        db.Index('ix_lot_rollups_period_bucket', 'period', 'bucket'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(4), primary_key=True) # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, primary_key=True) # start of the hour/day
+    occupied_minutes = db.Column(db.Float, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    closed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ReservationArchive(db.Model):
+    __tablename__ = 'reservations_archive'
+    __table_args__ = (
+        db.Index('ix_reservations_archive_user', 'user_id'),
+        db.Index('ix_reservations_archive_lot', 'lot_id'),
+    )
+    r_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    spot_id = db.Column(db.Integer, nullable=False)
+    lot_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    parking_timestamp = db.Column(db.DateTime)
+    leaving_timestamp = db.Column(db.DateTime)
+    amount = db.Column(db.Float)
+    payment_status = db.Column(db.String(20), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    lot = db.relationship('Lot', primaryjoin='foreign(ReservationArchive.lot_id) == Lot.lot_id', viewonly=True)
+    vehicle = db.relationship('Vehicle', primaryjoin='foreign(ReservationArchive.vehicle_id) == Vehicle.v_id', viewonly=True)
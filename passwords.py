@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from flask import current_app
+from profiling import timed
+
+# bcrypt releases the GIL, so a small thread pool caps how many cores hashing
+# can take without starving the other requests
+_executor = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _pool():
+    global _executor, _slots
+    with _pool_lock:
+        if _executor is None:
+            workers = current_app.config['HASH_WORKERS']
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+            _slots = threading.BoundedSemaphore(workers + current_app.config['HASH_MAX_PENDING'])
+    return _executor, _slots
+
+
+def _run(fn, *args):
+    executor, slots = _pool()
+    if not slots.acquire(timeout=current_app.config['HASH_QUEUE_TIMEOUT']):
+        raise HashingBusy()
+    try:
+        with timed('bcrypt'):
+            return executor.submit(fn, *args).result()
+    finally:
+        slots.release()
+
+
+def _as_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def hash_password(password):
+    salt = bcrypt.gensalt(rounds=current_app.config['BCRYPT_ROUNDS'])
+    return _run(bcrypt.hashpw, password, salt)
+
+
+def check_password(password, hashed):
+    return _run(bcrypt.checkpw, password, _as_bytes(hashed))
+
+
+def needs_rehash(hashed):
+    # hashes look like $2b$12$..., the middle field being the cost
+    try:
+        rounds = int(_as_bytes(hashed).split(b'$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != current_app.config['BCRYPT_ROUNDS']
+
+
+class RateLimiter:
+    # sliding window kept in process memory, so each worker counts on its own
+
+    def __init__(self, limit_setting, max_keys=10000):
+        self.limit_setting = limit_setting
+        self.max_keys = max_keys
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        window = current_app.config['RATE_LIMIT_WINDOW']
+        hits = self._hits.get(key)
+        if hits is None:
+            if len(self._hits) >= self.max_keys:
+                self._prune(now - window)
+            hits = self._hits[key] = deque()
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        return hits
+
+    def _prune(self, cutoff):
+        for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= cutoff]:
+            del self._hits[key]
+
+    def blocked(self, key):
+        with self._lock:
+            return len(self._recent(key, time.monotonic())) >= current_app.config[self.limit_setting]
+
+    def hit(self, key):
+        with self._lock:
+            now = time.monotonic()
+            self._recent(key, now).append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+login_ip_limiter = RateLimiter('LOGIN_IP_LIMIT')
+# counts failed attempts only, so a user who keeps logging in is never locked out
+login_user_limiter = RateLimiter('LOGIN_USER_LIMIT')
+register_ip_limiter = RateLimiter('REGISTER_IP_LIMIT')
@@ -0,0 +1,180 @@
+import cProfile
+import hmac
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context, abort, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds, in seconds, of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SECTIONS = ('matplotlib', 'bcrypt')
+
+
+def _current():
+    if has_request_context():
+        return g.get('metrics')
+    return None
+
+
+@contextmanager
+def timed(section):
+    metrics = _current()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics['sections'][section] = metrics['sections'].get(section, 0) + time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current()
+    if metrics is None or not conn.info.get('query_start'):
+        return
+    metrics['sql_count'] += 1
+    metrics['sql_time'] += time.perf_counter() - conn.info['query_start'].pop()
+
+
+class RouteMetrics:
+    # counters are per process, so each worker reports only the requests it served
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, metrics, wall):
+        with self._lock:
+            route = self._routes.get((endpoint, method))
+            if route is None:
+                route = self._routes[(endpoint, method)] = {
+                    'count': 0,
+                    'wall': 0.0,
+                    'buckets': [0] * len(self.buckets),
+                    'sql_count': 0,
+                    'sql_time': 0.0,
+                    'sections': dict.fromkeys(SECTIONS, 0.0),
+                }
+            route['count'] += 1
+            route['wall'] += wall
+            for i, bound in enumerate(self.buckets):
+                if wall <= bound:
+                    route['buckets'][i] += 1
+            route['sql_count'] += metrics['sql_count']
+            route['sql_time'] += metrics['sql_time']
+            for section, seconds in metrics['sections'].items():
+                route['sections'][section] = route['sections'].get(section, 0.0) + seconds
+
+    def prometheus(self):
+        with self._lock:
+            routes = {key: dict(route, buckets=list(route['buckets']), sections=dict(route['sections']))
+                      for key, route in self._routes.items()}
+
+        lines = [
+            '# HELP parking_request_seconds Wall time spent handling requests.',
+            '# TYPE parking_request_seconds histogram',
+        ]
+        for (endpoint, method), route in sorted(routes.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            for bound, count in zip(self.buckets, route['buckets']):
+                lines.append(f'parking_request_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'parking_request_seconds_bucket{{{labels},le="+Inf"}} {route["count"]}')
+            lines.append(f'parking_request_seconds_sum{{{labels}}} {route["wall"]:.6f}')
+            lines.append(f'parking_request_seconds_count{{{labels}}} {route["count"]}')
+
+        lines += [
+            '# HELP parking_sql_queries_total SQL statements executed while handling requests.',
+            '# TYPE parking_sql_queries_total counter',
+        ]
+        for (endpoint, method), route in sorted(routes.items()):
+            lines.append(f'parking_sql_queries_total{{endpoint="{endpoint}",method="{method}"}} {route["sql_count"]}')
+
+        lines += [
+            '# HELP parking_sql_seconds_total Time spent in SQL statements while handling requests.',
+            '# TYPE parking_sql_seconds_total counter',
+        ]
+        for (endpoint, method), route in sorted(routes.items()):
+            lines.append(f'parking_sql_seconds_total{{endpoint="{endpoint}",method="{method}"}} {route["sql_time"]:.6f}')
+
+        lines += [
+            '# HELP parking_section_seconds_total Time spent in chart rendering and password hashing.',
+            '# TYPE parking_section_seconds_total counter',
+        ]
+        for (endpoint, method), route in sorted(routes.items()):
+            for section, seconds in sorted(route['sections'].items()):
+                lines.append(
+                    f'parking_section_seconds_total{{endpoint="{endpoint}",method="{method}",section="{section}"}} {seconds:.6f}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+
+def _dump_profile(app, profiler, endpoint):
+    directory = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{endpoint}-{int(time.time() * 1000)}.prof')
+    profiler.dump_stats(path)
+    app.logger.warning('slow request %s profiled to %s', request.path, path)
+
+
+def init_profiling(app):
+
+    @app.before_request
+    def start_metrics():
+        g.metrics = {'start': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0, 'sections': {}}
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_metrics(response):
+        metrics = g.pop('metrics', None)
+        if metrics is None:
+            return response
+        wall = time.perf_counter() - metrics['start']
+        endpoint = request.endpoint or 'unmatched'
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if wall * 1000 >= app.config['PROFILE_SLOW_MS']:
+                _dump_profile(app, profiler, endpoint)
+
+        route_metrics.record(endpoint, request.method, metrics, wall)
+        if app.debug:
+            response.headers['X-Request-Time'] = f'{wall * 1000:.1f}ms'
+            response.headers['X-SQL-Count'] = str(metrics['sql_count'])
+            response.headers['X-SQL-Time'] = f"{metrics['sql_time'] * 1000:.1f}ms"
+            for section, seconds in metrics['sections'].items():
+                response.headers[f'X-{section.capitalize()}-Time'] = f'{seconds * 1000:.1f}ms'
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    @app.route('/metrics')
+    def metrics():
+        if not app.config['METRICS_ENABLED']:
+            abort(404)
+        token = app.config['METRICS_TOKEN']
+        given = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if token and not hmac.compare_digest(given.encode(), token.encode()):
+            abort(403)
+        return Response(route_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
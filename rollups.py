@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Lot, LotRollup
+from archive import all_reservations
+
+ROLLUP_PERIODS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+TREND_DAYS = 90
+
+
+def bucket_start(when, period):
+    if period == 'day':
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def split_by_bucket(parked, left, period):
+    step = ROLLUP_PERIODS[period]
+    bucket = bucket_start(parked, period)
+    while bucket < left:
+        end = bucket + step
+        minutes = (min(end, left) - max(bucket, parked)).total_seconds() / 60
+        yield bucket, minutes
+        bucket = end
+
+
+def rollup_rows(lot_id, parked, left, amount):
+    # occupancy and revenue are spread over the buckets the stay covers; the
+    # closed count lands in the bucket the car left in
+    total = (left - parked).total_seconds() / 60
+    rows = []
+    for period in ROLLUP_PERIODS:
+        closed_bucket = bucket_start(left, period)
+        pieces = list(split_by_bucket(parked, left, period))
+        if not pieces or pieces[-1][0] != closed_bucket:
+            pieces.append((closed_bucket, 0))
+        for bucket, minutes in pieces:
+            rows.append({
+                'lot_id': lot_id,
+                'period': period,
+                'bucket': bucket,
+                'occupied_minutes': minutes,
+                'revenue': (amount or 0) * minutes / total if total else (amount or 0),
+                'closed': 1 if bucket == closed_bucket else 0,
+            })
+    return rows
+
+
+def _upsert():
+    table = LotRollup.__table__
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.lot_id, table.c.period, table.c.bucket],
+        set_={
+            'occupied_minutes': table.c.occupied_minutes + stmt.excluded.occupied_minutes,
+            'revenue': table.c.revenue + stmt.excluded.revenue,
+            'closed': table.c.closed + stmt.excluded.closed,
+        },
+    )
+
+
+def record_closed(reservation):
+    rows = rollup_rows(
+        reservation.lot_id,
+        reservation.parking_timestamp,
+        reservation.leaving_timestamp,
+        reservation.amount,
+    )
+    # one statement run for every bucket, so a stay spanning months is not
+    # compiled into a single huge multi-row insert
+    db.session.execute(_upsert(), rows)
+
+
+def rebuild_rollups(conn):
+    res = all_reservations()
+    totals = {}
+    closed = conn.execute(
+        select(res.c.lot_id, res.c.parking_timestamp, res.c.leaving_timestamp, res.c.amount)
+        .where(res.c.leaving_timestamp.isnot(None))
+        .execution_options(stream_results=True, yield_per=1000)
+    )
+    for lot_id, parked, left, amount in closed:
+        for row in rollup_rows(lot_id, parked, left, amount):
+            key = (row['lot_id'], row['period'], row['bucket'])
+            if key in totals:
+                total = totals[key]
+                total['occupied_minutes'] += row['occupied_minutes']
+                total['revenue'] += row['revenue']
+                total['closed'] += row['closed']
+            else:
+                totals[key] = row
+
+    conn.execute(delete(LotRollup.__table__))
+    if totals:
+        conn.execute(insert(LotRollup.__table__), list(totals.values()))
+    return len(totals)
+
+
+def lot_trend(lot_id=None, period='day', since=None):
+    if since is None:
+        since = bucket_start(datetime.utcnow() - timedelta(days=TREND_DAYS), period)
+    query = (
+        db.session.query(
+            LotRollup.bucket,
+            func.sum(LotRollup.occupied_minutes).label('occupied_minutes'),
+            func.sum(LotRollup.revenue).label('revenue'),
+            func.sum(LotRollup.closed).label('closed'),
+        )
+        .filter(LotRollup.period == period, LotRollup.bucket >= since)
+    )
+    capacity = db.session.query(func.coalesce(func.sum(Lot.max_spots), 0))
+    if lot_id:
+        query = query.filter(LotRollup.lot_id == lot_id)
+        capacity = capacity.filter(Lot.lot_id == lot_id)
+    # occupancy is measured against the lots' current capacity
+    spot_minutes = capacity.scalar() * ROLLUP_PERIODS[period].total_seconds() / 60
+    trend = []
+    for row in query.group_by(LotRollup.bucket).order_by(LotRollup.bucket):
+        trend.append({
+            'bucket': row.bucket,
+            'occupied_minutes': round(row.occupied_minutes, 2),
+            'occupancy_percent': round(row.occupied_minutes / spot_minutes * 100, 2) if spot_minutes else 0,
+            'revenue': round(row.revenue, 2),
+            'closed': row.closed,
+        })
+    return trend
+
+
+@click.command('rebuild-rollups')
+def rebuild_rollups_command():
+    with db.engine.begin() as conn:
+        count = rebuild_rollups(conn)
+    click.echo(f'Rebuilt {count} rollup bucket(s).')
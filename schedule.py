@@ -0,0 +1,194 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+from models import db, Spot, Booking
+
+# bookings made by other workers are confirmed against the database before
+# they are written, so a stale index only costs a retry
+BOOKING_INDEX_TTL = 30
+# bookings that still hold their spot's window
+LIVE_BOOKINGS = ('Booked', 'CheckedIn')
+
+
+class SpotSchedule:
+    # one spot's bookings as half-open [start, end) windows; they never
+    # overlap, so sorted by start they are sorted by end as well
+
+    __slots__ = ('starts', 'ends', 'ids')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def conflicts(self, start, end):
+        # the first window ending after `start` is the only one that can overlap
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def add(self, start, end, booking_id):
+        i = bisect.bisect_left(self.starts, start)
+        if i < len(self.ids) and self.ids[i] == booking_id:
+            return
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, booking_id)
+
+    def remove(self, start, booking_id):
+        i = bisect.bisect_left(self.starts, start)
+        if i < len(self.ids) and self.ids[i] == booking_id:
+            del self.starts[i], self.ends[i], self.ids[i]
+            return True
+        return False
+
+    def prune(self, before):
+        i = bisect.bisect_right(self.ends, before)
+        del self.starts[:i], self.ends[:i], self.ids[:i]
+
+
+class LotSchedule:
+    # one lot's bookings: spots with none at all, which fit any window, and
+    # the booked spots ordered by their first live start, so only a prefix
+    # of them can overlap a window that ends soon
+
+    __slots__ = ('built_at', 'schedules', 'unbooked', 'upcoming')
+
+    def __init__(self, spot_ids, schedules):
+        self.built_at = time.monotonic()
+        self.schedules = schedules
+        self.unbooked = set(spot_ids) - schedules.keys()
+        self.upcoming = sorted((schedule.starts[0], spot_id) for spot_id, schedule in schedules.items())
+
+    def _rekey(self, spot_id, before):
+        # `before` is the spot's first start as it was before its schedule changed
+        schedule = self.schedules.get(spot_id)
+        after = schedule.starts[0] if schedule else None
+        if after == before:
+            return
+        if before is not None:
+            del self.upcoming[bisect.bisect_left(self.upcoming, (before, spot_id))]
+        if after is None:
+            self.schedules.pop(spot_id, None)
+            self.unbooked.add(spot_id)
+        else:
+            bisect.insort(self.upcoming, (after, spot_id))
+
+    def _first_start(self, spot_id):
+        schedule = self.schedules.get(spot_id)
+        return schedule.starts[0] if schedule else None
+
+    def add(self, spot_id, start, end, booking_id):
+        before = self._first_start(spot_id)
+        self.unbooked.discard(spot_id)
+        self.schedules.setdefault(spot_id, SpotSchedule()).add(start, end, booking_id)
+        self._rekey(spot_id, before)
+
+    def remove(self, spot_id, start, booking_id):
+        schedule = self.schedules.get(spot_id)
+        if schedule is not None:
+            before = schedule.starts[0]
+            if schedule.remove(start, booking_id):
+                self._rekey(spot_id, before)
+
+    def prune(self, before):
+        for spot_id, schedule in list(self.schedules.items()):
+            first = schedule.starts[0]
+            schedule.prune(before)
+            self._rekey(spot_id, first)
+
+    def held(self, start, end):
+        stop = bisect.bisect_left(self.upcoming, (end,))
+        return {
+            spot_id for _, spot_id in self.upcoming[:stop]
+            if self.schedules[spot_id].conflicts(start, end)
+        }
+
+    def find_free(self, start, end, only=None, skip=()):
+        for spot_id in _within(self.unbooked, only):
+            if spot_id not in skip:
+                return spot_id
+        # every candidate has bookings of its own; one bisect each
+        for spot_id in _within(self.schedules, only):
+            if spot_id not in skip and not self.schedules[spot_id].conflicts(start, end):
+                return spot_id
+        return None
+
+
+def _within(pool, only):
+    # members of `pool` that are also in `only`, walking the smaller of the two
+    if only is None:
+        return iter(pool)
+    if len(only) < len(pool):
+        return (spot_id for spot_id in only if spot_id in pool)
+    return (spot_id for spot_id in pool if spot_id in only)
+
+
+class BookingIndex:
+    # per-lot LotSchedule of live bookings, loaded on first use
+
+    def __init__(self, ttl=BOOKING_INDEX_TTL):
+        self.ttl = ttl
+        self._lots = {}
+        self._lock = threading.Lock()
+
+    def _load(self, lot_id):
+        spot_ids = [spot_id for (spot_id,) in db.session.query(Spot.spot_id).filter_by(lot_id=lot_id)]
+        rows = (
+            db.session.query(Booking.spot_id, Booking.starts_at, Booking.ends_at, Booking.booking_id)
+            .filter(Booking.lot_id == lot_id, Booking.status.in_(LIVE_BOOKINGS), Booking.ends_at > datetime.utcnow())
+            .order_by(Booking.starts_at)
+        )
+        schedules = {}
+        for spot_id, start, end, booking_id in rows:
+            schedule = schedules.setdefault(spot_id, SpotSchedule())
+            schedule.starts.append(start)
+            schedule.ends.append(end)
+            schedule.ids.append(booking_id)
+        lot = self._lots[lot_id] = LotSchedule(spot_ids, schedules)
+        return lot
+
+    def _lot(self, lot_id):
+        lot = self._lots.get(lot_id)
+        if lot is None or time.monotonic() - lot.built_at > self.ttl:
+            lot = self._load(lot_id)
+        return lot
+
+    def invalidate(self, lot_id=None):
+        with self._lock:
+            if lot_id is None:
+                self._lots.clear()
+            else:
+                self._lots.pop(lot_id, None)
+
+    def find_free(self, lot_id, start, end, only=None, skip=()):
+        with self._lock:
+            return self._lot(lot_id).find_free(start, end, only, skip)
+
+    def held_spots(self, lot_id, start, end):
+        # spots that have a booking somewhere in [start, end)
+        with self._lock:
+            return self._lot(lot_id).held(start, end)
+
+    def add(self, lot_id, spot_id, start, end, booking_id):
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is not None:
+                lot.add(spot_id, start, end, booking_id)
+
+    def remove(self, lot_id, spot_id, start, booking_id):
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is not None:
+                lot.remove(spot_id, start, booking_id)
+
+    def prune(self, before):
+        with self._lock:
+            for lot in self._lots.values():
+                lot.prune(before)
+
+
+booking_index = BookingIndex()
@@ -0,0 +1,179 @@
+import random
+import secrets
+import threading
+import time
+from datetime import datetime
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from sqlalchemy import select, delete, insert
+from werkzeug.datastructures import CallbackDict
+from models import db, SessionRecord
+
+# chance that a save also clears out expired rows
+PRUNE_CHANCE = 0.01
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        # new id on login so a sid planted before authentication is useless
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class MemoryStore:
+    # single process only; also stands in for Redis in development
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None or entry[0] < time.time():
+                self._data.pop(sid, None)
+                return None
+            return dict(entry[1])
+
+    def save(self, sid, data, lifetime):
+        with self._lock:
+            self._data[sid] = (time.time() + lifetime.total_seconds(), dict(data))
+            if random.random() < PRUNE_CHANCE:
+                now = time.time()
+                for key in [key for key, entry in self._data.items() if entry[0] < now]:
+                    del self._data[key]
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class DatabaseStore:
+    # rows in the app database; runs on its own connection so it never
+    # commits whatever the view left in db.session
+
+    def load(self, sid):
+        table = SessionRecord.__table__
+        with db.engine.connect() as conn:
+            data = conn.execute(
+                select(table.c.data).where(table.c.sid == sid, table.c.expires_at > datetime.utcnow())
+            ).scalar()
+        return serializer.loads(data) if data else None
+
+    def save(self, sid, data, lifetime):
+        table = SessionRecord.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.sid == sid))
+            conn.execute(insert(table).values(sid=sid, data=serializer.dumps(data), expires_at=now + lifetime))
+            if random.random() < PRUNE_CHANCE:
+                conn.execute(delete(table).where(table.c.expires_at <= now))
+
+    def delete(self, sid):
+        table = SessionRecord.__table__
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.sid == sid))
+
+
+class RedisStore:
+
+    def __init__(self, url, prefix='session:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('SESSION_BACKEND=redis needs the redis package (pip install redis).')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def load(self, sid):
+        data = self.client.get(self.prefix + sid)
+        return serializer.loads(data.decode('utf-8')) if data else None
+
+    def save(self, sid, data, lifetime):
+        self.client.setex(self.prefix + sid, lifetime, serializer.dumps(data))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    # the cookie only carries a signed session id; the data stays on the server
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session')
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            data = self.store.load(sid) if sid else None
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        self.store.save(session.sid, dict(session), app.permanent_session_lifetime)
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode('utf-8')).decode('utf-8'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def create_store(app):
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'database':
+        return DatabaseStore()
+    if backend == 'redis':
+        return RedisStore(app.config['SESSION_REDIS_URL'])
+    raise RuntimeError(f"Unknown SESSION_BACKEND {backend!r}; expected cookie, memory, database or redis")
+
+
+def init_sessions(app):
+    if app.config['SESSION_BACKEND'] != 'cookie':
+        app.session_interface = ServerSideSessionInterface(create_store(app))
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from stats import lot_stats
+from spots import on_spots_changed
+
+# other workers' changes are only picked up once the snapshot expires
+SNAPSHOT_TTL = 2
+
+
+def _etag(data):
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class LotSnapshot:
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._state = None
+        self._built_at = 0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self, lot_id=None):
+        self._stale = True
+
+    def get(self):
+        with self._lock:
+            if self._stale or time.monotonic() - self._built_at > self.ttl:
+                self._build()
+            return self._state
+
+    def _build(self):
+        self._stale = False
+        lots = {}
+        for lot in lot_stats():
+            lots[lot['id']] = {
+                'id': lot['id'],
+                'location_name': lot['location_name'],
+                'pin_code': lot['pin_code'],
+                'price': lot['price'],
+                'capacity': lot['max_spots'],
+                'occupied': lot['occupied'],
+                'free': lot['free'],
+            }
+        etag = _etag(lots)
+        if self._state is None or etag != self._state['etag']:
+            self._state = {
+                'lots': lots,
+                'etags': {lot_id: _etag(lot) for lot_id, lot in lots.items()},
+                'etag': etag,
+                'last_modified': datetime.utcnow().replace(microsecond=0),
+            }
+        self._built_at = time.monotonic()
+
+
+lot_snapshot = LotSnapshot()
+on_spots_changed(lot_snapshot.invalidate)
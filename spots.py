@@ -0,0 +1,332 @@
+import random
+import threading
+import time
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select, update, delete, func, or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from models import db, Spot, Reservation, ReservationArchive, Booking
+from stats import bump_user_stats
+from rollups import record_closed
+from billing import price_stay
+from schedule import booking_index, LIVE_BOOKINGS
+from archive import move_to_archive
+
+MAX_CLAIM_ATTEMPTS = 20
+MAX_PARK_RETRIES = 10
+# only ever visible inside the transaction that shrinks a lot
+RETIRING = 'R'
+# session.info key for spots the open transaction took out of the index
+CLAIMS = 'claimed_spots'
+
+
+class SpotIndex:
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def _load(self, lot_id):
+        rows = db.session.query(Spot.spot_id).filter_by(lot_id=lot_id, status='A').all()
+        self._free[lot_id] = {spot_id for (spot_id,) in rows}
+        return self._free[lot_id]
+
+    def _lot(self, lot_id):
+        free = self._free.get(lot_id)
+        if free is None:
+            free = self._load(lot_id)
+        return free
+
+    def rebuild(self):
+        rows = db.session.query(Spot.lot_id, Spot.spot_id).filter_by(status='A').all()
+        free = {}
+        for lot_id, spot_id in rows:
+            free.setdefault(lot_id, set()).add(spot_id)
+        with self._lock:
+            self._free = free
+
+    def reload(self, lot_id):
+        with self._lock:
+            self._load(lot_id)
+
+    def drop(self, lot_id):
+        with self._lock:
+            self._free.pop(lot_id, None)
+
+    def allocate(self, lot_id, exclude=None):
+        with self._lock:
+            free = self._lot(lot_id)
+            # only excluded spots are ever set aside, so this stops after at
+            # most len(exclude) + 1 pops however large the lot is
+            skipped = []
+            spot_id = None
+            while free:
+                candidate = free.pop()
+                if not exclude or candidate not in exclude:
+                    spot_id = candidate
+                    break
+                skipped.append(candidate)
+            free.update(skipped)
+            return spot_id
+
+    def take(self, lot_id, spot_id):
+        with self._lock:
+            self._lot(lot_id).discard(spot_id)
+
+    def release(self, lot_id, spot_id):
+        with self._lock:
+            # a lot that is not loaded picks the spot up when it is
+            free = self._free.get(lot_id)
+            if free is not None:
+                free.add(spot_id)
+
+    def free_spots(self, lot_id):
+        with self._lock:
+            return frozenset(self._lot(lot_id))
+
+    def check(self):
+        rows = db.session.query(Spot.lot_id, Spot.spot_id).filter_by(status='A').all()
+        actual = {}
+        for lot_id, spot_id in rows:
+            actual.setdefault(lot_id, set()).add(spot_id)
+
+        mismatches = {}
+        with self._lock:
+            for lot_id, indexed in self._free.items():
+                expected = actual.get(lot_id, set())
+                if indexed != expected:
+                    mismatches[lot_id] = {
+                        'missing': sorted(expected - indexed),
+                        'stale': sorted(indexed - expected),
+                    }
+        return mismatches
+
+
+spot_index = SpotIndex()
+
+_change_listeners = []
+
+
+def on_spots_changed(listener):
+    _change_listeners.append(listener)
+    return listener
+
+
+def spots_changed(lot_id):
+    for listener in _change_listeners:
+        listener(lot_id)
+
+
+def _claimed(lot_id, spot_id):
+    db.session.info.setdefault(CLAIMS, []).append((lot_id, spot_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _keep_claims(session):
+    session.info.pop(CLAIMS, None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _return_claims(session, transaction):
+    # whatever ended the transaction without a commit (rollback, close, or an
+    # exception part way through a request), its spots are free again
+    if transaction.parent is None:
+        for lot_id, spot_id in session.info.pop(CLAIMS, ()):
+            spot_index.release(lot_id, spot_id)
+
+
+def claim_spot(lot_id, when=None):
+    # walk-ins stay off spots that are booked to start soon
+    now = when or datetime.utcnow()
+    buffer = timedelta(minutes=current_app.config['BOOKING_WALKIN_BUFFER_MINUTES'])
+    held = booking_index.held_spots(lot_id, now, now + buffer)
+    reloaded = False
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        spot_id = spot_index.allocate(lot_id, exclude=held)
+        if spot_id is None:
+            # other workers may have freed spots this process has not seen yet
+            if reloaded:
+                return None
+            spot_index.reload(lot_id)
+            reloaded = True
+            continue
+
+        _claimed(lot_id, spot_id)
+        result = db.session.execute(
+            update(Spot)
+            .where(Spot.spot_id == spot_id, Spot.status == 'A')
+            .values(status='O')
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            return spot_id
+        db.session.info[CLAIMS].pop()
+        # lost the race to another worker, so this process's view of the lot is stale
+        if not reloaded:
+            spot_index.reload(lot_id)
+            reloaded = True
+    return None
+
+
+def take_spot(lot_id, spot_id):
+    result = db.session.execute(
+        update(Spot)
+        .where(Spot.spot_id == spot_id, Spot.status == 'A')
+        .values(status='O')
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    spot_index.take(lot_id, spot_id)
+    _claimed(lot_id, spot_id)
+    return True
+
+
+def start_parking(user_id, vehicle_id, lot_id, when=None):
+    spot_id = claim_spot(lot_id, when)
+    if spot_id is None:
+        return None
+    reservation = Reservation(
+        spot_id=spot_id,
+        lot_id=lot_id,
+        user_id=user_id,
+        vehicle_id=vehicle_id,
+        parking_timestamp=when or datetime.utcnow(),
+        payment_status='Parked'
+    )
+    db.session.add(reservation)
+    bump_user_stats(user_id, bookings=1)
+    return reservation
+
+
+def finish_parking(reservation, tariff, when=None):
+    reservation.leaving_timestamp = when or datetime.utcnow()
+
+    duration_minutes = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 60
+
+    reservation.amount = price_stay(tariff, reservation.parking_timestamp, reservation.leaving_timestamp)
+    reservation.payment_status = 'Pending'
+
+    db.session.execute(
+        update(Spot)
+        .where(Spot.spot_id == reservation.spot_id)
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    )
+    bump_user_stats(reservation.user_id, minutes=duration_minutes)
+    record_closed(reservation)
+
+    # a booked stay that ends early gives the rest of its window back
+    bookings = Booking.__table__
+    booking = db.session.execute(
+        update(bookings)
+        .where(bookings.c.r_id == reservation.r_id, bookings.c.status == 'CheckedIn')
+        .values(status='Completed')
+        .returning(bookings.c.lot_id, bookings.c.spot_id, bookings.c.starts_at, bookings.c.booking_id)
+    ).first()
+    if booking is not None:
+        booking_index.remove(*booking)
+    return duration_minutes
+
+
+def park(user_id, vehicle_id, lot_id, when=None):
+    for attempt in range(MAX_PARK_RETRIES):
+        try:
+            reservation = start_parking(user_id, vehicle_id, lot_id, when)
+            if reservation is None:
+                db.session.rollback()
+                return None, 'full'
+            db.session.commit()
+            spots_changed(lot_id)
+            return reservation, None
+        except IntegrityError:
+            db.session.rollback()
+            return None, 'already_parked'
+        except OperationalError:
+            # database locked by a concurrent writer, back off and retry
+            db.session.rollback()
+            time.sleep(random.uniform(0, 0.02 * (attempt + 1)))
+    return None, 'busy'
+
+
+def add_spots(lot_id, count):
+    if count <= 0:
+        return
+    db.session.execute(Spot.__table__.insert(), [{'lot_id': lot_id, 'status': 'A'}] * count)
+
+
+def remove_spots(lot_id, count):
+    if count <= 0:
+        return True
+    has_history = or_(
+        select(Reservation.r_id)
+        .where(Reservation.spot_id == Spot.spot_id)
+        .exists(),
+        select(ReservationArchive.r_id)
+        .where(ReservationArchive.lot_id == lot_id, ReservationArchive.spot_id == Spot.spot_id)
+        .exists(),
+    )
+    # history of a removed spot moves to the archive, which only takes paid
+    # stays, and never the newest hot row (see archive_reservations)
+    newest = select(func.max(Reservation.r_id)).scalar_subquery()
+    must_stay = (
+        select(Reservation.r_id)
+        .where(Reservation.spot_id == Spot.spot_id,
+               or_(Reservation.payment_status != 'Paid', Reservation.r_id == newest))
+        .exists()
+    )
+    has_booking = (
+        select(Booking.booking_id)
+        .where(Booking.spot_id == Spot.spot_id, Booking.status.in_(LIVE_BOOKINGS))
+        .exists()
+    )
+    # spots without any history, hot or archived, go first, then the newest
+    # ones; spots with live bookings or unpaid stays are never removed
+    victims = (
+        select(Spot.spot_id)
+        .where(Spot.lot_id == lot_id, Spot.status == 'A', ~has_booking, ~must_stay)
+        .order_by(has_history, Spot.spot_id.desc())
+        .limit(count)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        update(Spot)
+        .where(Spot.spot_id.in_(victims), Spot.status == 'A')
+        .values(status=RETIRING)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount < count:
+        return False
+
+    retiring = (
+        select(Spot.spot_id)
+        .where(Spot.lot_id == lot_id, Spot.status == RETIRING)
+        .scalar_subquery()
+    )
+    # kept rather than deleted, so user_stats and lot_rollups still add up and
+    # the spot's whole history, like anything archived earlier, is in one table
+    move_to_archive(db.session, Reservation.spot_id.in_(retiring))
+    db.session.execute(
+        delete(Booking)
+        .where(Booking.spot_id.in_(retiring))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(Spot)
+        .where(Spot.lot_id == lot_id, Spot.status == RETIRING)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+@click.command('check-spots')
+def check_spots_command():
+    mismatches = spot_index.check()
+    if not mismatches:
+        click.echo('Spot index consistent with database.')
+        return
+    for lot_id, diff in mismatches.items():
+        click.echo(f"Lot {lot_id}: missing {diff['missing']}, stale {diff['stale']}")
+    raise click.ClickException(f'{len(mismatches)} lot(s) out of step with the database.')
@@ -0,0 +1,151 @@
+import click
+from sqlalchemy import func, case, update, select, delete, insert
+from models import db, Lot, Spot, Reservation, ReservationArchive, UserStats
+from archive import all_reservations
+
+RECENT_HISTORY_SIZE = 10
+DURATION_CHART_SIZE = 50
+
+
+def lot_stats():
+    occupied = func.coalesce(func.sum(case((Spot.status == 'O', 1), else_=0)), 0)
+    rows = (
+        db.session.query(Lot, occupied.label('occupied'))
+        .outerjoin(Spot, Spot.lot_id == Lot.lot_id)
+        .group_by(Lot.lot_id)
+        .order_by(Lot.lot_id)
+        .all()
+    )
+
+    stats = []
+    for lot, occupied_count in rows:
+        stats.append({
+            'id': lot.lot_id,
+            'location_name': lot.location_name,
+            'pin_code': lot.pin_code,
+            'price': lot.price,
+            'occupied': occupied_count,
+            'max_spots': lot.max_spots,
+            'free': max(lot.max_spots - occupied_count, 0),
+            'revenue_per_minute': lot.price * occupied_count,
+        })
+    return stats
+
+
+def dashboard_totals(stats):
+    total_spots_occupied = sum(s['occupied'] for s in stats)
+    total_spots = sum(s['max_spots'] for s in stats)
+    total_revenue_per_minute = sum(s['revenue_per_minute'] for s in stats)
+    occupancy_percent = (total_spots_occupied / total_spots * 100) if total_spots else 0
+    return {
+        'spots_occupied': total_spots_occupied,
+        'total_spots': total_spots,
+        'occupancy_percent': round(occupancy_percent, 2),
+        'revenue_per_minute': round(total_revenue_per_minute, 2),
+    }
+
+
+def bump_user_stats(user_id, minutes=0, paid=0, bookings=0):
+    result = db.session.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(
+            total_minutes=UserStats.total_minutes + minutes,
+            total_paid=UserStats.total_paid + paid,
+            bookings=UserStats.bookings + bookings,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.add(UserStats(user_id=user_id, total_minutes=minutes, total_paid=paid, bookings=bookings))
+
+
+def user_totals(user_id):
+    stats = db.session.get(UserStats, user_id)
+    total_minutes = int(stats.total_minutes) if stats else 0
+    hours = total_minutes // 60
+    minutes = total_minutes % 60
+    return {
+        'total_time_parked': f"{hours}h {minutes:02d}m",
+        'total_amount_paid': f"₹{(stats.total_paid if stats else 0):.2f}",
+        'total_bookings': stats.bookings if stats else 0,
+    }
+
+
+def recent_reservations(user_id, before=None, page_size=RECENT_HISTORY_SIZE):
+    rows = []
+    # newest page from each of the hot and archive tables, merged by r_id
+    for model in (Reservation, ReservationArchive):
+        query = (
+            model.query
+            .options(db.joinedload(model.lot), db.joinedload(model.vehicle))
+            .filter(model.user_id == user_id)
+        )
+        if before:
+            query = query.filter(model.r_id < before)
+        rows += query.order_by(model.r_id.desc()).limit(page_size + 1).all()
+    rows.sort(key=lambda res: res.r_id, reverse=True)
+    rows = rows[:page_size + 1]
+    next_before = rows[page_size - 1].r_id if len(rows) > page_size else None
+    return rows[:page_size], next_before
+
+
+def recent_durations(user_id, limit=DURATION_CHART_SIZE):
+    res = all_reservations()
+    rows = (
+        db.session.query(res.c.parking_timestamp, res.c.leaving_timestamp)
+        .filter(res.c.user_id == user_id, res.c.leaving_timestamp.isnot(None))
+        .order_by(res.c.r_id.desc())
+        .limit(limit)
+        .all()
+    )
+    return list(reversed(rows))
+
+
+def stay_totals(conn, reservations, lot_id=None):
+    where = [reservations.c.lot_id == lot_id] if lot_id else []
+    paid = func.sum(case((reservations.c.payment_status == 'Paid', reservations.c.amount), else_=0))
+    totals = {}
+    for user_id, bookings, total_paid in conn.execute(
+        select(reservations.c.user_id, func.count(), paid).where(*where).group_by(reservations.c.user_id)
+    ):
+        totals[user_id] = {'user_id': user_id, 'total_minutes': 0.0, 'total_paid': total_paid or 0.0, 'bookings': bookings}
+
+    closed = conn.execute(
+        select(reservations.c.user_id, reservations.c.parking_timestamp, reservations.c.leaving_timestamp)
+        .where(reservations.c.leaving_timestamp.isnot(None), *where)
+        .execution_options(stream_results=True, yield_per=1000)
+    )
+    for user_id, parked, left in closed:
+        totals[user_id]['total_minutes'] += (left - parked).total_seconds() / 60
+    return totals
+
+
+def rebuild_user_stats(conn, reservations=None):
+    if reservations is None:
+        reservations = all_reservations()
+    totals = stay_totals(conn, reservations)
+    conn.execute(delete(UserStats.__table__))
+    if totals:
+        conn.execute(insert(UserStats.__table__), list(totals.values()))
+    return len(totals)
+
+
+def forget_lot_stats(lot_id):
+    # a deleted lot's stays come out of every user's totals with it
+    totals = stay_totals(db.session, all_reservations(), lot_id)
+    for user_id, total in totals.items():
+        bump_user_stats(user_id, -total['total_minutes'], -total['total_paid'], -total['bookings'])
+    if totals:
+        db.session.execute(
+            delete(UserStats)
+            .where(UserStats.user_id.in_(totals), UserStats.bookings <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@click.command('backfill-user-stats')
+def backfill_user_stats_command():
+    with db.engine.begin() as conn:
+        count = rebuild_user_stats(conn)
+    click.echo(f'Rebuilt statistics for {count} user(s).')
@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+from datetime import timedelta
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix='parking-tests-')
+
+# app.py builds the app at import time, so its settings have to be in the
+# environment first; spawned worker processes inherit them too
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TMP, 'app.db')}"
+os.environ['SECRET_KEY'] = 'test-secret'
+os.environ['BCRYPT_ROUNDS'] = '4'
+os.environ['BOOKING_EXPIRY_INTERVAL'] = '0'
+os.environ['LOGIN_IP_LIMIT'] = '100000'
+os.environ['REGISTER_IP_LIMIT'] = '100000'
+
+from app import app as flask_app
+from models import db, User, Vehicle, Lot, UserStats, LotRollup
+from spots import spot_index, add_spots, park, finish_parking
+from billing import tariff_for
+from stats import bump_user_stats, rebuild_user_stats
+from rollups import rebuild_rollups
+from passwords import hash_password, login_ip_limiter, login_user_limiter, register_ip_limiter
+from lot_search import lot_search_index
+from schedule import booking_index
+from snapshot import lot_snapshot
+
+
+def reset_caches():
+    spot_index.rebuild()
+    lot_search_index.invalidate()
+    booking_index.invalidate()
+    lot_snapshot.invalidate()
+    for limiter in (login_ip_limiter, login_user_limiter, register_ip_limiter):
+        limiter._hits.clear()
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        reset_caches()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_lot(app):
+    def make(spots=3, price=2.0, name='Lot', pin_code='600001', **columns):
+        with app.app_context():
+            lot = Lot(location_name=name, price=price, address='x', pin_code=pin_code, max_spots=spots, **columns)
+            db.session.add(lot)
+            db.session.flush()
+            add_spots(lot.lot_id, spots)
+            db.session.commit()
+            spot_index.reload(lot.lot_id)
+            return lot.lot_id
+    return make
+
+
+@pytest.fixture
+def make_user(app):
+    def make(username, password='p', role='user', v_number=None):
+        with app.app_context():
+            user = User(username=username, full_name=username, password=hash_password(password.encode('utf-8')), role=role)
+            db.session.add(user)
+            db.session.flush()
+            vehicle = Vehicle(v_number=v_number or username.upper(), details='car', user_id=user.id)
+            db.session.add(vehicle)
+            db.session.commit()
+            return user.id, vehicle.v_id
+    return make
+
+
+def login(client, username, password='p'):
+    return client.post('/login', data={'username': username, 'password': password})
+
+
+def stay(user_id, vehicle_id, lot_id, parked, hours=1, paid=True):
+    reservation, error = park(user_id, vehicle_id, lot_id, parked)
+    assert error is None
+    finish_parking(reservation, tariff_for(db.session.get(Lot, lot_id)), parked + timedelta(hours=hours))
+    if paid:
+        reservation.payment_status = 'Paid'
+        bump_user_stats(user_id, paid=reservation.amount)
+    db.session.commit()
+    return reservation.spot_id
+
+
+def aggregates():
+    stats = [(s.user_id, round(s.total_minutes, 6), round(s.total_paid, 6), s.bookings)
+             for s in UserStats.query.order_by(UserStats.user_id)]
+    rollups = [(r.lot_id, r.period, r.bucket, round(r.occupied_minutes, 6), round(r.revenue, 6), r.closed)
+               for r in LotRollup.query.order_by(LotRollup.lot_id, LotRollup.period, LotRollup.bucket)]
+    return stats, rollups
+
+
+def recomputed():
+    # what the backfill commands would rebuild from the raw reservations
+    with db.engine.begin() as conn:
+        rebuild_user_stats(conn)
+        rebuild_rollups(conn)
+    db.session.expire_all()
+    return aggregates()
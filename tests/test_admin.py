@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import template_rendered
+import admin as admin_module
+from models import db, Lot, Spot, User, Reservation, ReservationArchive
+from archive import archive_reservations, all_reservations
+from spots import park
+from billing import tariff_for, price_stay
+from conftest import login, stay, aggregates, recomputed
+
+
+def edit_spots(client, lot_id, max_spots):
+    return client.post(f'/admin/lot/{lot_id}/edit',
+                       data={'max_spots': max_spots, 'price': 2.0, 'address': 'x'}, follow_redirects=True)
+
+
+def test_deleting_a_lot_removes_its_archived_reservations(app, client, make_lot, make_user):
+    lot_id = make_lot()
+    kept_lot = make_lot(name='Kept')
+    user_id, vehicle_id = make_user('alice')
+    make_user('admin', role='admin')
+    old = datetime.utcnow() - timedelta(days=400)
+    with app.app_context():
+        # the newest row always stays hot, so the last stay is a recent one
+        for lot, parked in ((lot_id, old), (kept_lot, old), (kept_lot, datetime.utcnow())):
+            spot_id = db.session.get(Lot, lot).spots[0].spot_id
+            db.session.add(Reservation(spot_id=spot_id, lot_id=lot, user_id=user_id, vehicle_id=vehicle_id,
+                                       parking_timestamp=parked, leaving_timestamp=parked + timedelta(hours=1),
+                                       amount=1.0, payment_status='Paid'))
+        db.session.commit()
+        archive_reservations(timedelta(days=180))
+        assert ReservationArchive.query.count() == 2
+
+    login(client, 'admin')
+    client.post(f'/admin/lot/{lot_id}/delete')
+
+    with app.app_context():
+        assert db.session.get(Lot, lot_id) is None
+        assert [row.lot_id for row in ReservationArchive.query] == [kept_lot]
+
+
+def test_shrinking_keeps_unpaid_stays_and_the_aggregates(app, client, make_lot, make_user):
+    lot_id = make_lot(spots=3)
+    other_lot = make_lot(name='Other')
+    alice = make_user('alice')
+    bob = make_user('bob')
+    carol = make_user('carol')
+    make_user('admin', role='admin')
+    start = datetime.utcnow() - timedelta(days=3)
+    with app.app_context():
+        paid_spot = stay(*alice, lot_id, start)
+        unpaid_spot = stay(*bob, lot_id, start + timedelta(hours=2), paid=False)
+        # the newest reservation sits elsewhere, so it does not pin a spot here
+        stay(*carol, other_lot, start + timedelta(hours=4))
+        before = aggregates()
+
+    login(client, 'admin')
+    response = edit_spots(client, lot_id, 0)
+    assert b'Cannot reduce spots' in response.data
+    edit_spots(client, lot_id, 1)
+
+    with app.app_context():
+        assert [spot.spot_id for spot in Spot.query.filter_by(lot_id=lot_id)] == [unpaid_spot]
+        assert [row.spot_id for row in ReservationArchive.query] == [paid_spot]
+        assert Reservation.query.filter_by(lot_id=lot_id).one().payment_status == 'Pending'
+        assert aggregates() == before == recomputed()
+
+
+def test_shrinking_keeps_archived_history_with_the_rest(app, client, make_lot, make_user):
+    lot_id = make_lot(spots=3)
+    other_lot = make_lot(name='Other')
+    user_id, vehicle_id = make_user('alice')
+    make_user('admin', role='admin')
+    now = datetime.utcnow()
+    with app.app_context():
+        archived_spot, hot_spot, unused_spot = [spot.spot_id for spot in db.session.get(Lot, lot_id).spots]
+        other_spot = db.session.get(Lot, other_lot).spots[0].spot_id
+        for spot_id, lot, parked in ((archived_spot, lot_id, now - timedelta(days=400)),
+                                     (hot_spot, lot_id, now - timedelta(days=1)),
+                                     (other_spot, other_lot, now - timedelta(hours=2))):
+            db.session.add(Reservation(spot_id=spot_id, lot_id=lot, user_id=user_id, vehicle_id=vehicle_id,
+                                       parking_timestamp=parked, leaving_timestamp=parked + timedelta(hours=1),
+                                       amount=1.0, payment_status='Paid'))
+        db.session.commit()
+        archive_reservations(timedelta(days=180))
+
+    login(client, 'admin')
+    edit_spots(client, lot_id, 1)
+
+    with app.app_context():
+        # a spot with only archived stays still counts as having history
+        assert [spot.spot_id for spot in Spot.query.filter_by(lot_id=lot_id)] == [archived_spot]
+        assert sorted(row.spot_id for row in ReservationArchive.query.filter_by(lot_id=lot_id)) == [archived_spot, hot_spot]
+        assert Reservation.query.filter_by(lot_id=lot_id).count() == 0
+        assert db.session.query(all_reservations()).count() == 3
+
+
+def test_user_search_matches_prefixes_of_username_or_name(app, client, make_user):
+    make_user('admin', role='admin')
+    for username, full_name in (('alice', 'Alice Smith'), ('Alicia', 'Bob Jones'), ('malice', 'Carol Alison'),
+                                ('bob', 'Ali Baba'), ('al_x', 'X')):
+        user_id, _ = make_user(username)
+        with app.app_context():
+            db.session.get(User, user_id).full_name = full_name
+            db.session.commit()
+
+    login(client, 'admin')
+
+    def found(q):
+        html = client.get('/admin/users', query_string={'q': q}).get_data(as_text=True)
+        return sorted(name for name in ('alice', 'Alicia', 'malice', 'bob', 'al_x') if f'>{name}<' in html)
+
+    assert found('ALI') == ['Alicia', 'alice', 'bob']
+    assert found('al_') == ['al_x']
+    assert found('z') == []
+
+
+@contextmanager
+def rendered(app):
+    contexts = []
+
+    def record(sender, template, context, **extra):
+        contexts.append(context)
+
+    template_rendered.connect(record, app)
+    try:
+        yield contexts
+    finally:
+        template_rendered.disconnect(record, app)
+
+
+def test_lot_vehicles_lists_each_parked_car_once(app, client, make_lot, make_user, monkeypatch):
+    lot_id = make_lot(spots=4, price=1.5)
+    other_lot = make_lot(name='Other')
+    users = {name: make_user(name) for name in ('alice', 'bob', 'carol', 'dave')}
+    make_user('admin', role='admin')
+    now = datetime.utcnow()
+    with app.app_context():
+        # carol's old stay on this lot is over and must not show up
+        stay(*users['carol'], lot_id, now - timedelta(days=1))
+        for name, lot, minutes in (('alice', lot_id, 95), ('bob', lot_id, 20), ('dave', other_lot, 40)):
+            user_id, vehicle_id = users[name]
+            park(user_id, vehicle_id, lot, now - timedelta(minutes=minutes, seconds=30))
+
+        # what the old per-spot loop showed: the open stay on each occupied spot
+        tariff = tariff_for(db.session.get(Lot, lot_id))
+        expected = []
+        for spot in Spot.query.filter_by(lot_id=lot_id, status='O').order_by(Spot.spot_id):
+            res = Reservation.query.filter_by(spot_id=spot.spot_id, leaving_timestamp=None).one()
+            expected.append((res.vehicle.v_number, res.user.username, res.vehicle.details, res.parking_timestamp))
+
+    monkeypatch.setattr(admin_module, 'LOT_VEHICLES_PAGE_SIZE', 1)
+    login(client, 'admin')
+    rows = []
+    after = None
+    with rendered(app) as contexts:
+        while True:
+            client.get(f'/admin/lot/{lot_id}', query_string={'after': after} if after else {})
+            rows += contexts[-1]['lot_vehicles']
+            after = contexts[-1]['next_after']
+            if not after:
+                break
+
+    assert sorted((v['vehicle_number'], v['username'], v['details'], v['parked_at']) for v in rows) == sorted(expected)
+    for v in rows:
+        assert v['minutes_parked'] in (95, 96) if v['username'] == 'alice' else v['minutes_parked'] in (20, 21)
+        left = v['parked_at'] + timedelta(minutes=v['minutes_parked'])
+        assert v['revenue'] == price_stay(tariff, v['parked_at'], left)
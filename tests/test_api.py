@@ -0,0 +1,25 @@
+from spots import park
+
+
+def test_lots_answer_304_while_nothing_changes(app, client, make_lot, make_user):
+    lot_id = make_lot(spots=2)
+    other_lot = make_lot(name='Other')
+    user_id, vehicle_id = make_user('alice')
+
+    first = client.get('/api/lots')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert [lot['free'] for lot in first.get_json()['lots']] == [2, 3]
+
+    again = client.get('/api/lots', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and not again.data
+    lot = client.get(f'/api/lots/{lot_id}')
+    assert client.get(f'/api/lots/{lot_id}', headers={'If-None-Match': lot.headers['ETag']}).status_code == 304
+
+    with app.app_context():
+        park(user_id, vehicle_id, other_lot)
+    changed = client.get('/api/lots', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert [lot['free'] for lot in changed.get_json()['lots']] == [2, 2]
+    # the lot alice did not park in keeps its tag
+    assert client.get(f'/api/lots/{lot_id}', headers={'If-None-Match': lot.headers['ETag']}).status_code == 304
+    assert client.get('/api/lots/999').status_code == 404
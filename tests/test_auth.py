@@ -0,0 +1,78 @@
+import pytest
+import auth
+from models import db, User
+from passwords import HashingBusy
+from conftest import login
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    # counts password checks, to show rejected attempts never reach bcrypt
+    calls = []
+    check = auth.check_password
+
+    def counted(password, hashed):
+        calls.append(password)
+        return check(password, hashed)
+
+    monkeypatch.setattr(auth, 'check_password', counted)
+    return calls
+
+
+def test_failed_logins_for_a_user_are_limited(app, client, make_user, hashes, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_USER_LIMIT', 3)
+    make_user('alice', password='right')
+    for _ in range(3):
+        assert login(client, 'alice', 'wrong').status_code == 200
+    assert len(hashes) == 3
+
+    assert login(client, 'alice', 'right').status_code == 429
+    assert len(hashes) == 3
+    # other users are not affected
+    make_user('bob')
+    assert login(client, 'bob').status_code == 302
+
+
+def test_a_successful_login_clears_the_failures(app, client, make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_USER_LIMIT', 2)
+    make_user('alice', password='right')
+    for _ in range(3):
+        login(client, 'alice', 'wrong')
+        client.get('/logout')
+        if login(client, 'alice', 'right').status_code == 429:
+            pytest.fail('locked out despite logging in successfully')
+        client.get('/logout')
+
+
+def test_logins_and_registrations_per_address_are_limited(app, client, make_user, hashes, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_IP_LIMIT', 2)
+    monkeypatch.setitem(app.config, 'REGISTER_IP_LIMIT', 1)
+    make_user('alice')
+    assert [login(client, 'alice', 'wrong').status_code for _ in range(3)] == [200, 200, 429]
+    assert len(hashes) == 2
+
+    form = {'u_name': 'Carol', 'username': 'carol', 'password': 'p'}
+    assert client.post('/register', data=form).status_code == 302
+    assert client.post('/register', data=dict(form, username='dave')).status_code == 429
+    with app.app_context():
+        assert User.query.filter_by(username='dave').first() is None
+
+
+def test_busy_hash_pool_answers_503(client, make_user, monkeypatch):
+    make_user('alice')
+
+    def busy(password, hashed):
+        raise HashingBusy()
+
+    monkeypatch.setattr(auth, 'check_password', busy)
+    assert login(client, 'alice').status_code == 503
+
+
+def test_hash_is_upgraded_when_the_cost_changes(app, client, make_user, monkeypatch):
+    user_id, _ = make_user('alice')
+    monkeypatch.setitem(app.config, 'BCRYPT_ROUNDS', 5)
+    assert login(client, 'alice').status_code == 302
+    with app.app_context():
+        assert bytes(db.session.get(User, user_id).password).startswith(b'$2b$05$')
+    client.get('/logout')
+    assert login(client, 'alice').status_code == 302
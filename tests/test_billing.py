@@ -0,0 +1,87 @@
+import random
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from billing import parse_tariff, price_stay, price_stays, stay_minutes, EPOCH, MINUTE
+
+MONDAY = datetime(2024, 1, 1)
+
+
+def stay(tariff, start, minutes):
+    return price_stay(tariff, start, start + timedelta(minutes=minutes))
+
+
+def test_stays_within_grace_are_free():
+    tariff = parse_tariff(2.0, {'grace_minutes': 10})
+    assert stay(tariff, MONDAY, 10) == 0.0
+    # once past grace the whole stay is charged
+    assert stay(tariff, MONDAY, 11) == 22.0
+
+
+def test_started_units_are_charged_in_full():
+    tariff = parse_tariff(1.0, {'unit_minutes': 30})
+    assert stay(tariff, MONDAY, 30) == 30.0
+    assert stay(tariff, MONDAY, 30.5) == 60.0
+    assert stay(tariff, MONDAY, 61) == 90.0
+
+
+@pytest.mark.parametrize('minutes, amount', [(60, 30.0), (61, 31.0), (120, 90.0), (121, 92.0), (150, 150.0)])
+def test_slab_boundaries(minutes, amount):
+    # 0.5 for the first hour, 1 for the second, then the lot price of 2
+    tariff = parse_tariff(2.0, {'slabs': [[60, 0.5], [120, 1.0]]})
+    assert stay(tariff, MONDAY, minutes) == amount
+
+
+def test_night_window_wraps_past_midnight():
+    tariff = parse_tariff(1.0, {'night_price': 0.1, 'night_start': 22, 'night_end': 6})
+    # 21:00 to 07:00 is two day hours and eight night hours
+    assert stay(tariff, MONDAY.replace(hour=21), 600) == 120 + 48.0
+    assert stay(tariff, MONDAY.replace(hour=23), 60) == 6.0
+
+
+def test_night_window_follows_the_local_offset():
+    # 16:30 UTC is 22:00 at +05:30
+    tariff = parse_tariff(1.0, {'night_price': 0.0, 'night_start': 22, 'night_end': 6}, utc_offset=330)
+    assert stay(tariff, MONDAY.replace(hour=16, minute=30), 60) == 0.0
+    assert stay(tariff, MONDAY.replace(hour=15, minute=30), 60) == 60.0
+
+
+def test_daily_cap_applies_to_each_day_from_arrival():
+    tariff = parse_tariff(1.0, {'daily_cap': 100})
+    assert stay(tariff, MONDAY, 60) == 60.0
+    assert stay(tariff, MONDAY, 1440) == 100.0
+    assert stay(tariff, MONDAY, 1440 + 30) == 130.0
+    assert stay(tariff, MONDAY, 2 * 1440 + 720) == 300.0
+
+
+def test_invalid_tariffs_are_refused():
+    with pytest.raises(ValueError):
+        parse_tariff(1.0, {'surge': 2})
+    with pytest.raises(ValueError):
+        parse_tariff(1.0, {'slabs': [[60, 1.0], [30, 2.0]]})
+    with pytest.raises(ValueError):
+        parse_tariff(1.0, '[1, 2]')
+
+
+TARIFFS = [
+    parse_tariff(2.0),
+    parse_tariff(1.5, {'grace_minutes': 15, 'unit_minutes': 30}),
+    parse_tariff(3.0, {'slabs': [[30, 0.5], [180, 2.0]], 'daily_cap': 400}),
+    parse_tariff(2.0, {'night_price': 0.25, 'night_start': 22, 'night_end': 6, 'unit_minutes': 15,
+                       'daily_cap': 900}, utc_offset=330),
+    parse_tariff(2.0, {'night_price': 0.5, 'night_start': 1, 'night_end': 5, 'grace_minutes': 5}),
+]
+
+
+@pytest.mark.parametrize('tariff', TARIFFS)
+def test_batch_and_single_stay_prices_agree(tariff):
+    rng = random.Random(7)
+    parked = [MONDAY + timedelta(seconds=rng.randrange(30 * 86400)) for _ in range(500)]
+    left = [p + timedelta(seconds=rng.randrange(4 * 86400)) for p in parked]
+    left[:3] = parked[:3]
+
+    single = [price_stay(tariff, p, l) for p, l in zip(parked, left)]
+    starts, durations = stay_minutes([p.isoformat(' ') for p in parked], [l.isoformat(' ') for l in left])
+    batch = price_stays(tariff, starts, durations)
+    assert batch.tolist() == single
+    assert np.array_equal(starts, [(p - EPOCH) / MINUTE for p in parked])
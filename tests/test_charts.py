@@ -0,0 +1,26 @@
+import subprocess
+import sys
+from conftest import ROOT
+
+SCRIPT = '''
+import sys
+sys.path.insert(0, {root!r})
+# module-level code, like app.py's, that chart workers must not run again
+with open({marker!r}, 'a') as f:
+    f.write('run\\n')
+
+from charts import chart_cache
+
+if __name__ == '__main__':
+    key, png = chart_cache.get('pie', {{'labels': ['A', 'B'], 'values': [1, 2]}})
+    assert png.startswith(b'\\x89PNG'), png[:20]
+'''
+
+
+def test_chart_workers_do_not_rerun_the_main_script(tmp_path):
+    marker = tmp_path / 'runs'
+    script = tmp_path / 'main.py'
+    script.write_text(SCRIPT.format(root=ROOT, marker=str(marker)))
+    result = subprocess.run([sys.executable, str(script)], cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert marker.read_text() == 'run\n'
@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, insert, select, func
+from models import db, User, Vehicle, Lot, Spot, Reservation
+from migrations import upgrade
+
+STRESS_USERS = int(os.environ.get('STRESS_USERS', 2000))
+STRESS_SPOTS = int(os.environ.get('STRESS_SPOTS', 300))
+STRESS_WORKERS = int(os.environ.get('STRESS_WORKERS', 8))
+
+_app = None
+
+
+def _init_worker(url):
+    # each process is its own app with its own spot index, like a gunicorn worker
+    global _app
+    os.environ['DATABASE_URL'] = url
+    os.environ['APP_PROFILE'] = 'production'
+    from app import app
+    _app = app
+
+
+def _park(user_id):
+    from spots import park
+    with _app.app_context():
+        reservation, error = park(user_id, user_id, 1)
+        return error
+
+
+def _seed(engine):
+    db.metadata.create_all(engine)
+    upgrade(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Lot.__table__).values(lot_id=1, location_name='Stress', price=1.0, max_spots=STRESS_SPOTS))
+        conn.execute(insert(Spot.__table__), [{'lot_id': 1, 'status': 'A'}] * STRESS_SPOTS)
+        conn.execute(insert(User.__table__), [
+            {'id': i, 'username': f's{i}', 'password': 'x', 'role': 'user'} for i in range(1, STRESS_USERS + 1)
+        ])
+        conn.execute(insert(Vehicle.__table__), [
+            {'v_id': i, 'v_number': f'S{i}', 'user_id': i} for i in range(1, STRESS_USERS + 1)
+        ])
+
+
+def test_parallel_parks_never_share_a_spot(tmp_path):
+    url = f"sqlite:///{tmp_path / 'stress.db'}"
+    engine = create_engine(url)
+    _seed(engine)
+
+    # every user parks twice at once, so both spots and users are contended
+    users = [user_id for user_id in range(1, STRESS_USERS + 1) for _ in range(2)]
+    with ProcessPoolExecutor(
+        max_workers=STRESS_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(url,),
+    ) as pool:
+        errors = Counter(pool.map(_park, users, chunksize=25))
+
+    with engine.connect() as conn:
+        active = conn.execute(
+            select(Reservation.spot_id, Reservation.user_id).where(Reservation.leaving_timestamp.is_(None))
+        ).all()
+        occupied = conn.execute(select(func.count()).where(Spot.status == 'O')).scalar()
+
+    spots = Counter(spot_id for spot_id, _ in active)
+    holders = Counter(user_id for _, user_id in active)
+    assert not [spot_id for spot_id, count in spots.items() if count > 1]
+    assert not [user_id for user_id, count in holders.items() if count > 1]
+    assert len(active) == occupied == STRESS_SPOTS
+    assert errors[None] == STRESS_SPOTS
+    assert set(errors) <= {None, 'full', 'already_parked', 'busy'}
@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+from conftest import ROOT
+
+REPORT = '''
+import json
+from app import app
+from models import db
+with app.app_context():
+    with db.engine.connect() as conn:
+        pragmas = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                   for name in ('journal_mode', 'busy_timeout', 'synchronous')}
+    print(json.dumps({'pragmas': pragmas, 'pool_size': db.engine.pool.size()}))
+'''
+
+
+def boot(tmp_path, **settings):
+    # the profile is read when app.py is imported, so each one needs a fresh interpreter
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'app.db'}", **settings)
+    result = subprocess.run([sys.executable, '-c', REPORT], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_production_profile_uses_wal_and_a_sized_pool(tmp_path):
+    report = boot(tmp_path, APP_PROFILE='production', DB_POOL_SIZE='7', SQLITE_BUSY_TIMEOUT='1234')
+    # synchronous NORMAL is 1
+    assert report['pragmas'] == {'journal_mode': 'wal', 'busy_timeout': 1234, 'synchronous': 1}
+    assert report['pool_size'] == 7
+
+
+def test_development_profile_keeps_sqlite_defaults(tmp_path):
+    report = boot(tmp_path, APP_PROFILE='development')
+    assert report['pragmas']['journal_mode'] == 'delete'
+
+
+def test_unknown_profile_is_refused(tmp_path):
+    env = dict(os.environ, APP_PROFILE='staging')
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "Unknown APP_PROFILE 'staging'" in result.stderr
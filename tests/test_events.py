@@ -0,0 +1,31 @@
+import json
+
+
+def test_stream_starts_with_a_snapshot(client, make_lot):
+    lot_id = make_lot(spots=2)
+    response = client.get('/api/lots/stream')
+    try:
+        assert response.mimetype == 'text/event-stream'
+        event = next(response.response).decode()
+        assert event.startswith('event: snapshot')
+        [lot] = json.loads(event.split('data: ', 1)[1])
+        assert (lot['id'], lot['free']) == (lot_id, 2)
+    finally:
+        response.close()
+
+
+def test_displays_over_the_limit_are_turned_away(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SSE_MAX_SUBSCRIBERS', 2)
+    streams = [client.get('/api/lots/stream') for _ in range(2)]
+    try:
+        busy = client.get('/api/lots/stream')
+        assert busy.status_code == 503
+        assert busy.headers['Retry-After']
+
+        # a display that disconnects, even before its first event, frees its place
+        streams.pop().close()
+        streams.append(client.get('/api/lots/stream'))
+        assert streams[-1].status_code == 200
+    finally:
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,48 @@
+import csv
+from datetime import datetime, timedelta
+from models import db, Lot, Reservation
+
+
+def add_stay(lot_id, user_id, vehicle_id, closed):
+    parked = datetime.utcnow() - timedelta(hours=2)
+    spot_id = db.session.get(Lot, lot_id).spots[0].spot_id
+    reservation = Reservation(spot_id=spot_id, lot_id=lot_id, user_id=user_id, vehicle_id=vehicle_id,
+                              parking_timestamp=parked, payment_status='Parked')
+    if closed:
+        reservation.leaving_timestamp = parked + timedelta(hours=1)
+        reservation.amount = 1.0
+        reservation.payment_status = 'Pending'
+    db.session.add(reservation)
+    db.session.commit()
+    return reservation.r_id
+
+
+def export(app, tmp_path, watermark):
+    out = tmp_path / 'out.csv'
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=['export-reservations', '--out', str(out), '--watermark', str(watermark)])
+    assert result.exit_code == 0, result.output
+    with open(out) as f:
+        return [int(row['r_id']) for row in csv.DictReader(f)]
+
+
+def test_watermark_exports_open_stays_once_they_close(app, tmp_path, make_lot, make_user):
+    lot_id = make_lot()
+    alice = make_user('alice')
+    bob = make_user('bob')
+    watermark = tmp_path / 'watermark'
+    with app.app_context():
+        open_id = add_stay(lot_id, *alice, closed=False)
+        closed_id = add_stay(lot_id, *bob, closed=True)
+
+    assert export(app, tmp_path, watermark) == [closed_id]
+
+    with app.app_context():
+        reservation = db.session.get(Reservation, open_id)
+        reservation.leaving_timestamp = datetime.utcnow()
+        reservation.payment_status = 'Pending'
+        db.session.commit()
+        later_id = add_stay(lot_id, *bob, closed=True)
+
+    assert export(app, tmp_path, watermark) == [open_id, later_id]
+    assert export(app, tmp_path, watermark) == []
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+import gate as gate_module
+from models import db, Spot, Reservation
+from gate import parse_timestamp
+from bookings import due_booking
+from spots import spot_index
+
+
+@pytest.fixture
+def gate(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'GATE_API_KEY', 'gate-key')
+
+    def send(*events):
+        response = client.post('/api/gate/events', json={'events': list(events)}, headers={'X-Gate-Key': 'gate-key'})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()['results']
+    return send
+
+
+def test_offsets_are_converted_to_utc():
+    assert parse_timestamp('2024-05-01T15:30:00+05:30') == datetime(2024, 5, 1, 10, 0)
+    assert parse_timestamp('2024-05-01T10:00:00Z') == datetime(2024, 5, 1, 10, 0)
+    assert parse_timestamp('2024-05-01T10:00:00') == datetime(2024, 5, 1, 10, 0)
+
+
+def test_entry_and_exit_with_offsets(app, gate, make_lot, make_user):
+    lot_id = make_lot()
+    make_user('alice', v_number='KA01')
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=2)
+    local = start + timedelta(hours=5, minutes=30)
+
+    [entry] = gate({'event_id': 1, 'type': 'entry', 'v_number': 'KA01', 'lot_id': lot_id,
+                    'timestamp': local.isoformat() + '+05:30'})
+    assert entry['ok'], entry
+    [exit_] = gate({'event_id': 2, 'type': 'exit', 'v_number': 'KA01', 'lot_id': lot_id,
+                    'timestamp': (start + timedelta(hours=1)).isoformat() + 'Z'})
+    assert exit_['ok'], exit_
+    with app.app_context():
+        reservation = db.session.get(Reservation, entry['r_id'])
+        assert reservation.parking_timestamp == start
+        assert reservation.leaving_timestamp == start + timedelta(hours=1)
+
+
+def test_future_and_backwards_timestamps_are_rejected(app, gate, make_lot, make_user):
+    lot_id = make_lot()
+    make_user('bob', v_number='KA02')
+    now = datetime.utcnow().replace(microsecond=0)
+
+    [future] = gate({'type': 'entry', 'v_number': 'KA02', 'lot_id': lot_id,
+                     'timestamp': (now + timedelta(days=1)).isoformat()})
+    assert future['error'] == 'future_timestamp'
+
+    [entry] = gate({'type': 'entry', 'v_number': 'KA02', 'lot_id': lot_id, 'timestamp': now.isoformat()})
+    assert entry['ok']
+    [early] = gate({'type': 'exit', 'v_number': 'KA02', 'lot_id': lot_id,
+                    'timestamp': (now - timedelta(hours=1)).isoformat()})
+    assert early['error'] == 'exit_before_entry'
+    with app.app_context():
+        assert db.session.get(Reservation, entry['r_id']).leaving_timestamp is None
+
+
+def free_in_database(lot_id):
+    return {spot.spot_id for spot in Spot.query.filter_by(lot_id=lot_id, status='A')}
+
+
+def test_user_parked_elsewhere_mid_batch_rejects_only_that_entry(app, gate, make_lot, make_user, monkeypatch):
+    lot_id = make_lot()
+    alice, alice_car = make_user('alice', v_number='KA01')
+    make_user('bob', v_number='KA02')
+    other_worker = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    raced = []
+
+    def due_booking_after_race(pending, vehicle_id, lot, when):
+        # another worker parks alice after this batch has read who is parked
+        if not raced:
+            raced.append(True)
+            with other_worker.begin() as conn:
+                spot_id = conn.execute(text("SELECT MAX(spot_id) FROM spots WHERE status = 'A'")).scalar()
+                conn.execute(text("UPDATE spots SET status = 'O' WHERE spot_id = :s"), {'s': spot_id})
+                conn.execute(text(
+                    'INSERT INTO reservations (spot_id, lot_id, user_id, vehicle_id, parking_timestamp, payment_status) '
+                    "VALUES (:s, :l, :u, :v, :t, 'Parked')"
+                ), {'s': spot_id, 'l': lot, 'u': alice, 'v': alice_car, 't': when})
+        return due_booking(pending, vehicle_id, lot, when)
+
+    monkeypatch.setattr(gate_module, 'due_booking', due_booking_after_race)
+    results = gate({'event_id': 1, 'type': 'entry', 'v_number': 'KA01', 'lot_id': lot_id},
+                   {'event_id': 2, 'type': 'entry', 'v_number': 'KA02', 'lot_id': lot_id})
+    other_worker.dispose()
+
+    assert [r.get('error') for r in results] == ['already_parked', None]
+    with app.app_context():
+        assert Reservation.query.filter(Reservation.leaving_timestamp.is_(None)).count() == 2
+        assert free_in_database(lot_id) <= spot_index.free_spots(lot_id)
+
+
+def test_spots_claimed_by_a_failed_attempt_go_back(app, gate, make_lot, make_user, monkeypatch):
+    lot_id = make_lot(spots=2)
+    make_user('alice', v_number='KA01')
+    make_user('bob', v_number='KA02')
+    commit = db.session.commit
+    failures = []
+
+    def locked_once():
+        if not failures:
+            failures.append(True)
+            raise OperationalError('COMMIT', {}, Exception('database is locked'))
+        commit()
+
+    monkeypatch.setattr(db.session, 'commit', locked_once)
+    results = gate({'type': 'entry', 'v_number': 'KA01', 'lot_id': lot_id},
+                   {'type': 'entry', 'v_number': 'KA02', 'lot_id': lot_id})
+
+    assert failures and all(r['ok'] for r in results)
+    with app.app_context():
+        assert free_in_database(lot_id) == spot_index.free_spots(lot_id) == set()
+
+
+def test_malformed_events_are_rejected_one_by_one(gate, make_lot, make_user):
+    lot_id = make_lot()
+    make_user('alice', v_number='KA01')
+    make_user('bob', v_number='KA02')
+
+    results = gate({'event_id': 1, 'type': 'entry', 'v_number': 'KA01', 'lot_id': lot_id, 'timestamp': 1714557600},
+                   {'event_id': 2, 'type': 'entry', 'v_number': 'KA01', 'lot_id': [lot_id]},
+                   {'event_id': 3, 'type': 'entry', 'v_number': 'KA01', 'lot_id': {'id': lot_id}},
+                   {'event_id': 4, 'type': 'entry', 'v_number': 'KA02', 'lot_id': lot_id})
+    assert [r.get('error') for r in results] == ['invalid_timestamp', 'unknown_lot', 'unknown_lot', None]
+
+
+def test_non_ascii_gate_key_is_forbidden(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'GATE_API_KEY', 'gate-key')
+    response = client.post('/api/gate/events', json={'events': []}, headers={'X-Gate-Key': 'gäte-key'})
+    assert response.status_code == 403
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from models import db, Lot, Reservation
+from archive import archive_reservations
+from history import history_query, history_page, history_stream
+
+
+def add_stays(lot_id, user_id, vehicle_id, count, start):
+    spot_id = db.session.get(Lot, lot_id).spots[0].spot_id
+    for i in range(count):
+        parked = start + timedelta(hours=i)
+        db.session.add(Reservation(spot_id=spot_id, lot_id=lot_id, user_id=user_id, vehicle_id=vehicle_id,
+                                   parking_timestamp=parked, leaving_timestamp=parked + timedelta(minutes=30),
+                                   amount=1.0, payment_status='Paid'))
+    db.session.commit()
+
+
+def test_pages_stay_stable_while_new_stays_arrive(app, make_lot, make_user):
+    lot_id = make_lot()
+    user_id, vehicle_id = make_user('alice')
+    with app.app_context():
+        # older stays sit in the archive, so pages cross both tables
+        add_stays(lot_id, user_id, vehicle_id, 4, datetime.utcnow() - timedelta(days=400))
+        add_stays(lot_id, user_id, vehicle_id, 3, datetime.utcnow() - timedelta(days=1))
+        archive_reservations(timedelta(days=180))
+        expected = [row.r_id for row in history_query()]
+        assert len(expected) == 7
+
+        seen = []
+        page, before = history_page(history_query(), page_size=3)
+        seen += [row['r_id'] for row in page]
+        # newer stays land after the first page was read
+        add_stays(lot_id, user_id, vehicle_id, 2, datetime.utcnow() - timedelta(hours=1))
+        while before:
+            page, before = history_page(history_query(before=before), page_size=3)
+            seen += [row['r_id'] for row in page]
+
+        assert seen == expected
+        assert [row['r_id'] for row in history_stream(history_query())] == [max(expected) + 2, max(expected) + 1] + expected
+
+
+def test_filters_apply_to_pages(app, make_lot, make_user):
+    lot_id = make_lot()
+    other_lot = make_lot(name='Other')
+    alice = make_user('alice')
+    bob = make_user('bob')
+    day = datetime(2024, 3, 10, 9)
+    with app.app_context():
+        add_stays(lot_id, *alice, 2, day)
+        add_stays(other_lot, *alice, 1, day + timedelta(days=1))
+        add_stays(lot_id, *bob, 1, day)
+
+        def users(**filters):
+            return [row['username'] for row in history_page(history_query(**filters))[0]]
+
+        assert users(lot_id=lot_id) == ['bob', 'alice', 'alice']
+        assert users(username='alice') == ['alice'] * 3
+        assert users(date_from=day + timedelta(days=1)) == ['alice']
+        assert users(date_to=day, lot_id=other_lot) == []
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine, text
+from snapshot import lot_snapshot
+from conftest import login
+
+
+def test_free_counts_include_spots_taken_by_other_workers(app, client, make_lot, make_user):
+    lot_id = make_lot(spots=3, pin_code='600001')
+    make_user('alice')
+    other_worker = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    with other_worker.begin() as conn:
+        conn.execute(text("UPDATE spots SET status = 'O' WHERE spot_id = (SELECT MIN(spot_id) FROM spots WHERE lot_id = :l)"),
+                     {'l': lot_id})
+    other_worker.dispose()
+    # as if the snapshot's short TTL had run out
+    lot_snapshot.invalidate()
+
+    [lot] = client.get('/api/lots/search?pin=600001').get_json()['lots']
+    assert lot['free'] == 2
+
+    login(client, 'alice')
+    assert b'(2 free)' in client.get('/park').data
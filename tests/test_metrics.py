@@ -0,0 +1,56 @@
+import re
+import pytest
+from profiling import route_metrics
+from conftest import login
+
+
+@pytest.fixture
+def metrics(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', True)
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape')
+    monkeypatch.setattr(route_metrics, '_routes', {})
+
+    def scrape():
+        response = client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+        assert response.status_code == 200
+        samples = {}
+        for line in response.get_data(as_text=True).splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+    return scrape
+
+
+def test_metrics_count_requests_queries_and_hashing(client, make_lot, make_user, metrics):
+    make_lot()
+    make_user('alice')
+    client.get('/api/lots')
+    client.get('/api/lots')
+    login(client, 'alice')
+
+    samples = metrics()
+    lots = 'endpoint="api.lots_availability",method="GET"'
+    assert samples[f'parking_request_seconds_count{{{lots}}}'] == 2
+    assert samples[f'parking_request_seconds_bucket{{{lots},le="+Inf"}}'] == 2
+    assert samples[f'parking_sql_queries_total{{{lots}}}'] >= 1
+    assert samples['parking_section_seconds_total{endpoint="auth.login",method="POST",section="bcrypt"}'] > 0
+    # the scrape itself is only counted once it has been answered
+    assert not any(re.search(r'endpoint="metrics"', name) for name in samples)
+
+
+def test_metrics_need_the_token(client, metrics):
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrapé'}).status_code == 403
+
+
+def test_metrics_are_off_by_default_in_development(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_debug_responses_carry_timing_headers(app, client, monkeypatch):
+    monkeypatch.setattr(app, 'debug', True)
+    response = client.get('/api/lots')
+    assert response.headers['X-SQL-Count'].isdigit()
+    assert response.headers['X-Request-Time'].endswith('ms')
@@ -0,0 +1,111 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from sqlalchemy import create_engine, inspect, text, select, func
+from sqlalchemy.exc import IntegrityError
+import migrations
+from migrations import MIGRATIONS, upgrade
+from models import Spot, Vehicle, Reservation, User
+from admin import prefix_match
+from conftest import ROOT
+
+BASELINE_DB = os.path.join(ROOT, 'instance', 'parking_app.db')
+
+
+def baseline_copy(tmp_path):
+    path = tmp_path / 'parking_app.db'
+    shutil.copy(BASELINE_DB, path)
+    return path
+
+
+def import_app(path):
+    # a fresh interpreter, exactly as a worker booting on an existing database
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+    return subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_baseline_database_upgrades_on_import(tmp_path):
+    path = baseline_copy(tmp_path)
+    result = import_app(path)
+    assert result.returncode == 0, result.stderr
+
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.connect() as conn:
+        versions = conn.execute(text('SELECT version FROM schema_migrations ORDER BY version')).scalars().all()
+        stats = conn.execute(text('SELECT user_id, bookings FROM user_stats')).all()
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    assert stats == [(2, 2)]
+    tables = set(inspect(engine).get_table_names())
+    assert {'user_stats', 'reservations_archive', 'lot_rollups', 'sessions', 'bookings'} <= tables
+
+    # a second boot finds nothing to do
+    assert import_app(path).returncode == 0
+
+
+def test_duplicate_active_reservations_are_closed_before_the_unique_index(tmp_path):
+    path = baseline_copy(tmp_path)
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX IF EXISTS uq_reservations_active_user'))
+        user_id, vehicle_id = conn.execute(text('SELECT id, v_id FROM users JOIN vehicles ON user_id = id LIMIT 1')).one()
+        spots = conn.execute(text("SELECT spot_id, lot_id FROM spots WHERE status = 'A' LIMIT 2")).all()
+        for spot_id, lot_id in spots:
+            conn.execute(text(
+                'INSERT INTO reservations (spot_id, lot_id, user_id, vehicle_id, parking_timestamp, payment_status) '
+                "VALUES (:s, :l, :u, :v, '2024-01-01 10:00:00', 'Parked')"
+            ), {'s': spot_id, 'l': lot_id, 'u': user_id, 'v': vehicle_id})
+            conn.execute(text("UPDATE spots SET status = 'O' WHERE spot_id = :s"), {'s': spot_id})
+
+    upgrade(engine)
+
+    with engine.connect() as conn:
+        active = conn.execute(text(
+            'SELECT spot_id FROM reservations WHERE user_id = :u AND leaving_timestamp IS NULL'
+        ), {'u': user_id}).scalars().all()
+        statuses = dict(conn.execute(text('SELECT spot_id, status FROM spots WHERE spot_id IN (:a, :b)'),
+                                     {'a': spots[0][0], 'b': spots[1][0]}).all())
+        versions = conn.execute(text('SELECT version FROM schema_migrations ORDER BY version')).scalars().all()
+    assert active == [spots[1][0]]
+    assert statuses == {spots[0][0]: 'A', spots[1][0]: 'O'}
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    assert 'uq_reservations_active_user' in {index['name'] for index in inspect(engine).get_indexes('reservations')}
+
+
+def test_failing_migration_is_not_recorded(tmp_path, monkeypatch):
+    def broken(conn):
+        raise IntegrityError('INSERT', {}, Exception('constraint failed'))
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'broken.db'}")
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [(1, 'broken', broken)])
+    with pytest.raises(IntegrityError):
+        upgrade(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM schema_migrations')).scalar() == 0
+
+
+HOT_QUERIES = [
+    (select(Spot.spot_id).where(Spot.lot_id == 1, Spot.status == 'A'), 'ix_spots_lot_status'),
+    (select(Vehicle.v_id).where(Vehicle.user_id == 1), 'ix_vehicles_user_id'),
+    (select(Reservation.r_id).where(Reservation.user_id == 1, Reservation.leaving_timestamp.is_(None)),
+     ('uq_reservations_active_user', 'ix_reservations_user_leaving')),
+    (select(Reservation.r_id).where(Reservation.spot_id == 1, Reservation.leaving_timestamp.is_(None)),
+     'ix_reservations_spot_leaving'),
+    (select(func.count()).where(Reservation.lot_id == 1, Reservation.leaving_timestamp.is_(None)),
+     'ix_reservations_lot_leaving'),
+    (select(User.id).where(prefix_match(User.username, 'Ali')), 'ix_users_username_lower'),
+    (select(User.id).where(prefix_match(User.full_name, 'ali')), 'ix_users_full_name_lower'),
+]
+
+
+@pytest.mark.parametrize('query, indexes', HOT_QUERIES)
+def test_hot_queries_use_their_index(tmp_path, query, indexes):
+    path = baseline_copy(tmp_path)
+    engine = create_engine(f'sqlite:///{path}')
+    upgrade(engine)
+    sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+    with engine.connect() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+    indexes = (indexes,) if isinstance(indexes, str) else indexes
+    assert any(f'INDEX {index}' in plan for index in indexes), plan
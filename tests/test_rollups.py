@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+import pytest
+from models import db
+from archive import archive_reservations, all_reservations
+from rollups import lot_trend
+from conftest import stay, aggregates, recomputed
+
+
+def test_rollups_agree_with_the_raw_reservations(app, make_lot, make_user):
+    lot_id = make_lot()
+    other_lot = make_lot(name='Other')
+    alice = make_user('alice')
+    bob = make_user('bob')
+    day = datetime(2024, 3, 10)
+    with app.app_context():
+        # within an hour, across hours, across midnight and over several days
+        stay(*alice, lot_id, day.replace(hour=9, minute=10), hours=0.5)
+        stay(*bob, lot_id, day.replace(hour=9, minute=45), hours=2.25)
+        stay(*alice, lot_id, day.replace(hour=22, minute=30), hours=3, paid=False)
+        stay(*bob, other_lot, day + timedelta(days=1, hours=8), hours=50)
+        stay(*alice, other_lot, datetime.utcnow() - timedelta(hours=1))
+        # archived stays still count; the unpaid one stays hot
+        assert archive_reservations(timedelta(days=30)) == 3
+
+        assert aggregates()[1] == recomputed()[1]
+
+        res = all_reservations()
+        raw = db.session.query(res.c.parking_timestamp, res.c.leaving_timestamp, res.c.amount).all()
+        trend = lot_trend(period='day', since=day)
+        assert sum(row['closed'] for row in trend) == len(raw) == 5
+        assert sum(row['occupied_minutes'] for row in trend) == pytest.approx(
+            sum((left - parked).total_seconds() / 60 for parked, left, _ in raw))
+        assert sum(row['revenue'] for row in trend) == pytest.approx(sum(amount for _, _, amount in raw), abs=0.05)
+
+        hours = {row['bucket']: row['occupied_minutes'] for row in lot_trend(lot_id, 'hour', since=day)}
+        assert hours[day.replace(hour=9)] == 30 + 15
+        assert hours[day.replace(hour=10)] == 60
+        assert hours[day.replace(hour=23)] == 60
+        assert hours[day + timedelta(days=1)] == 60
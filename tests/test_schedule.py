@@ -0,0 +1,61 @@
+import random
+from datetime import datetime, timedelta
+from schedule import LotSchedule
+from spots import SpotIndex
+
+T0 = datetime(2024, 1, 1)
+
+
+def minutes(n):
+    return T0 + timedelta(minutes=n)
+
+
+def test_lot_schedule_agrees_with_a_brute_force_scan():
+    rng = random.Random(7)
+    spots = range(1, 41)
+    lot = LotSchedule(spots, {})
+    live = {}
+    for booking_id in range(1, 400):
+        action = rng.random()
+        if action < 0.6:
+            spot_id = rng.choice(spots)
+            start = rng.randrange(0, 2000, 5)
+            end = start + rng.randrange(5, 120, 5)
+            if not any(s == spot_id and a < end and start < b for s, a, b in live.values()):
+                lot.add(spot_id, minutes(start), minutes(end), booking_id)
+                live[booking_id] = (spot_id, start, end)
+        elif action < 0.85 and live:
+            gone = rng.choice(list(live))
+            spot_id, start, _ = live.pop(gone)
+            lot.remove(spot_id, minutes(start), gone)
+        else:
+            cutoff = rng.randrange(0, 2000, 5)
+            lot.prune(minutes(cutoff))
+            live = {b: w for b, w in live.items() if w[2] > cutoff}
+
+        start = rng.randrange(0, 2000, 5)
+        end = start + 60
+        busy = {s for s, a, b in live.values() if a < end and start < b}
+        assert lot.held(minutes(start), minutes(end)) == busy
+        assert lot.unbooked == set(spots) - {s for s, _, _ in live.values()}
+        assert lot.upcoming == sorted(lot.upcoming)
+        skip = set(rng.sample(spots, 5))
+        found = lot.find_free(minutes(start), minutes(end), skip=skip)
+        free = set(spots) - busy - skip
+        assert found in free if free else found is None
+
+
+def test_find_free_only_considers_the_given_spots():
+    lot = LotSchedule([1, 2, 3], {})
+    lot.add(2, minutes(0), minutes(60), 1)
+    assert lot.find_free(minutes(0), minutes(30), only={2, 3}) == 3
+    assert lot.find_free(minutes(0), minutes(30), only={2}) is None
+    assert lot.find_free(minutes(60), minutes(90), only={2}) == 2
+
+
+def test_allocate_skips_excluded_spots_and_keeps_them_free():
+    index = SpotIndex()
+    index._free[1] = {1, 2, 3}
+    assert index.allocate(1, exclude={1, 2}) == 3
+    assert index.allocate(1, exclude={1, 2}) is None
+    assert index._free[1] == {1, 2}
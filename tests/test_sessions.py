@@ -0,0 +1,79 @@
+from itsdangerous import BadSignature
+from models import db, SessionRecord
+from conftest import login
+
+
+def session_id(client, app):
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    if cookie is None:
+        return None
+    try:
+        return app.session_interface._signer(app).unsign(cookie.value).decode('utf-8')
+    except BadSignature:
+        return None
+
+
+def stored(app, sid):
+    with app.app_context():
+        return db.session.get(SessionRecord, sid) is not None
+
+
+def test_login_gets_a_new_session_id(client, app, make_user):
+    make_user('alice')
+    # an anonymous visit already leaves a session behind for its flash message
+    client.get('/user/dashboard')
+    before = session_id(client, app)
+    assert before and stored(app, before)
+
+    login(client, 'alice')
+    after = session_id(client, app)
+    assert after != before
+    assert stored(app, after) and not stored(app, before)
+    assert client.get('/user/dashboard').status_code == 200
+
+
+def test_tampered_cookie_is_a_fresh_session(client, app, make_user):
+    make_user('alice')
+    login(client, 'alice')
+    sid = session_id(client, app)
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+    # a different id under the old signature; the signature's last character
+    # can carry unused bits, so changing that alone may still verify
+    forged = ('A' if cookie[0] != 'A' else 'B') + cookie[1:]
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], forged)
+
+    response = client.get('/user/dashboard')
+    assert response.status_code == 302 and '/login' in response.location
+    assert session_id(client, app) not in (None, sid)
+    # the real session is untouched
+    assert stored(app, sid)
+
+
+def test_logout_deletes_the_stored_session(client, app, make_user):
+    make_user('alice')
+    login(client, 'alice')
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+    sid = session_id(client, app)
+
+    client.get('/logout')
+    assert not stored(app, sid)
+    # replaying the old cookie gets nowhere
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], cookie)
+    assert client.get('/user/dashboard').status_code == 302
+
+
+def test_users_are_kept_out_of_admin_pages(client, make_user):
+    make_user('alice')
+    login(client, 'alice')
+    response = client.get('/admin/users')
+    assert response.status_code == 302 and '/login' in response.location
+    assert b'Admins only' in client.get(response.location).data
+
+
+def test_api_views_answer_403_json(client, make_user):
+    assert client.get('/admin/trends.json').status_code == 403
+    make_user('alice')
+    login(client, 'alice')
+    response = client.get('/admin/trends.json')
+    assert response.status_code == 403
+    assert response.get_json() == {'error': 'forbidden'}
@@ -0,0 +1,54 @@
+from models import db, Lot, Spot
+from spots import spot_index, park, check_spots_command
+from conftest import login
+
+
+def test_check_spots_reports_a_stale_index(app, make_lot):
+    lot_id = make_lot(spots=2)
+    runner = app.test_cli_runner()
+    with app.app_context():
+        result = runner.invoke(check_spots_command)
+    assert result.exit_code == 0 and 'consistent' in result.output
+
+    with app.app_context():
+        spot = Spot.query.filter_by(lot_id=lot_id).first()
+        spot.status = 'O'
+        spot_id = spot.spot_id
+        db.session.commit()
+        result = runner.invoke(check_spots_command)
+    assert result.exit_code == 1
+    assert f'Lot {lot_id}: missing [], stale [{spot_id}]' in result.output
+
+
+def lot_spots(lot_id):
+    return [spot.spot_id for spot in Spot.query.filter_by(lot_id=lot_id).order_by(Spot.spot_id)]
+
+
+def test_bulk_grow_and_shrink_keep_numbering_and_counts(app, client, make_user):
+    user_id, vehicle_id = make_user('alice')
+    make_user('admin', role='admin')
+    login(client, 'admin')
+    client.post('/admin/parking_lot/create', data={
+        'location_name': 'Garage', 'price': 2.0, 'address': 'x', 'pin_code': '600001', 'max_spots': 5,
+    })
+    with app.app_context():
+        lot_id = Lot.query.one().lot_id
+        created = lot_spots(lot_id)
+    assert len(created) == 5
+
+    edit = {'price': 2.0, 'address': 'x'}
+    client.post(f'/admin/lot/{lot_id}/edit', data=dict(edit, max_spots=8))
+    with app.app_context():
+        grown = lot_spots(lot_id)
+        # new spots carry on from the existing numbering
+        assert grown == list(range(created[0], created[0] + 8))
+        reservation, _ = park(user_id, vehicle_id, lot_id)
+        occupied = reservation.spot_id
+
+    client.post(f'/admin/lot/{lot_id}/edit', data=dict(edit, max_spots=3))
+    with app.app_context():
+        # the newest free spots go, the occupied one stays whatever its number
+        newest_free = sorted(set(grown) - {occupied})[-5:]
+        assert lot_spots(lot_id) == sorted(set(grown) - set(newest_free))
+        assert db.session.get(Lot, lot_id).max_spots == 3
+        assert spot_index.free_spots(lot_id) == set(lot_spots(lot_id)) - {occupied}
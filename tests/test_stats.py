@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from models import db, Reservation
+from stats import user_totals
+from conftest import login, stay, aggregates, recomputed
+
+
+def user_stats():
+    return aggregates()[0]
+
+
+def test_user_stats_follow_park_leave_pay_and_lot_deletion(app, client, make_lot, make_user):
+    lot_id = make_lot()
+    other_lot = make_lot(name='Other')
+    alice, alice_car = make_user('alice')
+    bob = make_user('bob')
+    make_user('admin', role='admin')
+    with app.app_context():
+        stay(*bob, other_lot, datetime.utcnow() - timedelta(days=2))
+        stay(alice, alice_car, other_lot, datetime.utcnow() - timedelta(days=1), paid=False)
+
+    login(client, 'alice')
+    client.post('/park', data={'vehicle_id': alice_car, 'lot_id': lot_id})
+    with app.app_context():
+        reservation = Reservation.query.filter_by(user_id=alice, leaving_timestamp=None).one()
+        r_id, spot_id = reservation.r_id, reservation.spot_id
+        assert user_stats() == recomputed()[0]
+    client.post(f'/leave/{spot_id}')
+    with app.app_context():
+        assert user_stats() == recomputed()[0]
+    client.post(f'/pay/{r_id}')
+    with app.app_context():
+        assert user_stats() == recomputed()[0]
+        assert user_totals(alice)['total_bookings'] == 2
+
+    client.get('/logout')
+    login(client, 'admin')
+    client.post(f'/admin/lot/{other_lot}/delete')
+    with app.app_context():
+        stats = user_stats()
+        assert stats == recomputed()[0]
+        # bob's only stay went with the lot
+        assert [row[0] for row in stats] == [alice]
+        assert user_totals(alice)['total_bookings'] == 1
@@ -1,15 +1,39 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from models import db, Vehicle, User, Lot, Spot, Reservation
 from datetime import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import db, Vehicle, Lot, Spot, Reservation
+from access import login_required, current_identity
+from spots import spot_index, park, finish_parking, spots_changed
+from stats import bump_user_stats
+from billing import tariff_for
+from lot_search import lot_search_index, MAX_RESULTS
+from snapshot import lot_snapshot
+from bookings import book, check_in, cancel, validate_window, pending_bookings, due_booking
 
 user_bp = Blueprint('user', __name__)
 
+PARK_ERRORS = {
+    'full': 'Parking lot full.',
+    'busy': 'Parking is busy right now, please try again.',
+}
+
+BOOKING_ERRORS = dict(PARK_ERRORS, **{
+    'bad_window': 'A booking has to end after it starts.',
+    'in_past': 'A booking cannot start in the past.',
+    'too_far': 'That start time is too far ahead to book.',
+    'too_long': 'That booking is longer than allowed.',
+    'overlap': 'You already have a booking during that time.',
+    'no_spot': 'No spot is free for that whole time.',
+    'too_early': 'Check-in for this booking has not opened yet.',
+    'expired': 'This booking has expired.',
+    'not_booked': 'This booking is no longer active.',
+    'not_found': 'Booking not found.',
+    'already_parked': 'You have already parked at a spot.',
+})
+
 @user_bp.route('/vehicle/register', methods=['GET', 'POST'])
+@login_required()
 def register_vehicle():
-    if 'user_id' not in session:
-        flash('Please log in first.')
-        return redirect(url_for('auth.login'))
-
+    user_id = current_identity().id
     if request.method == 'POST':
         v_number = request.form.get('v_number', '').strip().upper()
         details = request.form.get('details', '').strip()
@@ -18,11 +42,11 @@ def register_vehicle():
             flash('All fields are required.')
             return render_template('vehicle_register.html')
 
-        if Vehicle.query.filter_by(v_number=v_number, user_id=session['user_id']).first():
+        if Vehicle.query.filter_by(v_number=v_number, user_id=user_id).first():
             flash('Vehicle number already registered.')
             return render_template('vehicle_register.html')
         
-        vehicle = Vehicle(v_number=v_number, details=details, user_id=session['user_id'])
+        vehicle = Vehicle(v_number=v_number, details=details, user_id=user_id)
         db.session.add(vehicle)
         db.session.commit()
         flash('Vehicle registered successfully.')
@@ -32,16 +56,10 @@ def register_vehicle():
 
 
 @user_bp.route('/park', methods=['GET', 'POST'])
+@login_required()
 def park_vehicle():
-    if 'user_id' not in session:
-        flash('Please log in first.')
-        return redirect(url_for('auth.login'))
-
-    user_id = session['user_id']
-    user = User.query.get(user_id)
-    if not user:
-        flash('User not found.')
-        return redirect(url_for('auth.login'))
+    user = current_identity()
+    user_id = user.id
 
     if request.method == 'POST':
         active_reservation = Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first()
@@ -59,46 +77,89 @@ def park_vehicle():
             flash('Invalid vehicle or parking lot.')
             return redirect(url_for('user.park_vehicle'))
 
-        occupied_spots_count = Spot.query.filter_by(lot_id=lot.lot_id, status='O').count()
-
-        if occupied_spots_count >= lot.max_spots:
-            flash('Parking lot full.')
-            return redirect(url_for('user.park_vehicle'))
-
-        available_spot = Spot.query.filter_by(lot_id=lot.lot_id, status='A').first()
-        if not available_spot:
-            flash('No available parking spots found.')
+        # arriving within a booking's check-in window uses the booked spot
+        booking = due_booking(pending_bookings([vehicle.v_id]), vehicle.v_id, lot.lot_id, datetime.utcnow())
+        if booking:
+            reservation, error = check_in(booking.booking_id, user_id)
+        else:
+            reservation, error = park(user_id, vehicle.v_id, lot.lot_id)
+        if error == 'already_parked':
+            flash('You have already parked at a spot.')
+            return redirect(url_for('user_dashboard'))
+        if error:
+            flash(BOOKING_ERRORS[error])
             return redirect(url_for('user.park_vehicle'))
 
-        available_spot.status = 'O'
-
-        reservation = Reservation(
-            spot_id=available_spot.spot_id,
-            lot_id=available_spot.lot_id,   
-            user_id=user_id,
-            vehicle_id=vehicle.v_id,
-            parking_timestamp=datetime.utcnow(),
-            payment_status='Parked'
-        )
-        db.session.add(reservation)
-        db.session.commit()
-
         flash('Vehicle parked successfully.')
         return redirect(url_for('user_dashboard'))
 
-    lots = Lot.query.all()
+    pin = request.args.get('pin', '').strip()
+    if pin:
+        # nearest pin codes first, full lots left out
+        lots = lot_search_index.by_pin(pin, k=MAX_RESULTS)
+    else:
+        lots = list(lot_snapshot.get()['lots'].values())
     user_vehicles = Vehicle.query.filter_by(user_id=user_id).all()
-    return render_template('parking.html', user=user, lots=lots, vehicles=user_vehicles)
+    return render_template('parking.html', user=user, lots=lots, vehicles=user_vehicles, pin=pin)
+
 
 
+@user_bp.route('/book', methods=['GET', 'POST'])
+@login_required()
+def book_spot():
+    user = current_identity()
+    user_vehicles = Vehicle.query.filter_by(user_id=user.id).all()
+    lots = Lot.query.order_by(Lot.location_name).all()
+
+    if request.method == 'POST':
+        vehicle = Vehicle.query.filter_by(v_id=request.form.get('vehicle_id'), user_id=user.id).first()
+        lot = Lot.query.get(request.form.get('lot_id'))
+        if not vehicle or not lot:
+            flash('Invalid vehicle or parking lot.')
+            return render_template('book.html', user=user, lots=lots, vehicles=user_vehicles, form=request.form)
+        try:
+            starts_at = datetime.fromisoformat(request.form['starts_at'])
+            ends_at = datetime.fromisoformat(request.form['ends_at'])
+        except (KeyError, ValueError):
+            flash('Please enter a valid start and end time.')
+            return render_template('book.html', user=user, lots=lots, vehicles=user_vehicles, form=request.form)
+
+        error = validate_window(starts_at, ends_at)
+        if not error:
+            booking, error = book(user.id, vehicle.v_id, lot.lot_id, starts_at, ends_at)
+        if error:
+            flash(BOOKING_ERRORS[error])
+            return render_template('book.html', user=user, lots=lots, vehicles=user_vehicles, form=request.form)
+
+        flash(f"Spot {booking.spot_id} at {lot.location_name} booked from {starts_at:%Y-%m-%d %H:%M} to {ends_at:%Y-%m-%d %H:%M}.")
+        return redirect(url_for('user_dashboard'))
+
+    return render_template('book.html', user=user, lots=lots, vehicles=user_vehicles, form={})
+
+
+@user_bp.route('/booking/<int:booking_id>/check-in', methods=['POST'])
+@login_required()
+def check_in_booking(booking_id):
+    reservation, error = check_in(booking_id, current_identity().id)
+    if error:
+        flash(BOOKING_ERRORS[error])
+    else:
+        flash(f'Checked in. Your spot is {reservation.spot_id}.')
+    return redirect(url_for('user_dashboard'))
+
+
+@user_bp.route('/booking/<int:booking_id>/cancel', methods=['POST'])
+@login_required()
+def cancel_booking(booking_id):
+    error = cancel(booking_id, current_identity().id)
+    flash(BOOKING_ERRORS[error] if error else 'Booking cancelled.')
+    return redirect(url_for('user_dashboard'))
+
 
 @user_bp.route('/leave/<int:spot_id>', methods=['POST'])
+@login_required()
 def leave_spot(spot_id):
-    if 'user_id' not in session:
-        flash('Please log in first.')
-        return redirect(url_for('auth.login'))
-
-    user_id = session['user_id']
+    user_id = current_identity().id
     spot = Spot.query.get(spot_id)
     if not spot:
         flash('Invalid spot.')
@@ -114,28 +175,19 @@ def leave_spot(spot_id):
         flash('No active reservation found for this spot.')
         return redirect(url_for('user_dashboard'))
 
-    reservation.leaving_timestamp = datetime.utcnow()
-
-    duration_minutes = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 60
-    price_per_minute = spot.lot.price if spot.lot else 0
-
-    reservation.amount = round(duration_minutes * price_per_minute, 2)
-    reservation.payment_status = 'Pending'
-
-    spot.status = 'A'
+    finish_parking(reservation, tariff_for(spot.lot))
 
     db.session.commit()
+    spot_index.release(spot.lot_id, spot.spot_id)
+    spots_changed(spot.lot_id)
 
     flash('You have successfully left the parking spot.')
     return redirect(url_for('user_dashboard'))
 
 
 @user_bp.route('/pay/<int:reservation_id>', methods=['POST'])
+@login_required()
 def pay(reservation_id):
-    if 'user_id' not in session:
-        flash('Please log in first.')
-        return redirect(url_for('auth.login'))
-
     reservation = Reservation.query.get(reservation_id)
     if not reservation:
         flash('Reservation not found.')
@@ -150,6 +202,7 @@ def pay(reservation_id):
 
     if payment_status in ['Pending', 'Failed']:
         reservation.payment_status = 'Paid'
+        bump_user_stats(reservation.user_id, paid=reservation.amount or 0)
         db.session.commit()
         flash('Payment successful. Thank you!')
     else: